@@ -11,30 +11,24 @@ import sys
 import time
 import shutil
 
-from queue import Empty
-from threading import Event
+from threading import Event, Thread
 
 from PyQt6.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox
 from PyQt6.QtCore import QTimer
 from PyQt6 import uic, QtGui, QtCore
 
 from pathlib import Path
+from SurgeryViewer import VERSION
 from SurgeryViewer.core.Recorder import Recorder
+from SurgeryViewer.core.Playback import SessionPlayback
+from SurgeryViewer.ImageViewer import DisplayScheduler
+from SurgeryViewer.utils.PreviewChannel import MOSAIC_ID
 from SurgeryViewer.configs.params import *
 
 
 log = logging.getLogger('main')
 log.setLevel(logging.DEBUG)
 
-#make the logging to file
-log_path = Path('logs')
-log_path.mkdir(exist_ok=True)
-if LOG2FILE:
-    logging.basicConfig(filename=log_path / f'GUI_run{datetime.datetime.now().strftime("%m%d_%H%M")}.log', filemode='w',
-                        format='%(asctime)s - %(levelname)s - %(message)s')
-
-VERSION = "0.0.1"
-
 
 class BASLER_GUI(QMainWindow):
     def __init__(self):
@@ -43,11 +37,16 @@ class BASLER_GUI(QMainWindow):
         self.CameraSettings = None   # is loaded from the GUI_design.ui
         self.session_path = None  # path to the current session
         self.files_copied = False  # flag to check if files have been copied
-        self.timer_update_counter = 0
         self.rec_start_time = None  # time when recording started
         self.session_id = "test_sess"
-        self.multi_view_timer = None
+        self.display_scheduler = None  # renders the previews when they arrive
+        self.status_timer = None
         self.stop_event = None
+        self.calibration_thread = None
+        self.calibration_timer = None
+        self.playback = None  # SessionPlayback of a recorded session
+        self.playback_timer = None
+        self.scrub_position = None  # slider position not shown yet while scrubbing
         self.path2file = Path(__file__)
         uic.loadUi(self.path2file.parent / 'GUI' / 'GUI_design.ui', self)
         self.setWindowTitle(f'SurgeryViewer v.{VERSION}')
@@ -90,9 +89,22 @@ class BASLER_GUI(QMainWindow):
         self.MultiViewWidget.num_cameras = nr_cams
         self.CameraSettings.num_cameras = nr_cams
 
+    def camera_settings_supported(self) -> bool:
+        """exposure, gain, color modes, ... work on pylon cameras only, e.g. synthetic cameras have none"""
+        if self.basler_recorder.cam_array:
+            return True
+        self.statusbar.showMessage(f"Camera settings are not available for "
+                                   f"{self.basler_recorder.backend.name} cameras")
+        return False
+
     def connect_to_cams(self):
         self.basler_recorder.connect_cams()
 
+        if not self.basler_recorder.cam_array:
+            for c_id, cam in enumerate(self.basler_recorder.cameras):
+                self.CameraSettings.toolbox.setItemText(c_id, cam.name)
+            self.CameraSettings.setEnabled(False)
+            self.camera_settings_supported()
         for c_id, cam in enumerate(self.basler_recorder.cam_array):
             self.CameraSettings.toolbox.setItemText(c_id, cam.DeviceInfo.GetUserDefinedName())
             self.CameraSettings.exposure_spin_list[c_id].blockSignals(True)  # block triggering of events
@@ -117,9 +129,12 @@ class BASLER_GUI(QMainWindow):
         self.CameraSettings.toolbox.setCurrentIndex(0)
         self.RUNButton.setEnabled(True)
         self.RECButton.setEnabled(True)
+        self.CalibrateButton.setEnabled(True)
 
         self.ConnectButton.setEnabled(False)
 
+        if not self.basler_recorder.cam_array:
+            return  # the settings files hold pylon camera settings
         # need to connect beforehand
         try:
             self.load_settings('default_settings.settings.json')
@@ -140,19 +155,28 @@ class BASLER_GUI(QMainWindow):
         self.basler_recorder.fps = self.FrameRateSpin.value()
         self.basler_recorder.codec = self.Codec_comboBox.currentText()
         self.basler_recorder.crf = self.crf_spinBox.value()
-        self.number_cams = self.basler_recorder.cam_array.GetSize()
-        use_hw_trigger = False
+        if AUTO_SELECT_CODEC and self.basler_recorder.select_codec() is not None:
+            self.Codec_comboBox.setCurrentText(self.basler_recorder.codec)
+        max_fps = self.basler_recorder.get_codec_max_fps()
+        if max_fps is not None and max_fps < self.basler_recorder.fps:
+            answer = QMessageBox.question(self, "Codec too slow",
+                                          f"{self.basler_recorder.codec} is expected to encode only {max_fps:.1f} FPS "
+                                          f"on this machine, the recording will likely overflow. Record anyway?")
+            if answer != QMessageBox.StandardButton.Yes:
+                return
+        self.number_cams = self.basler_recorder.num_cams
+        use_hw_trigger = USE_HW_TRIGGER
 
+        self.start_display()
         self.basler_recorder.run_multi_cam_record(self.stop_event, filename=self.session_id,
                                                   use_hw_trigger=use_hw_trigger)
-
-        self.multi_view_timer = QTimer()
-        self.multi_view_timer.timeout.connect(self.update_multi_view)
-        self.multi_view_timer.start(5)  # dependign on frame rate ..
+        self.set_preview_sizes()
 
         self.STOPButton.setEnabled(True)
         self.RUNButton.setEnabled(False)
         self.RECButton.setEnabled(False)
+        self.CalibrateButton.setEnabled(False)
+        self.PlaybackButton.setEnabled(False)
 
         self.AutoExposeButton.setEnabled(False)
         self.AutoGainButton.setEnabled(False)
@@ -173,14 +197,16 @@ class BASLER_GUI(QMainWindow):
 
 
     def stop_cams(self):
+        if self.playback is not None:
+            self.stop_playback()
+            return
         if self.stop_event:
             self.stop_event.set()
         self.log.debug('Stopping grabbing')
 
 
-        if self.multi_view_timer:
-            self.multi_view_timer.stop()
-            self.multi_view_timer = None
+        if self.status_timer:
+            self.stop_display()
             if self.basler_recorder.is_recording:
                 self.basler_recorder.stop_multi_cam_record()
             else:
@@ -196,6 +222,8 @@ class BASLER_GUI(QMainWindow):
         self.Rec_status.setStyleSheet("background-color: none")
         self.RUNButton.setEnabled(True)
         self.RECButton.setEnabled(True)
+        self.CalibrateButton.setEnabled(True)
+        self.PlaybackButton.setEnabled(True)
 
         self.AutoExposeButton.setEnabled(True)
         self.AutoGainButton.setEnabled(True)
@@ -213,17 +241,17 @@ class BASLER_GUI(QMainWindow):
     def show_multiple_cam(self):
         self.stop_event = Event()
         self.basler_recorder.fps = self.FrameRateSpin.value()
-        self.number_cams = self.basler_recorder.cam_array.GetSize()
-        use_hw_trigger = False
+        self.number_cams = self.basler_recorder.num_cams
+        use_hw_trigger = USE_HW_TRIGGER
+        self.start_display()
         self.basler_recorder.run_multi_cam_show(self.stop_event, use_hw_trigger)
-
-        self.multi_view_timer = QTimer()
-        self.multi_view_timer.timeout.connect(self.update_multi_view)
-        self.multi_view_timer.start(int(1000 // (self.FrameRateSpin.value() * 1.2)))
+        self.set_preview_sizes()
 
         self.STOPButton.setEnabled(True)
         self.RUNButton.setEnabled(False)
         self.RECButton.setEnabled(False)
+        self.CalibrateButton.setEnabled(False)
+        self.PlaybackButton.setEnabled(False)
         self.FrameRateSpin.setEnabled(False)  # or implement on the go change of the framerate...
         self.Rec_status.setPixmap(QtGui.QIcon("GUI/icons/VideoCamera.svg").pixmap(64))
         # change the pixmap color to green
@@ -234,37 +262,221 @@ class BASLER_GUI(QMainWindow):
         self.rec_start_time = time.monotonic()
         # create a time that executes the trigger after 500 ms delay to make sure cameras are ready
 
-    def update_multi_view(self):
-        # call this from a thread ? or maybe not
+    def calibrate_codec(self):
+        """Test encode the codecs at the current frame rate in the background and select the one which keeps up"""
+        self.basler_recorder.fps = self.FrameRateSpin.value()
+        self.basler_recorder.crf = self.crf_spinBox.value()
+        self.CalibrateButton.setEnabled(False)
+        self.RUNButton.setEnabled(False)
+        self.RECButton.setEnabled(False)
+        self.statusbar.showMessage("Calibrating codecs, this takes a while ...")
+        self.calibration_thread = Thread(target=self.basler_recorder.select_codec, kwargs={'calibrate': True})
+        self.calibration_thread.daemon = True
+        self.calibration_thread.start()
+        self.calibration_timer = QTimer()
+        self.calibration_timer.timeout.connect(self.check_calibration)
+        self.calibration_timer.start(500)
+
+    def check_calibration(self):
+        if self.calibration_thread.is_alive():
+            return
+        self.calibration_timer.stop()
+        self.calibration_timer = None
+        self.calibration_thread = None
+        self.Codec_comboBox.setCurrentText(self.basler_recorder.codec)
+        max_fps = self.basler_recorder.get_codec_max_fps()
+        if max_fps is not None and max_fps >= self.basler_recorder.fps:
+            self.statusbar.showMessage(f"Selected {self.basler_recorder.codec} "
+                                       f"({self.basler_recorder.codec_presets.get(self.basler_recorder.codec)}), "
+                                       f"encodes up to {max_fps:.0f} FPS")
+        else:
+            self.statusbar.showMessage("No codec keeps up with the cameras, reduce the frame rate or resolution")
+        self.CalibrateButton.setEnabled(True)
+        self.RUNButton.setEnabled(True)
+        self.RECButton.setEnabled(True)
+
+    def set_preview_sizes(self):
+        """let the recorder downsample the live view to the size of the camera viewers, or pack it into the mosaic"""
+        if self.MultiViewWidget.mosaic is not None:
+            self.MultiViewWidget.mosaic.clear()
+            self.basler_recorder.preview.set_mosaic(self.MultiViewWidget.mosaic)
+            return
+        for c_id, viewer in enumerate(self.MultiViewWidget.cam_viewers[:self.number_cams]):
+            self.basler_recorder.preview.set_target_size(c_id, viewer.width(), viewer.height())
+
+    def start_display(self):
+        """render previews as the recorder delivers them, update the status bar every STATUS_INTERVAL"""
+        self.display_scheduler = DisplayScheduler(lambda c_id: self.basler_recorder.preview.get_latest(c_id),
+                                                  self.show_preview, fps=self.basler_recorder.preview_fps,
+                                                  parent=self)
+        self.basler_recorder.preview_listener = self.display_scheduler.notify
+        self.status_timer = QTimer()
+        self.status_timer.timeout.connect(self.update_status)
+        self.status_timer.start(int(STATUS_INTERVAL * 1000))
+
+    def stop_display(self):
+        self.status_timer.stop()
+        self.status_timer = None
+        self.display_scheduler.stop()
+        self.display_scheduler = None
+        self.basler_recorder.preview_listener = None
+        for viewer in self.MultiViewWidget.cam_viewers:
+            viewer.hide_hud()
+
+    def show_preview(self, c_id: int, preview):
+        if c_id == MOSAIC_ID:
+            c_id = 0  # the mosaic view is the only viewer
+        self.MultiViewWidget.cam_viewers[c_id].updateView(preview.image, preview.scale)
+
+    def update_status(self):
         if self.basler_recorder.error_event.is_set():  # if an error occured
             self.log.error('Error in Basler recorder')
             self.stop_cams()
             return
 
-        self.timer_update_counter += 1
-        if self.timer_update_counter >= 20:
-            self.update_rec_timer()  # dont call this too often ?
-            self.timer_update_counter = 0
-        try:
-            for c_id in range(self.number_cams):
-                curr_image = self.basler_recorder.multi_view_queue[c_id].get_nowait()
-                self.MultiViewWidget.cam_viewers[c_id].updateView(curr_image)
-        except Empty:
+        self.update_rec_timer()
+        if self.basler_recorder.preview is None:
             return
-
         writerstatus = f"\tVideoWriter {self.basler_recorder.video_writer_list[0].get_state()}" if len(
             self.basler_recorder.video_writer_list) >= 1 else "not recording"
 
-        display_string = ""
-        for i in range(len(self.basler_recorder.multi_view_queue)):
-            display_string += f"Q{i}: {self.basler_recorder.multi_view_queue[i].qsize()}"
-        display_string += f"{writerstatus}"
+        display_string = self.basler_recorder.preview.get_state()
+        display_string += f"{writerstatus}\t{self.MultiViewWidget.get_render_state()}"
 
         self.statusbar.showMessage(display_string)
+        if self.HudButton.isChecked():
+            self.update_hud()
 
         if not self.basler_recorder.is_recording and not self.basler_recorder.is_viewing:
             self.log.error('Basler recording stopped internally')
 
+    def update_hud(self):
+        """live status of each camera in the overlay of its view"""
+        status = self.basler_recorder.get_live_status()
+        if status is None:
+            return
+        for c_id, cam_status in enumerate(status):
+            viewer = self.MultiViewWidget.cam_viewers[0 if self.MultiViewWidget.mosaic is not None else c_id]
+            viewer.update_hud(c_id, cam_status)
+
+    def toggle_hud(self):
+        if self.HudButton.isChecked():
+            self.HudButton.setText('Hide\nHUD')
+            if self.basler_recorder.is_recording or self.basler_recorder.is_viewing:
+                self.update_hud()
+        else:
+            self.HudButton.setText('Show\nHUD')
+            for viewer in self.MultiViewWidget.cam_viewers:
+                viewer.hide_hud()
+
+    ### SESSION PLAYBACK ###
+    def open_playback(self):
+        """Play the videos of the cameras of a recorded session, synchronized by their timestamps"""
+        files = QFileDialog.getOpenFileNames(self, 'Open the videos of all cameras of a session',
+                                             str(self.basler_recorder.save_path), "Videos (*.mp4 *.mkv)")[0]
+        if not files:
+            return
+        self.stop_playback()
+        self.MultiViewWidget.num_cameras = len(files)
+        files = sorted(files)[:self.MultiViewWidget.num_cameras]
+        mosaic = self.MultiViewWidget.mosaic
+        try:
+            self.playback = SessionPlayback(files, [mosaic.tile_size] * len(files) if mosaic is not None else None)
+        except OSError as e:
+            self.log.error(f'Could not open the session: {e}')
+            QMessageBox.warning(self, "Playback", f"Could not open the session:\n{e}")
+            return
+
+        self.Playback_slider.setRange(0, int(self.playback.duration * 1000))
+        self.Playback_slider.setValue(0)
+        self.PlayPauseButton.setEnabled(True)
+        self.Playback_slider.setEnabled(True)
+        self.PlaySpeed_spinBox.setEnabled(True)
+        self.STOPButton.setEnabled(True)
+        self.RUNButton.setEnabled(False)
+        self.RECButton.setEnabled(False)
+        self.CalibrateButton.setEnabled(False)
+
+        self.playback.set_speed(self.PlaySpeed_spinBox.value())
+        self.playback.seek(0.0)
+        self.playback.play()
+        self.PlayPauseButton.setText('Pause')
+        self.playback_timer = QTimer()
+        self.playback_timer.timeout.connect(self.update_playback)
+        self.playback_timer.start(max(int(1000 // self.playback.fps), 1))
+        self.statusbar.showMessage(f"Playing {len(files)} videos ({self.playback.duration:.0f}s)")
+
+    def update_playback(self):
+        if self.Playback_slider.isSliderDown():
+            # scrubbing, at most one preview per tick however often the slider moved
+            if self.scrub_position is not None:
+                self.show_playback_frames(self.playback.preview(self.scrub_position))
+                self.scrub_position = None
+            return
+        self.show_playback_frames(self.playback.update())
+        self.Playback_slider.blockSignals(True)
+        self.Playback_slider.setValue(int(self.playback.position * 1000))
+        self.Playback_slider.blockSignals(False)
+        if not self.playback.playing:
+            self.PlayPauseButton.setText('Play')
+
+    def show_playback_frames(self, images: list):
+        mosaic = self.MultiViewWidget.mosaic
+        if mosaic is not None:
+            changed = False
+            for c_id, (stream, image) in enumerate(zip(self.playback.streams, images)):
+                if image is not None:
+                    mosaic.place(c_id, image, stream.scale)
+                    changed = True
+            if changed:
+                self.MultiViewWidget.cam_viewers[0].updateView(mosaic.snapshot())
+        else:
+            for viewer, stream, image in zip(self.MultiViewWidget.cam_viewers, self.playback.streams, images):
+                if image is not None:
+                    viewer.updateView(image, stream.scale)
+        self.Playback_label.setText(f"{self.playback.position:.1f}/{self.playback.duration:.0f}s")
+
+    def toggle_playback(self):
+        if self.playback.playing:
+            self.playback.pause()
+            self.PlayPauseButton.setText('Play')
+        else:
+            self.playback.play()
+            self.PlayPauseButton.setText('Pause')
+
+    def scrub_playback(self, value: int):
+        """keyframes at the slider position are shown by update_playback while it is dragged"""
+        self.scrub_position = value / 1000
+
+    def seek_playback(self):
+        self.scrub_position = None
+        self.playback.seek(self.Playback_slider.value() / 1000)
+
+    def set_playback_speed(self, speed: float):
+        if self.playback is not None:
+            self.playback.set_speed(speed)
+
+    def stop_playback(self):
+        if self.playback_timer:
+            self.playback_timer.stop()
+            self.playback_timer = None
+        if self.playback is None:
+            return
+        self.playback.stop()
+        self.playback = None
+        self.PlayPauseButton.setEnabled(False)
+        self.Playback_slider.setEnabled(False)
+        self.PlaySpeed_spinBox.setEnabled(False)
+        self.Playback_label.setText('')
+        self.STOPButton.setEnabled(False)
+        if self.basler_recorder.cams_connected:
+            self.RUNButton.setEnabled(True)
+            self.RECButton.setEnabled(True)
+            self.CalibrateButton.setEnabled(True)
+        if self.basler_recorder.num_cams > 0:
+            self.MultiViewWidget.num_cameras = self.basler_recorder.num_cams
+        self.statusbar.showMessage("Stopped playback")
+
     def update_rec_timer(self):
         current_run_time = time.monotonic() - self.rec_start_time
         if current_run_time >= 60:
@@ -286,6 +498,8 @@ class BASLER_GUI(QMainWindow):
                                     buttons=QMessageBox.StandardButton.Ok)
             return
 
+        if not self.camera_settings_supported():
+            return
         # get active camera settings.. save those to json with cam name
         cam_lib = {}
         for cam in self.basler_recorder.cam_array:
@@ -293,7 +507,8 @@ class BASLER_GUI(QMainWindow):
             cam_lib.update(**cam_settings)
 
         cam_lib.update(**{'save_path': self.basler_recorder.save_path, 'fps': self.FrameRateSpin.value(),
-                          "HW_trigg": False, 'codec': self.Codec_comboBox.currentText(),
+                          "HW_trigg": USE_HW_TRIGGER, 'codec': self.Codec_comboBox.currentText(),
+                          'preset': self.basler_recorder.codec_presets.get(self.Codec_comboBox.currentText()),
                           "crf": self.crf_spinBox.value()})
 
         # open file dialog for where to save
@@ -318,6 +533,8 @@ class BASLER_GUI(QMainWindow):
                                     "Not connected to cameras, cant load settings",
                                     buttons=QMessageBox.StandardButton.Ok)
             return
+        if not self.camera_settings_supported():
+            return
 
         if file is None or not file:
             settings_file = QFileDialog.getOpenFileName(self, 'Open settings file', "",
@@ -327,17 +544,13 @@ class BASLER_GUI(QMainWindow):
             else:
                 return
 
-        with open(file, 'r') as fi:
-            cam_lib = json.load(fi)
+        cam_lib = self.basler_recorder.load_settings(file)
 
         for c_id, cam in enumerate(self.basler_recorder.cam_array):
             try:
                 settings = cam_lib[cam.DeviceInfo.GetUserDefinedName()]
             except KeyError:
-                self.log.info(f'No settings found for cam: {cam.DeviceInfo.GetUserDefinedName()} '
-                              f'with SN: {cam.DeviceInfo.GetSerialNumber()}')
                 continue
-            self.basler_recorder.set_cam_settings(cam, settings)
             self.CameraSettings.exposure_spin_list[c_id].blockSignals(True)
             self.CameraSettings.gain_spin_list[c_id].blockSignals(True)
             self.CameraSettings.color_mode_list[c_id].blockSignals(True)
@@ -351,6 +564,8 @@ class BASLER_GUI(QMainWindow):
         try:
             self.crf_spinBox.setValue(cam_lib['crf'])
             self.Codec_comboBox.setCurrentText(cam_lib['codec'])
+            if 'preset' in cam_lib:
+                self.basler_recorder.codec_presets[cam_lib['codec']] = cam_lib['preset']
             self.FrameRateSpin.setValue(cam_lib['fps'])
             self.set_save_path(cam_lib['save_path'])
             #self.basler_recorder.save_path = cam_lib['save_path']
@@ -376,6 +591,8 @@ class BASLER_GUI(QMainWindow):
     # those functions are now blocking ? maybe make sure they r not ? create threads for actual adjustments ?
     def auto_expose(self):
         """Runs autoexposure routine for given/all camera"""
+        if not self.camera_settings_supported():
+            return
         if self.All_cams_checkBox.isChecked():
             for current_camid in range(len(self.basler_recorder.cam_array)):
                 final_exp = self.basler_recorder.run_auto_exposure(current_camid)
@@ -388,6 +605,8 @@ class BASLER_GUI(QMainWindow):
 
     def auto_gain(self):
         """Runs autogain routine for given/all camera"""
+        if not self.camera_settings_supported():
+            return
         if self.All_cams_checkBox.isChecked():
             for current_camid in range(len(self.basler_recorder.cam_array)):
                 final_gain = self.basler_recorder.run_auto_gain(current_camid)
@@ -399,6 +618,8 @@ class BASLER_GUI(QMainWindow):
 
     def white_balance(self):
         """Runs auto white balance routine for given/all camera"""
+        if not self.camera_settings_supported():
+            return
         if self.All_cams_checkBox.isChecked():
             for current_camid in range(len(self.basler_recorder.cam_array)):
                 self.basler_recorder.run_white_balance(current_camid)
@@ -408,6 +629,8 @@ class BASLER_GUI(QMainWindow):
 
     def set_gain_exposure(self):
         """set the gain and exposure time for the current camera"""
+        if not self.camera_settings_supported():
+            return
         current_camid = self.get_current_tab()
         exp_time = self.CameraSettings.exposure_spin_list[current_camid].value()
         gain = self.CameraSettings.gain_spin_list[current_camid].value()
@@ -415,6 +638,8 @@ class BASLER_GUI(QMainWindow):
 
     def set_color_mode(self, color_mode: str):
         """set the colormode for the current camera, this is poorly used by ImageViewer.py"""
+        if not self.camera_settings_supported():
+            return
         current_camid = self.get_current_tab()
         self.basler_recorder.set_color_mode(current_camid, color_mode)
         # exp_time = self.CameraSettings.exposure_spin_list[current_camid]
@@ -423,6 +648,8 @@ class BASLER_GUI(QMainWindow):
         """
         Flip image on x axis
         """
+        if not self.camera_settings_supported():
+            return
         current_camid = self.get_current_tab()
         self.basler_recorder.flip_image_x(current_camid)
 
@@ -430,6 +657,8 @@ class BASLER_GUI(QMainWindow):
         """
         Flip image on y axis
         """
+        if not self.camera_settings_supported():
+            return
         current_camid = self.get_current_tab()
         self.basler_recorder.flip_image_y(current_camid)
 
@@ -446,18 +675,24 @@ class BASLER_GUI(QMainWindow):
         self.FlipXButton.clicked.connect(self.flip_x)
         self.FlipYButton.clicked.connect(self.flip_y)
         self.Save_pathButton.clicked.connect(self.set_save_path)
+        self.CalibrateButton.clicked.connect(self.calibrate_codec)
+        self.PlaybackButton.clicked.connect(self.open_playback)
+        self.PlayPauseButton.clicked.connect(self.toggle_playback)
+        self.Playback_slider.sliderMoved.connect(self.scrub_playback)
+        self.Playback_slider.sliderReleased.connect(self.seek_playback)
+        self.PlaySpeed_spinBox.valueChanged.connect(self.set_playback_speed)
 
         self.markerAddButton.clicked.connect(self.add_markers)
         self.markerClearButton.clicked.connect(self.clear_markers)
         self.GridButton.clicked.connect(self.toggle_grid)
+        self.HudButton.clicked.connect(self.toggle_hud)
         self.Grid_slider.valueChanged.connect(self.change_grid_size)
 
         self.ScreenshotButton.clicked.connect(self.take_screenshot)
 
     def take_screenshot(self):
-        for viewer in self.MultiViewWidget.cam_viewers:
-            image = viewer.image_view.getProcessedImage()
-            view_box = viewer.image_view.getView()
+        for c_id, viewer in enumerate(self.MultiViewWidget.cam_viewers):
+            view_box = viewer.view_box
 
             # Get the scene of the view box (which includes all the items)
             scene = view_box.scene()
@@ -473,7 +708,7 @@ class BASLER_GUI(QMainWindow):
             painter = QtGui.QPainter(image)
             scene.render(painter, QtCore.QRectF(image.rect()), rect)
             painter.end()
-            save_path = f'{self.session_id}{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.png'
+            save_path = f'{self.session_id}{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}_cam{c_id}.png'
             image.save(save_path, "PNG")
 
     def add_markers(self):
@@ -504,6 +739,7 @@ class BASLER_GUI(QMainWindow):
     def app_is_exiting(self):
         """Routine to be run when the app is exiting, cleanup and release of resources"""
         # check if recording is running stop if does.
+        self.stop_playback()
         self.stop_cams()  # stop any grabbing still ongoing
         self.basler_recorder.disconnect_cams()  # close and release cameras
 
@@ -531,7 +767,17 @@ class BASLER_GUI(QMainWindow):
         super(BASLER_GUI, self).closeEvent(event)
 
 
+def setup_file_logging():
+    """log to logs/GUI_run<date>.log, called when the GUI starts instead of at import"""
+    log_path = Path('logs')
+    log_path.mkdir(exist_ok=True)
+    if LOG2FILE:
+        logging.basicConfig(filename=log_path / f'GUI_run{datetime.datetime.now().strftime("%m%d_%H%M")}.log',
+                            filemode='w', format='%(asctime)s - %(levelname)s - %(message)s')
+
+
 def start_gui():
+    setup_file_logging()
     app = QApplication([])
     win = BASLER_GUI()
     win.show()
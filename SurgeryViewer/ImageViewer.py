@@ -12,16 +12,36 @@ import numpy as np
 import cv2
 import time
 
+from SurgeryViewer.configs.params import MAX_CAMERAS, MOSAIC_THRESHOLD
+from SurgeryViewer.utils.MosaicCanvas import MosaicCanvas
+
+
+HUD_STYLE = 'QLabel {{background-color: rgba(0, 0, 0, 140); color: {color}; padding: 2px}}'
+
+
+def format_hud(status: dict) -> str:
+    """text of the live overlay of a camera from its LiveStatus, stages not running are left out"""
+    lines = [f"Acq {status['grab_fps']:.1f} FPS  skipped {status['skipped']}"]
+    if status['queue_fill'] is not None:
+        lines.append(f"Queue {100 * status['queue_fill']:.0f}%  Enc {status['encode_fps']:.1f} FPS")
+    if status['display_fps'] is not None:
+        age = f"  age {1000 * status['frame_age']:.0f} ms" if status['frame_age'] is not None else ''
+        lines.append(f"Disp {status['display_fps']:.1f} FPS{age}")
+    return '\n'.join(lines)
+
 
 class MultiCameraViewer(QWidget):
     """
     A widget that displays the images from multiple cameras.
+    Up to MOSAIC_THRESHOLD cameras get a view each, more are packed into one MosaicCanvas shown by a single MosaicView
+    (the only entry of cam_viewers then).
     """
     def __init__(self, parent=None, num_cameras=4):
         super().__init__(parent)
         self.grid = None
         self._num_cameras = num_cameras
         self.cam_viewers = []
+        self.mosaic = None  # MosaicCanvas of all cameras in mosaic mode
         self.parent = parent
         self.init_ui()
         self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
@@ -32,11 +52,11 @@ class MultiCameraViewer(QWidget):
 
     @num_cameras.setter
     def num_cameras(self, value):
-        if 0 < value <= 9:
+        if 0 < value <= MAX_CAMERAS:
             self._num_cameras = value
 
         else:
-            self._num_cameras = 9
+            self._num_cameras = MAX_CAMERAS
         self.change_ui()
 
     def init_ui(self):
@@ -47,15 +67,7 @@ class MultiCameraViewer(QWidget):
         # self.grid.setContentsMargins(0, 0, 0, 0)
         self.setLayout(self.grid)
 
-        # create a RawImageWidget for each camera and add it to the layout
-        if self.num_cameras <= 4:
-            step = 2
-        else:
-            step = 3
-        for i in range(self.num_cameras):
-            widget = ImageView_camera(self.parent)
-            self.cam_viewers.append(widget)
-            self.grid.addWidget(widget, i // step, i % step)
+        self.add_viewers()
 
         self.show()
         self.grid.setSpacing(0)
@@ -64,6 +76,17 @@ class MultiCameraViewer(QWidget):
         for view in self.cam_viewers:
             self.grid.removeWidget(view)
         self.cam_viewers = []
+        self.add_viewers()
+
+    def add_viewers(self):
+        """create a view for each camera, or a single mosaic view for many cameras, and add them to the layout"""
+        if self.num_cameras > MOSAIC_THRESHOLD:
+            self.mosaic = MosaicCanvas(self.num_cameras)
+            widget = MosaicView(self.mosaic, self.parent)
+            self.cam_viewers.append(widget)
+            self.grid.addWidget(widget, 0, 0)
+            return
+        self.mosaic = None
         if self.num_cameras <= 4:
             step = 2
         else:
@@ -73,8 +96,72 @@ class MultiCameraViewer(QWidget):
             self.cam_viewers.append(widget)
             self.grid.addWidget(widget, i // step, i % step)
 
+    def get_render_state(self) -> str:
+        """mean time per image update of the camera views"""
+        times = [viewer.render_time for viewer in self.cam_viewers if viewer.render_time is not None]
+        if not times:
+            return ''
+        return f'Render {1000 * sum(times) / len(times):.1f} ms/frame'
+
+
+class DisplayScheduler(QtCore.QObject):
+    """
+    Renders the newest previews of the cameras when they arrive instead of polling on a fast timer.
+    notify(c_id) may be called from any thread (e.g. as on_ready of the PreviewChannel), it marks the camera and
+    schedules one render tick, at most one per 1/fps s. A tick renders every marked camera once with its newest frame,
+    so cameras are updated at their own rate and nothing runs while no frames arrive.
+    """
+    frame_ready = QtCore.pyqtSignal(int)
+
+    def __init__(self, fetch, render, fps: float = 30, parent=None):
+        """
+        :param fetch: fetch(c_id) -> newest frame of the camera or None
+        :param render: render(c_id, frame) shows the frame
+        :param fps: maximal rate of render ticks
+        """
+        super().__init__(parent)
+        self.fetch = fetch
+        self.render = render
+        self.period = 1.0 / fps
+        self._dirty = set()
+        self._last_tick = 0.0
+        self._active = True
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._tick)
+        # queued to the GUI thread when emitted from the preview thread
+        self.frame_ready.connect(self._on_frame_ready)
+
+    def notify(self, c_id: int):
+        self.frame_ready.emit(c_id)
+
+    def _on_frame_ready(self, c_id: int):
+        if not self._active:
+            return
+        self._dirty.add(c_id)
+        if not self._timer.isActive():
+            wait = self.period - (time.monotonic() - self._last_tick)
+            self._timer.start(max(0, int(wait * 1000)))
+
+    def _tick(self):
+        self._last_tick = time.monotonic()
+        dirty, self._dirty = self._dirty, set()
+        for c_id in sorted(dirty):
+            frame = self.fetch(c_id)
+            if frame is not None:
+                self.render(c_id, frame)
+
+    def stop(self):
+        self._active = False
+        self._timer.stop()
+        self._dirty.clear()
+
 
 class ImageView_camera(QWidget):
+    """
+    View of one camera: a bare ImageItem in a ViewBox with marker and grid overlays. Images are used in row-major
+    order as they come from the cameras (no transposed copy) and each update only replaces the image data of the item.
+    """
     def __init__(self, parent=None):
         super(ImageView_camera, self).__init__(parent)
 
@@ -82,75 +169,97 @@ class ImageView_camera(QWidget):
         layout = QVBoxLayout(self)
         layout.setContentsMargins(0, 0, 0, 0)
         #layout.setSpacing(0)
-        # Create a RawImageWidget
-        self.image_view = pg.ImageView()
-        self.image_view.ui.histogram.hide()  # Hide the histogram if not needed
-        self.image_view.ui.roiBtn.hide()     # Hide ROI buttons if not needed
-        self.image_view.ui.menuBtn.hide()    # Hide the menu button if not needed
-        self.image_view.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
-
-        # Add the RawImageWidget to the layout
-        layout.addWidget(self.image_view)
+        self.graphics_view = GraphicsView()
+        self.view_box = pg.ViewBox(lockAspect=True, invertY=True, enableMenu=False)
+        self.graphics_view.setCentralItem(self.view_box)
+        self.graphics_view.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+        self.image_item = ImageItem(axisOrder='row-major', levels=(0, 255))
+        self.view_box.addItem(self.image_item)
+        layout.addWidget(self.graphics_view)
+
         self.marker_scatter = pg.ScatterPlotItem(pen=pg.mkPen(None), symbol='o', size=10, brush='r')
-        self.image_view.getView().addItem(self.marker_scatter)
+        self.view_box.addItem(self.marker_scatter)
 
         self.grid_item = pg.GridItem(pen=pg.mkPen(color='w', width=2))
 
-        self.image_view.getView().addItem(self.grid_item)
+        self.view_box.addItem(self.grid_item)
 
         self.grid_item.setTickSpacing(x=[40], y=[40])
         self.grid_item.setVisible(False)
 
-        self.image_view.setImage(np.random.randint(0, 255, (128, 128), np.uint8))
+        self.image_item.setImage(np.random.randint(0, 255, (128, 128), np.uint8), autoLevels=False)
+        self.view_box.autoRange()
         self.marker_points = []
         self.counter = 0
         self.add_markers_toggle = False
+        self._format = None  # (height, width) and scale of the shown images, the view is fitted when they change
+        self.render_time = None  # s per update, moving average
 
-    def updateView(self, image):
+        # live status overlay, on top of the view so it does not zoom with the image
+        self.hud_label = QLabel(self.graphics_view)
+        self.hud_label.move(4, 4)
+        self.hud_label.setVisible(False)
+        self._hud_behind = None
+
+    def updateView(self, image, scale=1):
         """
-        Set the image to be displayed in the RawImageWidget.
-        image: numpy array containing the image data
+        Set the image to be displayed.
+        image: numpy array containing the image data, (height, width) or (height, width, 3)
+        scale: downsampling factor of the image, keeps markers and grid in camera pixel coordinates
         """
-        # rotate img such that if it 2 dimentional it s transposed if 3 dimentional only first 2 axis are transposed
-        if self.counter == 0:
-            autoRange = True
-        else:
-            autoRange = False
-        self.counter +=1
+        start = time.perf_counter()
         try:
-            if len(image.shape) == 3:
-                self.image_view.setImage(image.transpose(1, 0, 2), autoRange=autoRange, autoLevels=False)
-            else:
-                self.image_view.setImage(image.T, autoRange=autoRange, autoLevels=False)
+            self.image_item.setImage(image, autoLevels=False)
         except ValueError:
             print("Image could not be displayed. this format is not implemented")
+            return
+        if self._format != (image.shape[:2], scale):
+            self.image_item.setTransform(QtGui.QTransform.fromScale(scale, scale))
+            self.view_box.autoRange()
+            self._format = (image.shape[:2], scale)
+        self.counter += 1
+        duration = time.perf_counter() - start
+        self.render_time = duration if self.render_time is None else 0.9 * self.render_time + 0.1 * duration
 
     def mousePressEvent(self, event):
         # Check if left mouse button is clicked
         if self.add_markers_toggle:
             if event.button() == QtCore.Qt.MouseButton.LeftButton:
                 # Get scene position from the event
-                pos = event.position()
+                pos = self.graphics_view.mapFrom(self, event.position().toPoint())
                 # Map the position to image coordinates
-                img_coord = self.image_view.getImageItem().mapFromScene(pos)
-                x = img_coord.x()
-                y = img_coord.y()
-
-                self.marker_points.append({
-                    'pos': (x, y),
-                    'size': 10,
-                    'symbol': 'o',
-                    'brush': pg.mkBrush(255, 0, 0)
-                })            # Update the ScatterPlotItem with the new points
-                self.marker_scatter.setData(self.marker_points)
+                img_coord = self.view_box.mapSceneToView(self.graphics_view.mapToScene(pos))
+                self.add_marker(img_coord.x(), img_coord.y())
 
         # Call the base class implementation
         super().mousePressEvent(event)
 
+    def add_marker(self, x, y):
+        """marker at x, y in view coordinates (camera pixels)"""
+        self.marker_points.append({
+            'pos': (x, y),
+            'size': 10,
+            'symbol': 'o',
+            'brush': pg.mkBrush(255, 0, 0)
+        })            # Update the ScatterPlotItem with the new points
+        self.marker_scatter.setData(self.marker_points)
+
     def remove_markers(self):
         self.marker_scatter.setData([])
         self.marker_points = []
 
+    def update_hud(self, c_id: int, status: dict):
+        """show the live status of the camera (see LiveStatus.camera) in the overlay, red if it falls behind"""
+        if self._hud_behind != status['behind']:
+            self.hud_label.setStyleSheet(HUD_STYLE.format(color='red' if status['behind'] else 'white'))
+            self._hud_behind = status['behind']
+        self.hud_label.setText(format_hud(status))
+        self.hud_label.adjustSize()
+        self.hud_label.setVisible(True)
+
+    def hide_hud(self):
+        self.hud_label.setVisible(False)
+
     def toggle_grid_visibility(self):
         self.grid_item.setVisible(not self.grid_item.isVisible())
 
@@ -164,6 +273,49 @@ class ImageView_camera(QWidget):
         #self.grid_size_label.setText(f"Grid Size: {self.grid_spacing}")
 
 
+class MosaicView(ImageView_camera):
+    """
+    View of a MosaicCanvas of many cameras. Clicks are mapped back to the camera below them, markers are kept per
+    camera in camera pixel coordinates (camera_markers) and drawn on the camera's tile.
+    """
+    def __init__(self, mosaic: MosaicCanvas, parent=None):
+        super(MosaicView, self).__init__(parent)
+        self.mosaic = mosaic
+        self.camera_markers = {}  # camera index -> [(x, y)] in camera pixels
+        self.hud_items = {}  # camera index -> TextItem with its live status at the corner of its tile
+        self.log = logging.getLogger('MosaicView')
+
+    def add_marker(self, x, y):
+        """marker at x, y in canvas coordinates, ignored outside of the camera images"""
+        location = self.mosaic.locate(x, y)
+        if location is None:
+            return
+        c_id, cam_x, cam_y = location
+        self.camera_markers.setdefault(c_id, []).append((cam_x, cam_y))
+        self.log.debug(f'Marker on camera {c_id} at ({cam_x:.0f}, {cam_y:.0f})')
+        super(MosaicView, self).add_marker(x, y)
+
+    def remove_markers(self):
+        super(MosaicView, self).remove_markers()
+        self.camera_markers = {}
+
+    def update_hud(self, c_id: int, status: dict):
+        """show the live status of a camera on its tile"""
+        item = self.hud_items.get(c_id)
+        if item is None:
+            item = pg.TextItem(anchor=(0, 0), fill=pg.mkBrush(0, 0, 0, 140))
+            item.setPos(*self.mosaic.tile_origin(c_id))
+            self.view_box.addItem(item)
+            self.hud_items[c_id] = item
+        item.setColor('r' if status['behind'] else 'w')
+        item.setText(format_hud(status))
+        item.setVisible(True)
+
+    def hide_hud(self):
+        for item in self.hud_items.values():
+            item.setVisible(False)
+
+
 class SingleCamViewer(QDialog):
     def __init__(self, parent, cam_name):
         super(SingleCamViewer, self).__init__(parent)
@@ -294,11 +446,11 @@ class CameraSettingsTab(QWidget):
 
     @num_cameras.setter
     def num_cameras(self, value):
-        if 0 < value <= 9:
+        if 0 < value <= MAX_CAMERAS:
             self._num_cameras = value
 
         else:
-            self._num_cameras = 9
+            self._num_cameras = MAX_CAMERAS
         self.change_ui()
 
     def init_ui(self):
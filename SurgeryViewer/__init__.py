@@ -4,6 +4,13 @@ SurgeryViewer
 A module for Recording Videos using Basler Cameras
 
 """
-from SurgeryViewer.GUI_run import VERSION
+VERSION = "0.0.1"
 __version__ = VERSION
-from SurgeryViewer.GUI_run import start_gui as startRecorder
\ No newline at end of file
+
+
+def __getattr__(name):
+    # the GUI (PyQt6, pyqtgraph) is only imported when it is used, so headless tools stay lightweight
+    if name == 'startRecorder':
+        from SurgeryViewer.GUI_run import start_gui
+        return start_gui
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
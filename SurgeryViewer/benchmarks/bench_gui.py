@@ -0,0 +1,146 @@
+"""
+Render throughput of the camera views with synthetic frames
+
+Drives a MultiCameraViewer as fast as it renders: every tick updates all camera views with a new preview (downsampled
+to the view size like the live view) and lets Qt paint them. Runs without a display on the offscreen Qt platform.
+Reports the achieved render FPS per camera, the latency of single view updates and of whole ticks, and the cpu time
+of the GUI thread, as json lines:
+
+    python -m SurgeryViewer.benchmarks.bench_gui --cams 1 2 4 9 16 --modes mono rgb --duration 5 --out gui.jsonl
+
+With more than MOSAIC_THRESHOLD cameras the views are a mosaic. Packing the frames into the mosaic runs on the
+preview thread in the GUI, it is reported separately (mosaic_place_ms) and not counted as GUI thread time.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from SurgeryViewer.benchmarks.bench_record import machine_info, parse_size
+from SurgeryViewer.configs.params import MOSAIC_THRESHOLD
+
+FRAMES_PER_CAMERA = 4  # distinct frames cycled through, so no update shows the image it replaces
+
+
+def percentiles(values: list) -> dict:
+    """p50/p90/p99/max in ms of durations in s"""
+    if not values:
+        return {}
+    ms = np.asarray(values) * 1e3
+    return {'p50': float(np.percentile(ms, 50)), 'p90': float(np.percentile(ms, 90)),
+            'p99': float(np.percentile(ms, 99)), 'max': float(ms.max())}
+
+
+def synthetic_previews(preview_channel, cams: int, width: int, height: int, mode: str) -> list:
+    """FRAMES_PER_CAMERA previews per camera, noise of the camera size downsampled like the live view"""
+    rng = np.random.default_rng(0)
+    shape = (height, width) if mode == 'mono' else (height, width, 3)
+    return [[preview_channel.downsample(c_id, rng.integers(0, 256, shape, dtype=np.uint8))
+             for _ in range(FRAMES_PER_CAMERA)] for c_id in range(cams)]
+
+
+def run_config(app, config: dict) -> dict:
+    """render config['duration'] s with config['cams'] cameras"""
+    from SurgeryViewer.ImageViewer import MultiCameraViewer
+    from SurgeryViewer.utils.PreviewChannel import PreviewChannel
+
+    viewer = MultiCameraViewer(num_cameras=config['cams'])
+    viewer.resize(*config['viewer_size'])
+    viewer.show()
+    app.processEvents()
+
+    preview_channel = PreviewChannel(config['cams'])
+    mosaic = viewer.mosaic
+    if mosaic is not None:
+        preview_channel.set_mosaic(mosaic)
+    else:
+        for c_id, cam_viewer in enumerate(viewer.cam_viewers):
+            preview_channel.set_target_size(c_id, cam_viewer.width(), cam_viewer.height())
+    previews = synthetic_previews(preview_channel, config['cams'], config['width'], config['height'], config['mode'])
+
+    update_times, tick_times, place_times = [], [], []
+    gui_cpu = 0.0
+    ticks = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < config['duration']:
+        frame = ticks % FRAMES_PER_CAMERA
+        if mosaic is not None:
+            place_start = time.perf_counter()
+            for c_id in range(config['cams']):
+                mosaic.place(c_id, previews[c_id][frame].image, previews[c_id][frame].scale)
+            place_times.append(time.perf_counter() - place_start)
+            updates = [(viewer.cam_viewers[0], None)]
+        else:
+            updates = [(cam_viewer, previews[c_id][frame]) for c_id, cam_viewer in enumerate(viewer.cam_viewers)]
+
+        cpu_start = time.thread_time()
+        tick_start = time.perf_counter()
+        for cam_viewer, preview in updates:
+            update_start = time.perf_counter()
+            if preview is None:
+                cam_viewer.updateView(mosaic.snapshot())
+            else:
+                cam_viewer.updateView(preview.image, preview.scale)
+            update_times.append(time.perf_counter() - update_start)
+        app.processEvents()  # paints the views
+        tick_times.append(time.perf_counter() - tick_start)
+        gui_cpu += time.thread_time() - cpu_start
+        ticks += 1
+    elapsed = time.perf_counter() - start
+
+    viewer.close()
+    viewer.deleteLater()
+    app.processEvents()
+    preview_shape = previews[0][0].image.shape
+    return {'ticks': ticks,
+            'elapsed_s': elapsed,
+            'render_fps': ticks / elapsed,  # frames shown per camera and s
+            'frames_per_s': ticks * config['cams'] / elapsed,
+            'preview_size': [preview_shape[1], preview_shape[0]],
+            'update_ms': percentiles(update_times),
+            'tick_ms': percentiles(tick_times),
+            'gui_cpu_s': gui_cpu,
+            'gui_cpu_load': gui_cpu / elapsed,  # fraction of one core used by the GUI thread
+            'mosaic_place_ms': percentiles(place_times) if mosaic is not None else None}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Render benchmark of the camera views with synthetic frames')
+    parser.add_argument('--cams', type=int, nargs='+', default=[1, 2, 4, 9, 16], help='numbers of cameras')
+    parser.add_argument('--sizes', nargs='+', default=['1280x1024'], help='camera resolutions as WIDTHxHEIGHT')
+    parser.add_argument('--modes', nargs='+', default=['mono', 'rgb'], choices=['mono', 'rgb'],
+                        help='color modes of the frames')
+    parser.add_argument('--viewer-size', default='1141x771', help='size of the multi camera view as WIDTHxHEIGHT')
+    parser.add_argument('--duration', type=float, default=5, help='render time per configuration in s')
+    parser.add_argument('--out', default=None, help='append results to this json lines file instead of stdout')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')  # before Qt is loaded, no display needed
+    from PyQt6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    out = open(args.out, 'a') if args.out else sys.stdout
+
+    def emit(record: dict):
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+
+    emit(dict(machine_info(), qt_platform=app.platformName()))
+    for cams, size, mode in itertools.product(args.cams, args.sizes, args.modes):
+        width, height = parse_size(size)
+        config = {'cams': cams, 'width': width, 'height': height, 'mode': mode,
+                  'viewer_size': parse_size(args.viewer_size), 'duration': args.duration}
+        result = run_config(app, config)
+        emit(dict(type='run', cams=cams, width=width, height=height, mode=mode, mosaic=cams > MOSAIC_THRESHOLD,
+                  **result))
+    if out is not sys.stdout:
+        out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Import time budget of the package
+
+Every module is imported in a fresh interpreter, so nothing is cached between the measurements. Reports the median
+import time and fails (exit code 1) if a module exceeds its budget or loads a backend it should not need:
+
+    python -m SurgeryViewer.benchmarks.bench_import [--repeat 5] [--json]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ('PyQt6', 'pyqtgraph', 'pypylon', 'vidgear', 'cv2')
+
+# module: (budget in ms, heavy modules it must not load)
+BUDGETS = {
+    'SurgeryViewer': (50, HEAVY_MODULES),
+    'SurgeryViewer.configs.params': (50, HEAVY_MODULES),
+    'SurgeryViewer.configs.camera_enums': (50, HEAVY_MODULES),
+    'SurgeryViewer.utils.TimestampSidecar': (300, HEAVY_MODULES),
+    'SurgeryViewer.utils.FrameJournal': (300, HEAVY_MODULES),
+    'SurgeryViewer.core.Metrics': (50, HEAVY_MODULES),
+    'SurgeryViewer.utils.VideoReaderFast': (600, ('PyQt6', 'pyqtgraph', 'pypylon', 'vidgear')),
+    'SurgeryViewer.utils.VideoWriterFast_gear': (600, ('PyQt6', 'pyqtgraph', 'pypylon', 'vidgear')),
+    'SurgeryViewer.utils.raw_convert': (600, ('PyQt6', 'pyqtgraph', 'pypylon', 'vidgear')),
+    'SurgeryViewer.core.Recorder': (1500, ('PyQt6', 'pyqtgraph', 'vidgear')),
+    'SurgeryViewer.record_cli': (1500, ('PyQt6', 'pyqtgraph', 'vidgear')),
+}
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+duration = time.perf_counter() - start
+print(json.dumps({{'ms': duration * 1e3, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, repeat: int = 5) -> dict:
+    """median import time of module in a fresh interpreter and the heavy modules it pulled in"""
+    times, loaded = [], []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return {'module': module, 'error': result.stderr.strip().splitlines()[-1]}
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(probe['ms'])
+        loaded = probe['loaded']
+    return {'module': module, 'ms': statistics.median(times), 'loaded': loaded}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Measure the import time of the SurgeryViewer modules')
+    parser.add_argument('--repeat', type=int, default=5, help='imports per module, the median is reported')
+    parser.add_argument('--json', action='store_true', help='print one json line per module')
+    parser.add_argument('modules', nargs='*', help='modules to measure, defaults to all with a budget')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in args.modules or BUDGETS:
+        budget, forbidden = BUDGETS.get(module, (None, ()))
+        result = measure(module, args.repeat)
+        result['budget_ms'] = budget
+        if 'error' in result:
+            # a missing optional dependency is not a budget violation
+            result['ok'] = None
+        else:
+            result['ok'] = (budget is None or result['ms'] <= budget) and \
+                           not any(m in forbidden for m in result['loaded'])
+            failed |= not result['ok']
+        if args.json:
+            print(json.dumps(result))
+        elif result['ok'] is None:
+            print(f"{module:45s} skipped: {result['error']}")
+        else:
+            print(f"{module:45s} {result['ms']:8.1f} ms (budget {budget} ms) "
+                  f"loads {', '.join(result['loaded']) or '-'} {'OK' if result['ok'] else 'FAIL'}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+End-to-end throughput of the record path with synthetic cameras
+
+Sweeps camera count, resolution, pixel format, codec and crf, and for each combination raises the fps until the
+pipeline no longer keeps up. Every run records with the Recorder (grab workers, frame pools, video writers) in its
+own interpreter, so peak memory and cpu times are per run. Results are json lines, diff them between versions:
+
+    python -m SurgeryViewer.benchmarks.bench_record --cams 1 2 4 --sizes 1280x1024 --fps 30 60 90 120 \
+        --codecs libx264 --crf 17 --duration 10 --out results.jsonl
+
+A run is sustained if no frame was skipped or lost, nothing was spilled to disk and the encoders were at most
+--max-lag seconds behind when the recording stopped.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Event
+
+from SurgeryViewer.configs.params import codec_to_try, MAX_FPS, WRITER_BACKEND
+
+
+def cpu_seconds(usage) -> float:
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_config(config: dict) -> dict:
+    """record config['duration'] s with synthetic cameras and measure, runs in the benchmark subprocess"""
+    import logging
+    logging.basicConfig(level=logging.ERROR)
+    from SurgeryViewer.core.Recorder import Recorder
+    from SurgeryViewer.core.CameraBackend import get_backend
+
+    backend = get_backend('synthetic', num_cams=config['cams'], width=config['width'], height=config['height'],
+                          pixel_format=config['pixel_format'], seed=0)
+    recorder = Recorder(write_timestamps=True, backend=backend)
+    recorder.log.setLevel(logging.ERROR)
+    recorder.live_view = config['live_view']
+    recorder.record_raw = config['raw']
+    recorder.writer_backend = config['writer']
+    recorder.codec = config['codec']
+    recorder.crf = config['crf']
+    recorder.fps = config['fps']
+    recorder.save_path = config['save_path']
+    recorder.scan_cams()
+    recorder.connect_cams()
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    stop_event = Event()
+    start = time.monotonic()
+    recorder.run_multi_cam_record(stop_event, filename='bench')
+    while time.monotonic() - start < config['duration'] and not recorder.error_event.is_set():
+        time.sleep(0.05)
+    error = recorder.error_event.is_set()
+    at_stop = recorder.get_metrics()
+    recorded_s = time.monotonic() - start
+    stop_event.set()
+    stop_start = time.monotonic()
+    recorder.stop_multi_cam_record()  # waits for the encoders to write the backlog
+    drain_s = time.monotonic() - stop_start
+    final = recorder.get_metrics()
+    recorder.disconnect_cams()
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)  # the ffmpeg encoders, waited for on close
+
+    cams = final['cameras']
+    grabbed = sum(cam['grabbed'] for cam in cams)
+    skipped = sum(cam['skipped'] + cam['grab_errors'] for cam in cams)
+    lost = sum(max(0, cam['grabbed'] - cam['written']) for cam in cams)
+    spilled = sum(cam['spilled'] for cam in cams)
+    backlog = max(cam['grabbed'] - cam['written'] for cam in at_stop['cameras'])  # frames not encoded at stop
+    lag_s = backlog / recorder.fps
+    grab_cpu = sum(cam['grab_cpu_s'] for cam in cams)
+    write_cpu = sum(cam['write_cpu_s'] for cam in cams)
+    process_cpu = cpu_seconds(self_after) - cpu_seconds(self_before)
+    return {'fps': recorder.fps,
+            'recorded_s': recorded_s,
+            'achieved_fps': grabbed / len(cams) / recorded_s,
+            'grabbed': grabbed,
+            'skipped': skipped,
+            'lost': lost,
+            'spilled': spilled,
+            'error': error,
+            'encoder_lag_s': lag_s,
+            'encoder_lag_frames': backlog,
+            'queue_hwm': max(cam['queue_hwm'] for cam in cams),
+            'drain_s': drain_s,
+            'convert_p99_ms': max(cam['convert']['p99_ms'] for cam in cams),
+            'write_p99_ms': max(cam['write']['p99_ms'] for cam in cams),
+            'encoder_wait_s': max(cam['encoder_wait_s'] for cam in cams),
+            'cpu_s': {'grab': grab_cpu,
+                      'writer': write_cpu,
+                      'other': process_cpu - grab_cpu - write_cpu,  # preview, metrics, main thread
+                      'encoder': cpu_seconds(children_after) - cpu_seconds(children_before)},
+            'peak_rss_mb': {'recorder': self_after.ru_maxrss / 1024, 'encoder': children_after.ru_maxrss / 1024}}
+
+
+def run_isolated(config: dict, timeout: float) -> dict:
+    """run_config in a fresh interpreter inside a temporary folder"""
+    work_dir = tempfile.mkdtemp(prefix='bench_record_')
+    config = dict(config, save_path=os.path.join(work_dir, 'videos'))
+    cwd = os.path.join(work_dir, 'cwd')  # the camera registry writes ../cameras.json
+    os.makedirs(cwd)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([p for p in sys.path if p]))
+    try:
+        result = subprocess.run([sys.executable, '-m', 'SurgeryViewer.benchmarks.bench_record', '--run-config',
+                                 json.dumps(config)], capture_output=True, text=True, timeout=timeout, cwd=cwd, env=env)
+        if result.returncode != 0:
+            return {'failed': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'unknown'}
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    except subprocess.TimeoutExpired:
+        return {'failed': f'timeout after {timeout} s'}
+    finally:
+        if not config['keep']:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def is_sustained(result: dict, max_lag: float) -> bool:
+    return 'failed' not in result and not result['error'] and result['skipped'] == 0 and result['lost'] == 0 \
+        and result['spilled'] == 0 and result['encoder_lag_s'] <= max_lag
+
+
+def machine_info() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'type': 'machine', 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'host': platform.node(), 'platform': platform.platform(), 'python': platform.python_version(),
+            'cpus': os.cpu_count(), 'commit': commit}
+
+
+def parse_size(size: str) -> tuple:
+    width, height = size.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Throughput benchmark of the record path with synthetic cameras')
+    parser.add_argument('--cams', type=int, nargs='+', default=[1, 2, 4], help='numbers of cameras')
+    parser.add_argument('--sizes', nargs='+', default=['1280x1024'], help='resolutions as WIDTHxHEIGHT')
+    parser.add_argument('--formats', nargs='+', default=['BayerRG8'], help='pixel formats of the cameras')
+    parser.add_argument('--raw', action='store_true', help='record Bayer/Mono8 raw instead of converting to RGB')
+    parser.add_argument('--fps', type=float, nargs='+', default=[30, 60, 90, 120, MAX_FPS],
+                        help=f'frame rates tried in increasing order, capped at MAX_FPS ({MAX_FPS})')
+    parser.add_argument('--codecs', nargs='+', default=['libx264'],
+                        help=f"codecs, 'all' for codec_to_try: {' '.join(codec_to_try)}")
+    parser.add_argument('--crf', type=int, nargs='+', default=[17], help='compression levels')
+    parser.add_argument('--writers', nargs='+', default=[WRITER_BACKEND], choices=['gear', 'pipe'],
+                        help='video writer backends')
+    parser.add_argument('--duration', type=float, default=10, help='recording time per run in s')
+    parser.add_argument('--max-lag', type=float, default=1.0,
+                        help='maximal encoder backlog in s at the end of a sustained run')
+    parser.add_argument('--live-view', action='store_true', help='run the preview channel as with the GUI')
+    parser.add_argument('--full', action='store_true', help='run all fps values instead of stopping at the first '
+                                                            'one not sustained')
+    parser.add_argument('--keep', action='store_true', help='keep the recorded videos')
+    parser.add_argument('--out', default=None, help='append results to this json lines file instead of stdout')
+    parser.add_argument('--run-config', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_config is not None:
+        # inside the benchmark subprocess
+        print(json.dumps(run_config(json.loads(args.run_config))))
+        return 0
+
+    out = open(args.out, 'a') if args.out else sys.stdout
+
+    def emit(record: dict):
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+
+    codecs = codec_to_try if args.codecs == ['all'] else args.codecs
+    emit(machine_info())
+    for cams, size, pixel_format, codec, crf, writer in itertools.product(args.cams, args.sizes, args.formats, codecs,
+                                                                           args.crf, args.writers):
+        width, height = parse_size(size)
+        group = {'cams': cams, 'width': width, 'height': height, 'pixel_format': pixel_format, 'raw': args.raw,
+                 'codec': codec, 'crf': crf, 'writer': writer, 'live_view': args.live_view}
+        max_sustained = None
+        for fps in sorted(args.fps):
+            config = dict(group, fps=fps, duration=args.duration, keep=args.keep)
+            result = run_isolated(config, timeout=args.duration * 10 + 60)
+            sustained = is_sustained(result, args.max_lag)
+            emit(dict(type='run', **group, requested_fps=fps, **result, sustained=sustained))
+            if sustained:
+                max_sustained = result['fps']
+            elif not args.full:
+                break
+        emit(dict(type='summary', **group, max_sustained_fps=max_sustained))
+    if out is not sys.stdout:
+        out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
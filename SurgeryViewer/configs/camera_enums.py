@@ -1,6 +1,8 @@
 from enum import Enum, unique
 import json
 
+CAMERAS_FILE = '../cameras.json'
+
 
 # TODO some bigger changes happend in python 3.11 check if using this version !
 
@@ -46,17 +48,24 @@ class CameraRegistry:
     }
     """
     def __init__(self):
-        try:
-            with open('../cameras.json', 'r') as f:
-                self._cameras = json.load(f)
+        self.__cameras = None  # read from CAMERAS_FILE on first use
+
+    @property
+    def _cameras(self) -> dict:
+        if self.__cameras is None:
+            self.__cameras = {}
+            try:
+                with open(CAMERAS_FILE, 'r') as f:
+                    self.__cameras = json.load(f)
                 if not self.validate_cameras():
                     self.write_newcam()
-        except (FileNotFoundError, json.decoder.JSONDecodeError):
-            self._cameras = {}
+            except (FileNotFoundError, json.decoder.JSONDecodeError):
+                self.__cameras = {}
+        return self.__cameras
 
     def write_newcam(self):
         """write the camera dict to a json file"""
-        with open('../cameras.json', 'w') as f:
+        with open(CAMERAS_FILE, 'w') as f:
             json.dump(self._cameras, f, indent=4)
 
     def get_camera(self, serial_number):
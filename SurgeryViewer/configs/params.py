@@ -1,3 +1,5 @@
+import os
+
 SAVE_TIMESTAMPS = False     # Boolean to save the timestamps of the frames
 TIME_STAMP_STRING = '%Y%m%d_%H%M%S'  # time format for the videos
 VIDEO_FOLDER = "behav_vid"  # folder for the videos
@@ -6,4 +8,40 @@ TRIGGER_LINE_OUT = "Line1"  # Outputline for the camera
 MAX_FPS = 150    # maximum fps for the camera
 codec_to_try = ["h264_nvenc", "libx264", "mpeg4", "mpeg2video", "libxvid", "libx264rgb"]
 LOG2FILE = True  # Boolean to log to a file
-CONVERT2 = 'RGB8' # Mono8 or RGB8 Colorformat for conversion
\ No newline at end of file
+CONVERT2 = 'RGB8' # Mono8 or RGB8 Colorformat for conversion
+PARALLEL_GRAB = True  # one grabbing thread per camera instead of a single RetrieveResult loop over all cameras
+RECORD_RAW = False  # record the native Bayer/Mono8 sensor data as lossless gray video, convert with utils/raw_convert.py
+RAW_CODEC = 'libx264'  # codec for raw recordings, needs to support lossless gray (crf 0)
+WRITER_BACKEND = 'gear'  # 'gear' writes frame by frame with vidgear, 'pipe' writes batches straight to ffmpeg which also demosaics Bayer cameras
+FRAME_POOL_SIZE = 520  # reusable frame buffers per camera, has to cover the writer queue (512)
+PREVIEW_FPS = 30  # rate of the live view, independent of the camera fps
+PREVIEW_MAX_SIZE = 640  # maximal width/height of the live view images before the viewer size is known
+STATUS_INTERVAL = 0.5  # s between updates of the status bar and the recording time in the GUI
+MAX_CAMERAS = 32  # maximal number of cameras in the GUI
+MOSAIC_THRESHOLD = 9  # more cameras are shown as one mosaic image instead of one view per camera
+MOSAIC_TILE_SIZE = (320, 256)  # (width, height) of each camera's tile in the mosaic
+SPILL_WATERMARK = 384  # queued frames per writer above which frames are parked on disk, None to abort on overflow
+SPILL_DIR = None  # folder for the overflow journals (fast local disk), None for the video folder
+SPILL_MAX_GB = 50  # maximal size of an overflow journal per camera
+USE_HW_TRIGGER = False  # cameras are triggered by the signal on TRIGGER_LINE_IN instead of free running
+SYNC_FRAMESETS = True  # group hardware triggered frames of all cameras by trigger, repeat frames of missed triggers
+FRAMESET_WINDOW = 32  # frames buffered per camera while waiting for the frames of the other cameras
+FRAMESET_SYNC_TOLERANCE = 0.25  # maximal timestamp difference of the frames of one trigger, fraction of the period
+METRICS_EXPORT = 'csv'  # format of the pipeline metrics written next to the videos, 'csv', 'jsonl' or None
+METRICS_INTERVAL = 5  # seconds between two exported metrics snapshots
+CAMERA_BACKEND = 'pylon'  # 'pylon' for Basler cameras, 'synthetic' for generated images without hardware
+CODEC_PRESETS = {"libx264": ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"],  # fastest first
+                 "libx264rgb": ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"],
+                 "h264_nvenc": ["p1", "p3", "p5", "p7"]}
+# image quality per bit, best first: x264 compresses best, RGB without chroma subsampling needs more bits, hardware
+# encoders compress worse than x264, MPEG-4 part 2 (xvid before the native encoder) and MPEG-2 worst.
+# The calibration recommends the first codec which keeps up, codecs not listed come last
+CODEC_QUALITY = ["libx264", "libx264rgb", "h264_nvenc", "libxvid", "mpeg4", "mpeg2video"]
+CODEC_PROFILE = os.path.join(os.path.expanduser('~'), '.SurgeryViewer', 'codec_profile.json')  # results of the codec calibration, per machine
+CODEC_HEADROOM = 1.2  # encoders have to be this much faster than the camera fps to be recommended
+AUTO_SELECT_CODEC = False  # use the codec recommended by the calibration when recording starts
+SEGMENT_MINUTES = None  # start new video files every N minutes (same frame for all cameras), None for one file per session
+SEGMENT_GB = None  # start new video files once a camera's file exceeds N GB, None for no limit
+VIDEO_CONTAINER = 'mp4'  # 'mp4', or 'fmp4' (fragmented mp4) / 'mkv' which stay readable if a recording is aborted
+FLUSH_INTERVAL = 2  # s between flushes of fmp4/mkv videos and their timestamps to disk, data since the last flush is lost on a crash
+TIMESTAMP_TICK = 1e-9  # s per camera timestamp tick for the session playback (Basler ace 2/USB: 1 ns, GigE ace: 8 ns)
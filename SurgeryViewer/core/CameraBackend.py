@@ -0,0 +1,123 @@
+"""
+Camera backends of the Recorder.
+
+A backend enumerates its cameras, each Camera is opened, configured and then grabbed from by one grabbing thread.
+grab returns a GrabbedFrame which is copied into a buffer of the FramePool and released right away. Backends:
+'pylon' for Basler cameras (core/PylonBackend.py) and 'synthetic' for generated images (core/SyntheticBackend.py).
+"""
+import numpy as np
+
+
+class GrabError(Exception):
+    """Grabbing from a camera failed"""
+    pass
+
+
+class GrabTimeout(GrabError):
+    """No image arrived within the timeout"""
+    pass
+
+
+class GrabbedFrame:
+    """
+    Image grabbed from a camera, only valid until release is called
+    id: block ID of the image, counts lost images as well
+    image_number: number of the image since the start of grabbing
+    timestamp: camera timestamp in ns
+    skipped: number of images skipped since the previous one (lost or overwritten in the camera buffers)
+    """
+    def __init__(self, id: int = 0, image_number: int = 0, timestamp: int = 0, skipped: int = 0,
+                 succeeded: bool = True, error_description: str = '', height: int = 0, width: int = 0):
+        self.id = id
+        self.image_number = image_number
+        self.timestamp = timestamp
+        self.skipped = skipped
+        self.succeeded = succeeded
+        self.error_description = error_description
+        self.height = height
+        self.width = width
+
+    def copy_into(self, out: np.ndarray):
+        """
+        Copy the image into out, a (height, width) array receives the native sensor data (Mono8/Bayer),
+        a (height, width, 3) array the RGB image
+        """
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+class Camera:
+    """
+    One camera of a backend, grab is only called from the grabbing thread of the camera.
+    Besides the serial, cameras have a (user defined) name and an integer context identifying it in recordings.
+    """
+    name: str
+    context: int
+    id_wrap = 0  # block ID after which the IDs restart at 1, 0 if they never wrap
+
+    def __init__(self, serial: str):
+        self.serial = serial
+
+    @property
+    def pixel_format(self) -> str:
+        raise NotImplementedError
+
+    def get_resolution(self) -> tuple:
+        """(width, height) of the images"""
+        raise NotImplementedError
+
+    def open(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def is_open(self) -> bool:
+        raise NotImplementedError
+
+    def configure(self, fps: float, hw_trigger: bool = False):
+        """
+        :param fps: frame rate of free running cameras
+        :param hw_trigger: the camera is triggered externally, fps is ignored
+        """
+        raise NotImplementedError
+
+    def start_grabbing(self, latest_only: bool = False):
+        """
+        :param latest_only: only keep the newest image (live view), otherwise images are buffered (recording)
+        """
+        raise NotImplementedError
+
+    def grab(self, timeout_ms: int) -> GrabbedFrame:
+        """next image, raises GrabTimeout if none arrives within timeout_ms and GrabError on camera errors"""
+        raise NotImplementedError
+
+    def stop_grabbing(self):
+        raise NotImplementedError
+
+
+class CameraBackend:
+    name = ''
+    registered = True  # names and contexts come from (and new cameras are added to) the CameraRegistry, backends
+    # naming their cameras themselves set it False
+
+    def enumerate(self) -> list:
+        """all cameras available, as list of Camera"""
+        raise NotImplementedError
+
+
+def get_backend(name: str, **kwargs) -> CameraBackend:
+    """
+    Backend by name, the backend modules are only imported when used
+    :param name: 'pylon' or 'synthetic'
+    :param kwargs: passed to the backend, e.g. the resolution of synthetic cameras
+    """
+    if name == 'pylon':
+        from SurgeryViewer.core.PylonBackend import PylonBackend
+        return PylonBackend(**kwargs)
+    if name == 'synthetic':
+        from SurgeryViewer.core.SyntheticBackend import SyntheticBackend
+        return SyntheticBackend(**kwargs)
+    raise ValueError(f'Unknown camera backend {name}')
@@ -0,0 +1,233 @@
+import logging
+from collections import namedtuple
+from threading import Lock
+
+from SurgeryViewer.configs.params import FRAMESET_SYNC_TOLERANCE
+from SurgeryViewer.utils.FramePool import FrameSlot
+
+# frames and meta hold one entry per camera, None for cameras that missed the trigger
+FrameSet = namedtuple('FrameSet', ['index', 'frames', 'meta', 'missing'])
+
+
+class FrameSetAssembler:
+    """
+    Groups the frames of hardware triggered cameras into framesets, one per trigger.
+    The trigger index of a frame is its block ID (grabResult.ID) relative to the first frame of the camera plus the
+    trigger index of that first frame, lost frames leave a gap in the IDs. The first frames are aligned across cameras
+    by their timestamps (camera clocks synchronized, e.g. by PTP): a camera which missed the first triggers starts at
+    the trigger its first timestamp falls on. Without comparable timestamps all cameras start at trigger 0.
+    GigE block IDs wrap from 65535 to 1, USB3 block IDs are 64 bit and never wrap. Block IDs which advance less than
+    the ImageNumber (delivered images) are inconsistent, the timestamps decide the number of triggers in between.
+    Each camera delivers its frames in order, so a frameset is complete once all cameras delivered it and final once
+    every camera delivered a later frame. Frames wait in bounded per camera reorder buffers, if a camera stops
+    delivering the oldest frameset is given up after window frames of the other cameras.
+    Finished framesets are passed in order to all subscribers, cameras which missed the trigger are marked in missing.
+    """
+    def __init__(self, num_cams: int, window: int = 32, log_path: str = None, id_wraps: list = None,
+                 tolerance: float = FRAMESET_SYNC_TOLERANCE):
+        """
+        :param num_cams: number of cameras
+        :param window: maximal number of frames buffered per camera while waiting for the other cameras
+        :param log_path: csv file to which incomplete framesets are written
+        :param id_wraps: per camera the block ID after which the IDs restart at 1 (65535 for GigE), 0 if they never
+        wrap, defaults to no wrap
+        :param tolerance: maximal deviation of the timestamps of one trigger across cameras as fraction of the trigger
+        period
+        """
+        self.num_cams = num_cams
+        self.window = window
+        self.id_wraps = list(id_wraps) if id_wraps is not None else [0] * num_cams
+        self.tolerance = tolerance
+        self.buffers = [dict() for _ in range(num_cams)]  # trigger index -> (frame, meta)
+        self.pending = [[] for _ in range(num_cams)]  # (frame, unwrapped ID, meta) until the cameras are aligned
+        self.aligned = False
+        self.start_time = None  # timestamp of trigger 0
+        self.period = None  # trigger period in timestamp ticks
+        self.start_indices = [None] * num_cams  # trigger index of the first frame of each camera
+        self.first_ids = [None] * num_cams  # unwrapped block ID of the first frame of each camera
+        self.last_frames = [None] * num_cams  # (unwrapped block ID, image number, timestamp) of the last frame
+        self.id_offsets = [0] * num_cams  # for unwrapping of the block IDs
+        self.newest = [-1] * num_cams  # newest trigger index delivered by each camera
+        self.next_index = 0  # index of the next frameset to finish
+        self.subscribers = []
+        self.framesets = 0
+        self.incomplete = 0
+        self.missing = [0] * num_cams
+        self.late = [0] * num_cams  # frames arriving after their frameset was given up
+        self.id_errors = [0] * num_cams  # block IDs inconsistent with the image numbers
+        self._lock = Lock()
+        self._log_file = None
+        if log_path is not None:
+            self._log_file = open(log_path, 'w')
+            self._log_file.write('frameset,missing_cameras\n')
+        self.log = logging.getLogger('FrameSetAssembler')
+
+    def subscribe(self, callback):
+        """
+        callback(FrameSet) is called for every finished frameset in order. FrameSlots in the frameset are only valid
+        during the call, retain them to keep them.
+        """
+        self.subscribers.append(callback)
+
+    def unwrap_id(self, c_id: int, frame_id: int, image_number: int, timestamp: int) -> int:
+        """block ID of a frame continued across wraps and checked against the image number"""
+        last = self.last_frames[c_id]
+        if last is None:
+            unwrapped = frame_id
+        else:
+            last_id, last_number, last_timestamp = last
+            wrap = self.id_wraps[c_id]
+            if wrap and frame_id + self.id_offsets[c_id] < last_id:
+                self.id_offsets[c_id] += wrap
+            unwrapped = frame_id + self.id_offsets[c_id]
+            images = image_number - last_number  # at least one trigger per delivered image
+            if unwrapped - last_id < images:
+                triggers = images
+                if self.period:
+                    triggers = max(images, round((timestamp - last_timestamp) / self.period))
+                self.id_errors[c_id] += 1
+                self.log.warning(f'Cam{c_id}: block ID {frame_id} after {last_id} but {images} images, '
+                                 f'continuing {triggers} triggers later')
+                self.id_offsets[c_id] += last_id + triggers - unwrapped
+                unwrapped = last_id + triggers
+        self.last_frames[c_id] = (unwrapped, image_number, timestamp)
+        return unwrapped
+
+    def trigger_index(self, c_id: int, unwrapped_id: int) -> int:
+        return self.start_indices[c_id] + unwrapped_id - self.first_ids[c_id]
+
+    def add(self, c_id: int, frame, frame_id: int, image_number: int, timestamp: int):
+        """
+        Add a frame of a camera, takes over one reference if frame is a FrameSlot. Subscribers are called from the
+        calling thread.
+        """
+        with self._lock:
+            unwrapped = self.unwrap_id(c_id, frame_id, image_number, timestamp)
+            meta = (frame_id, image_number, timestamp)
+            if not self.aligned:
+                self.pending[c_id].append((frame, unwrapped, meta))
+                if self._can_align():
+                    self._align()
+                return
+            if self.start_indices[c_id] is None:
+                self._start_camera(c_id, unwrapped, timestamp)
+            self._insert(c_id, frame, self.trigger_index(c_id, unwrapped), meta)
+
+    def _insert(self, c_id: int, frame, index: int, meta: tuple):
+        if index < self.next_index:
+            self.late[c_id] += 1
+            self._release(frame)
+            return
+        self.buffers[c_id][index] = (frame, meta)
+        self.newest[c_id] = max(self.newest[c_id], index)
+        # finish under the lock to keep the order for the subscribers
+        while self._finished(self.next_index):
+            if any(self.next_index in buffer for buffer in self.buffers):
+                self._emit(self.next_index)
+            self.next_index += 1
+
+    def _can_align(self) -> bool:
+        """all cameras delivered and the trigger period is known, or a camera waits too long"""
+        if any(len(pending) > self.window for pending in self.pending):
+            return True
+        return all(self.pending) and any(len(pending) > 1 for pending in self.pending)
+
+    def _estimate_period(self):
+        """trigger period from the camera with the most pending frames"""
+        pending = max(self.pending, key=len)
+        if len(pending) < 2:
+            return None
+        (_, first_id, first_meta), (_, last_id, last_meta) = pending[0], pending[-1]
+        if last_id <= first_id or last_meta[2] <= first_meta[2]:
+            return None
+        return (last_meta[2] - first_meta[2]) / (last_id - first_id)
+
+    def _align(self):
+        """set the trigger index of the first frame of every camera which delivered, then insert the pending frames"""
+        self.aligned = True
+        self.period = self._estimate_period()
+        delivered = [c_id for c_id, pending in enumerate(self.pending) if pending]
+        if self.period:
+            # cameras with a clock far off the others can't be aligned, trigger 0 is the first of the others
+            first_times = sorted(self.pending[c_id][0][2][2] for c_id in delivered)
+            median = first_times[len(first_times) // 2]
+            self.start_time = min(t for t in first_times if abs(t - median) <= self.window * self.period)
+        for c_id in delivered:
+            _, first_id, meta = self.pending[c_id][0]
+            self._start_camera(c_id, first_id, meta[2], limit=self.window)
+        pending, self.pending = self.pending, [[] for _ in range(self.num_cams)]
+        for c_id in delivered:
+            for frame, unwrapped, meta in pending[c_id]:
+                self._insert(c_id, frame, self.trigger_index(c_id, unwrapped), meta)
+
+    def _start_camera(self, c_id: int, first_id: int, timestamp: int, limit: int = None):
+        """
+        Align the first frame of a camera by its timestamp
+        :param limit: maximal trigger index of the first frame, None to allow cameras which started late
+        """
+        self.first_ids[c_id] = first_id
+        if self.start_time is None:
+            self.start_indices[c_id] = 0 if limit is not None else self.next_index
+            return
+        offset = (timestamp - self.start_time) / self.period
+        index = round(offset)
+        if abs(offset - index) <= self.tolerance and 0 <= index and (limit is None or index <= limit):
+            self.start_indices[c_id] = index
+        else:
+            self.start_indices[c_id] = 0 if limit is not None else self.next_index
+            self.log.warning(f'Cam{c_id}: timestamp {offset:.2f} trigger periods off the other cameras, '
+                             f'aligned by block ID only')
+
+    def _finished(self, index: int) -> bool:
+        if all(index in buffer or newest > index for buffer, newest in zip(self.buffers, self.newest)):
+            return True
+        # a camera stopped delivering, dont wait for it forever
+        return any(len(buffer) > self.window for buffer in self.buffers)
+
+    def _emit(self, index: int):
+        entries = [buffer.pop(index, None) for buffer in self.buffers]
+        frames = [entry[0] if entry else None for entry in entries]
+        meta = [entry[1] if entry else None for entry in entries]
+        missing = [c_id for c_id, entry in enumerate(entries) if entry is None]
+        self.framesets += 1
+        if missing:
+            self.incomplete += 1
+            for c_id in missing:
+                self.missing[c_id] += 1
+            if self._log_file is not None:
+                self._log_file.write(f"{index},{' '.join(str(c_id) for c_id in missing)}\n")
+        frameset = FrameSet(index, frames, meta, missing)
+        try:
+            for callback in self.subscribers:
+                callback(frameset)
+        finally:
+            for frame in frames:
+                self._release(frame)
+
+    @staticmethod
+    def _release(frame):
+        if isinstance(frame, FrameSlot):
+            frame.release()
+
+    def flush(self):
+        """finish all buffered framesets, e.g. after grabbing stopped"""
+        with self._lock:
+            if not self.aligned:
+                self._align()
+            last = max(self.newest)
+            while self.next_index <= last:
+                if any(self.next_index in buffer for buffer in self.buffers):
+                    self._emit(self.next_index)
+                self.next_index += 1
+
+    def close(self):
+        self.flush()
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+        if self.incomplete:
+            self.log.warning(f'{self.incomplete}/{self.framesets} framesets incomplete, missing frames per camera: '
+                             f'{self.missing}')
+
+    def get_state(self) -> str:
+        return f'Framesets {self.framesets}, incomplete {self.incomplete}'
@@ -0,0 +1,231 @@
+"""
+Runtime metrics of the acquisition pipeline, per camera and stage.
+
+Every counter is only written by the thread of its stage (grabbing, writer), so no locking is needed on the hot path.
+Snapshots are plain dicts which can be queried from the Recorder or exported periodically with the MetricsExporter,
+taking them is serialized per camera as they update the rate meters.
+"""
+import csv
+import json
+import logging
+import time
+from bisect import bisect_left
+from threading import Thread, Event, Lock
+
+
+class LatencyHistogram:
+    """Histogram of durations with log2 spaced buckets from 1 us to ~30 s"""
+    BOUNDS = [1e-6 * 2 ** i for i in range(25)]
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.buckets[bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """upper bound of the bucket holding the q-th percentile, at most the maximum"""
+        if not self.count:
+            return float('nan')
+        rank = q / 100.0 * self.count
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(self.BOUNDS[idx], self.max) if idx < len(self.BOUNDS) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        mean = self.total / self.count if self.count else float('nan')
+        return {'mean_ms': mean * 1e3, 'p50_ms': self.percentile(50) * 1e3, 'p99_ms': self.percentile(99) * 1e3,
+                'max_ms': self.max * 1e3}
+
+
+class RateMeter:
+    """Rate of a counter, averaged over at least min_interval seconds between queries"""
+    def __init__(self, min_interval: float = 0.5):
+        self.min_interval = min_interval
+        self._last_time = time.monotonic()
+        self._last_count = 0
+        self._rate = 0.0
+
+    def rate(self, count: int) -> float:
+        now = time.monotonic()
+        if now - self._last_time >= self.min_interval:
+            self._rate = (count - self._last_count) / (now - self._last_time)
+            self._last_time, self._last_count = now, count
+        return self._rate
+
+
+class CameraMetrics:
+    """Counters of all pipeline stages of one camera"""
+    def __init__(self, name: str = ''):
+        self.name = name
+        # grabbing thread
+        self.grabbed = 0
+        self.skipped = 0  # GetNumberOfSkippedImages
+        self.grab_errors = 0
+        self.convert_time = LatencyHistogram()  # copy/conversion into the frame buffer
+        self.grab_cpu = 0.0  # cpu time of the grabbing thread
+        # video writer
+        self.queue_hwm = 0  # high water mark of the writer queue
+        self.spilled = 0  # frames parked in the overflow journal
+        self.journal_hwm = 0
+        self.written = 0
+        self.write_time = LatencyHistogram()  # encoding of a frame
+        self.write_cpu = 0.0  # cpu time of the writer thread
+        self.encoder_wait = 0.0  # time the writer was blocked by a full encoder pipe (pipe writer only)
+        # live view, filled by the Recorder from its PreviewChannel
+        self.preview_dropped = 0
+        self._grab_rate = RateMeter()
+        self._write_rate = RateMeter()
+        self._snapshot_lock = Lock()  # exporter, status output and GUI take snapshots from their own threads
+
+    def observe_queue(self, depth: int):
+        if depth > self.queue_hwm:
+            self.queue_hwm = depth
+
+    def snapshot(self) -> dict:
+        with self._snapshot_lock:
+            return {'name': self.name,
+                    'grabbed': self.grabbed,
+                    'grab_fps': self._grab_rate.rate(self.grabbed),
+                    'skipped': self.skipped,
+                    'grab_errors': self.grab_errors,
+                    'convert': self.convert_time.snapshot(),
+                    'grab_cpu_s': self.grab_cpu,
+                    'queue_hwm': self.queue_hwm,
+                    'spilled': self.spilled,
+                    'journal_hwm': self.journal_hwm,
+                    'written': self.written,
+                    'encode_fps': self._write_rate.rate(self.written),
+                    'write': self.write_time.snapshot(),
+                    'write_cpu_s': self.write_cpu,
+                    'encoder_wait_s': self.encoder_wait,
+                    'preview_dropped': self.preview_dropped}
+
+
+class PipelineMetrics:
+    """Metrics of all cameras of a show/record session"""
+    def __init__(self, camera_names: list):
+        self.start_time = time.time()
+        self._start = time.monotonic()
+        self.cameras = [CameraMetrics(name) for name in camera_names]
+
+    def __getitem__(self, c_id: int) -> CameraMetrics:
+        return self.cameras[c_id]
+
+    def snapshot(self) -> dict:
+        return {'time': time.time(), 'elapsed_s': time.monotonic() - self._start,
+                'cameras': [cam.snapshot() for cam in self.cameras]}
+
+
+class LiveStatus:
+    """
+    Figures of each camera for the live overlay of the GUI, derived from the counters the pipeline keeps anyway.
+    It has its own RateMeters, querying it does not change the rates of the exported snapshots.
+    """
+    def __init__(self, num_cams: int, min_interval: float = 0.5, queue_warning: float = 0.5):
+        """
+        :param min_interval: s over which the rates are averaged at least
+        :param queue_warning: writer queue fill from which a camera counts as falling behind
+        """
+        self.queue_warning = queue_warning
+        self._grab_rates = [RateMeter(min_interval) for _ in range(num_cams)]
+        self._write_rates = [RateMeter(min_interval) for _ in range(num_cams)]
+        self._show_rates = [RateMeter(min_interval) for _ in range(num_cams)]
+        self._skipped = [0] * num_cams
+
+    def camera(self, c_id: int, metrics: CameraMetrics, queue_fill: float = None, shown: int = None,
+               frame_age: float = None) -> dict:
+        """
+        :param metrics: counters of the camera
+        :param queue_fill: used fraction of the writer queue, None if not recording
+        :param shown: previews of the camera shown so far, None without live view
+        :param frame_age: s from grabbing a frame until its preview was shown
+        :return: dict, rates and values are None if the stage is not running. 'behind' is set if frames were skipped
+            since the last call or the writer queue is filling up
+        """
+        new_skipped = metrics.skipped - self._skipped[c_id]
+        self._skipped[c_id] = metrics.skipped
+        return {'grab_fps': self._grab_rates[c_id].rate(metrics.grabbed),
+                'skipped': metrics.skipped,
+                'queue_fill': queue_fill,
+                'encode_fps': self._write_rates[c_id].rate(metrics.written) if queue_fill is not None else None,
+                'display_fps': self._show_rates[c_id].rate(shown) if shown is not None else None,
+                'frame_age': frame_age,
+                'behind': new_skipped > 0 or (queue_fill is not None and queue_fill >= self.queue_warning)}
+
+
+def flatten(snapshot: dict) -> list:
+    """one row per camera with nested values joined by '_', e.g. write_p99_ms"""
+    rows = []
+    for c_id, cam in enumerate(snapshot['cameras']):
+        row = {'time': snapshot['time'], 'elapsed_s': snapshot['elapsed_s'], 'camera': c_id}
+        for key, value in cam.items():
+            if isinstance(value, dict):
+                row.update({f'{key}_{sub_key}': sub_value for sub_key, sub_value in value.items()})
+            else:
+                row[key] = value
+        rows.append(row)
+    return rows
+
+
+class MetricsExporter:
+    """
+    Writes a metrics snapshot every interval seconds as time series, either as csv (one row per camera and snapshot)
+    or as json lines (one snapshot per line) depending on the file extension.
+    """
+    def __init__(self, get_snapshot, path: str, interval: float = 5.0):
+        """
+        :param get_snapshot: callable returning a snapshot dict, e.g. Recorder.get_metrics
+        :param path: .csv or .jsonl file
+        :param interval: seconds between snapshots
+        """
+        self.get_snapshot = get_snapshot
+        self.path = path
+        self.interval = interval
+        self._stop_event = Event()
+        self._writer = None
+        self.thread = Thread(target=self.update, name='metrics_export')
+        self.thread.daemon = True
+        self.log = logging.getLogger('MetricsExporter')
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def export(self, f):
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return
+        if self.path.endswith('.csv'):
+            rows = flatten(snapshot)
+            if self._writer is None:
+                self._writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                self._writer.writeheader()
+            self._writer.writerows(rows)
+        else:
+            f.write(json.dumps(snapshot) + '\n')
+        f.flush()
+
+    def update(self):
+        with open(self.path, 'w', newline='') as f:
+            while not self._stop_event.wait(self.interval):
+                try:
+                    self.export(f)
+                except Exception as e:  # never take down a recording because of metrics
+                    self.log.error(f'Metrics export failed: {e}')
+            self.export(f)  # final state
+
+    def stop(self):
+        self._stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
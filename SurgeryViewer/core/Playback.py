@@ -0,0 +1,182 @@
+"""
+Synchronized playback of the videos of a recorded session.
+
+Every camera's video is read ahead by its own VideoReaderFast thread, which decodes, converts to RGB and downsamples
+the frames to the viewer size, so the GUI only picks up finished frames. All cameras follow one session clock: a
+frame is shown from its camera timestamp on, counted from the camera's first frame (frame number / fps if the video
+has no timestamps). While scrubbing each camera shows the keyframe before the position, a single decode by random
+access, the readers restart at the exact position once the slider is released.
+"""
+import logging
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+from SurgeryViewer.configs.params import TIMESTAMP_TICK, PREVIEW_MAX_SIZE
+from SurgeryViewer.utils.TimestampSidecar import load_timestamps, timestamps_path
+from SurgeryViewer.utils.VideoIndex import load_index, keyframe_before
+from SurgeryViewer.utils.VideoReaderFast import VideoReaderFast
+
+
+class PlaybackStream:
+    """Video of one camera of a session"""
+    def __init__(self, video_path: str, target_size: tuple = (PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE),
+                 prefetch: float = 1.0):
+        """
+        :param target_size: (width, height) of the viewer, frames are downsampled by an integer factor to fit
+        :param prefetch: s of frames decoded ahead
+        """
+        self.video_path = video_path
+        self.log = logging.getLogger('PlaybackStream')
+        index = load_index(video_path)
+        self.frame_count = index['frame_count']
+        self.fps = index['fps'] or 30
+        self.scale = max(1, math.floor(min(index['width'] / target_size[0], index['height'] / target_size[1])))
+        self.queue_size = max(int(prefetch * self.fps), 2)
+        self.times = self._load_times()
+        self.duration = float(self.times[-1]) if self.frame_count else 0.0
+        self.current = None  # number of the frame shown last
+        self.reader = None  # reading ahead from the current frame
+
+    def _load_times(self) -> np.ndarray:
+        """presentation time of every frame in s, from the first frame"""
+        fallback = np.arange(self.frame_count) / self.fps
+        if not os.path.exists(timestamps_path(self.video_path)):
+            return fallback
+        stamps = np.asarray(load_timestamps(self.video_path)['TimeStamp'][:self.frame_count], dtype=np.int64)
+        if len(stamps) < self.frame_count or np.any(np.diff(stamps) < 0):
+            self.log.warning(f'Timestamps of {self.video_path} do not match the video, playing at {self.fps} FPS')
+            return fallback
+        return (stamps - stamps[0]) * TIMESTAMP_TICK
+
+    def _to_rgb(self, img: np.ndarray) -> np.ndarray:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        if self.scale > 1:
+            img = cv2.resize(img, (img.shape[1] // self.scale, img.shape[0] // self.scale),
+                             interpolation=cv2.INTER_AREA)
+        return img
+
+    def frame_for_time(self, t: float) -> int:
+        """number of the frame shown at session time t"""
+        return int(np.clip(np.searchsorted(self.times, t, side='right') - 1, 0, max(self.frame_count - 1, 0)))
+
+    def start(self, frame: int = 0):
+        """(re)start reading ahead at frame"""
+        self.stop()
+        self.reader = VideoReaderFast(self.video_path, transform=self._to_rgb, queue_size=self.queue_size,
+                                      start_frame=frame).start()
+
+    def frame_at(self, t: float) -> [np.ndarray, None]:
+        """
+        Frame to show at session time t, None if it is still shown. Frames the reader has not decoded in time are
+        skipped, if it is far behind or t went back it is restarted at the frame
+        """
+        target = self.frame_for_time(t)
+        if target == self.current:
+            return None
+        if self.reader is None or target < self.reader.next_frame - 1 or \
+                target >= self.reader.next_frame + 2 * self.queue_size:
+            self.start(target)  # catching up would take longer than decoding from the keyframe
+        img = None
+        while self.reader.next_frame <= target:
+            frame = self.reader.poll()
+            if frame is None:
+                break
+            img = frame
+        if img is not None:
+            self.current = self.reader.next_frame - 1
+        return img
+
+    def preview(self, t: float, keyframe_only: bool = True) -> [np.ndarray, None]:
+        """
+        Frame at session time t by random access while scrubbing, None if it is still shown
+        :param keyframe_only: the keyframe at or before the frame instead, without decoding the frames in between
+        """
+        if self.reader is None:
+            self.start(self.frame_for_time(t))
+        frame = self.frame_for_time(t)
+        if keyframe_only:
+            frame = keyframe_before(self.reader.get_index(), frame)[0]
+        if frame == self.current:
+            return None
+        self.current = frame
+        return self.reader.seek(frame)
+
+    def stop(self):
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+
+
+class SessionPlayback:
+    """Lockstep playback of the videos of all cameras of a session"""
+    def __init__(self, video_paths: list, target_sizes: list = None):
+        """
+        :param video_paths: one video per camera
+        :param target_sizes: (width, height) of the viewer of each camera
+        """
+        if target_sizes is None:
+            target_sizes = [(PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE)] * len(video_paths)
+        self.streams = [PlaybackStream(path, size) for path, size in zip(video_paths, target_sizes)]
+        self.duration = max((stream.duration for stream in self.streams), default=0.0)
+        self.fps = max((stream.fps for stream in self.streams), default=30)
+        self.speed = 1.0
+        self.playing = False
+        self._position = 0.0  # session time when the clock was last set
+        self._clock_start = time.monotonic()
+
+    @property
+    def position(self) -> float:
+        """current session time in s"""
+        if not self.playing:
+            return self._position
+        return min(self._position + (time.monotonic() - self._clock_start) * self.speed, self.duration)
+
+    def _set_clock(self, position: float):
+        self._position = min(max(position, 0.0), self.duration)
+        self._clock_start = time.monotonic()
+
+    def play(self):
+        if self.position >= self.duration:
+            self._set_clock(0.0)
+        else:
+            self._set_clock(self.position)
+        self.playing = True
+
+    def pause(self):
+        self._set_clock(self.position)
+        self.playing = False
+
+    def set_speed(self, speed: float):
+        self._set_clock(self.position)
+        self.speed = speed
+
+    def seek(self, t: float):
+        """continue at session time t, the readers restart there"""
+        self._set_clock(t)
+        for stream in self.streams:
+            stream.current = None
+            stream.start(stream.frame_for_time(self.position))
+
+    def preview(self, t: float, keyframe_only: bool = True) -> list:
+        """
+        frames of all cameras at session time t without moving the readers, None for cameras whose frame did not
+        change, see PlaybackStream.preview
+        """
+        self._set_clock(t)
+        return [stream.preview(self.position, keyframe_only) for stream in self.streams]
+
+    def update(self) -> list:
+        """new frame of each camera for the current session time, None for cameras whose frame did not change"""
+        t = self.position
+        if self.playing and t >= self.duration:
+            self.pause()
+        return [stream.frame_at(t) for stream in self.streams]
+
+    def stop(self):
+        self.playing = False
+        for stream in self.streams:
+            stream.stop()
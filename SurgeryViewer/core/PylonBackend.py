@@ -0,0 +1,178 @@
+import numpy as np
+from pypylon import genicam
+from pypylon import pylon
+
+from SurgeryViewer.core.CameraBackend import CameraBackend, Camera, GrabbedFrame, GrabError, GrabTimeout
+from SurgeryViewer.configs.params import TRIGGER_LINE_IN, MAX_FPS
+
+GIGE_ID_WRAP = 65535  # GigE block IDs run from 1 to 65535
+
+
+def config_continuous(cam: pylon.InstantCamera, fps: float):
+    if not cam.IsOpen():
+        cam.Open()
+
+    # some things are to be set as attributes ...
+    try:
+        cam.AcquisitionFrameRate.Value = fps  # set fps to desired value
+    except genicam.LogicalErrorException:
+        cam.AcquisitionFrameRateAbs.Value = fps
+
+    cam.AcquisitionFrameRateEnable.Value = True
+
+    cam.MaxNumBuffer.SetValue(1024)  # how many buffers there are in total (empty and full)
+    cam.OutputQueueSize.SetValue(
+        512)  # maximal number of filled buffers (if another image is retrieved it replaces an old one and is called skipped)
+
+    cam.AcquisitionMode.Value = 'Continuous'
+    cam.TriggerMode.Value = 'Off'
+
+
+def config_hw_trigger(cam: pylon.InstantCamera):
+    if not cam.IsOpen():
+        cam.Open()
+    try:
+        cam.AcquisitionFrameRate.Value = MAX_FPS  # here we go to max fps in order to not be limited
+    except genicam.LogicalErrorException:
+        cam.AcquisitionFrameRateAbs.Value = MAX_FPS  # maybe basler 2 cameras ?
+    cam.AcquisitionFrameRateEnable.Value = True  # TODO should this be False ?
+    # behavior wrt to these values is a bit strange to me. Important seems to be to use LastImages Strategy and make MaxNumBuffers larger than OutputQueueSize. Otherwise its not guaranteed to work
+    cam.MaxNumBuffer.SetValue(1024)  # how many buffers there are in total (empty and full)
+    cam.OutputQueueSize.SetValue(
+        512)  # maximal number of filled buffers (if another image is retrieved it replaces an old one and is called skipped)
+
+    cam.AcquisitionMode.Value = 'Continuous'
+
+    #todo move this to camera config? only leave triggermode on ?
+    cam.LineSelector.Value = TRIGGER_LINE_IN
+    cam.LineMode.Value = "Input"
+    #cam.LineSelector = TRIGGER_LINE_OUT
+    #cam.LineMode = "Output"
+    # cam.LineSource = pylon. # set to exposureactive
+    cam.TriggerSelector.Value = "FrameStart"
+    cam.TriggerSource.Value = TRIGGER_LINE_IN
+
+    cam.TriggerMode.Value = "On"
+    cam.TriggerActivation.Value = 'RisingEdge'
+
+
+class PylonFrame(GrabbedFrame):
+    def __init__(self, grab_result, camera: 'PylonCamera'):
+        succeeded = grab_result.GrabSucceeded()
+        super().__init__(grab_result.ID, grab_result.ImageNumber, grab_result.TimeStamp,
+                         grab_result.GetNumberOfSkippedImages(), succeeded,
+                         '' if succeeded else f'{grab_result.ErrorCode} {grab_result.ErrorDescription}',
+                         grab_result.GetHeight() if succeeded else 0, grab_result.GetWidth() if succeeded else 0)
+        self.grab_result = grab_result
+        self.camera = camera
+
+    def copy_into(self, out: np.ndarray):
+        converter = self.camera.converter
+        if out.ndim == 2 or converter.ImageHasDestinationFormat(self.grab_result):
+            # no conversion required, raw keeps the native sensor format with a third of the bytes of RGB
+            with self.grab_result.GetArrayZeroCopy() as img:
+                np.copyto(out, img)
+        else:
+            # convert to RGB
+            converter.Convert(self.camera.target_image, self.grab_result)
+            with self.camera.target_image.GetArrayZeroCopy() as img:
+                np.copyto(out, img)
+
+    def release(self):
+        self.grab_result.Release()
+
+
+class PylonCamera(Camera):
+    """Basler camera of the InstantCameraArray of the PylonBackend"""
+    def __init__(self, cam: pylon.InstantCamera):
+        super().__init__(cam.DeviceInfo.GetSerialNumber())
+        self.cam = cam
+        # owned by the grabbing thread of the camera
+        self.converter = pylon.ImageFormatConverter()
+        self.converter.OutputPixelFormat = pylon.PixelType_RGB8packed
+        self.converter.OutputBitAlignment = pylon.OutputBitAlignment_MsbAligned  # most significant bit first #
+        self.target_image = pylon.PylonImage()  # reused as conversion target
+
+    @property
+    def name(self) -> str:
+        return self.cam.DeviceInfo.GetUserDefinedName()
+
+    @name.setter
+    def name(self, name: str):
+        self.cam.DeviceInfo.SetUserDefinedName(name)
+
+    @property
+    def context(self) -> int:
+        return self.cam.GetCameraContext()
+
+    @context.setter
+    def context(self, context: int):
+        self.cam.SetCameraContext(context)
+
+    @property
+    def id_wrap(self) -> int:
+        # GigE block IDs are 16 bit and skip 0, USB3 block IDs are 64 bit
+        return GIGE_ID_WRAP if self.cam.GetDeviceInfo().GetDeviceClass() == 'BaslerGigE' else 0
+
+    @property
+    def pixel_format(self) -> str:
+        return self.cam.PixelFormat.GetValue()
+
+    def get_resolution(self) -> tuple:
+        self.open()
+        return self.cam.Width.GetValue(), self.cam.Height.GetValue()
+
+    def open(self):
+        if not self.cam.IsOpen():
+            self.cam.Open()
+
+    def close(self):
+        self.cam.Close()
+
+    def is_open(self) -> bool:
+        return self.cam.IsOpen()
+
+    def configure(self, fps: float, hw_trigger: bool = False):
+        if hw_trigger:
+            config_hw_trigger(self.cam)
+        else:
+            config_continuous(self.cam, fps)
+
+    def start_grabbing(self, latest_only: bool = False):
+        if latest_only:
+            self.cam.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+        else:
+            self.cam.StartGrabbing(pylon.GrabStrategy_LatestImages)
+
+    def grab(self, timeout_ms: int) -> PylonFrame:
+        try:
+            return PylonFrame(self.cam.RetrieveResult(timeout_ms, pylon.TimeoutHandling_ThrowException), self)
+        except genicam.TimeoutException as e:
+            raise GrabTimeout(str(e))
+        except genicam.GenericException as e:
+            raise GrabError(str(e))
+
+    def stop_grabbing(self):
+        self.cam.StopGrabbing()
+
+
+class PylonBackend(CameraBackend):
+    """Basler cameras attached to this machine, cam_array keeps the InstantCameraArray for the camera settings"""
+    name = 'pylon'
+
+    def __init__(self):
+        self.cam_array = []
+
+    def enumerate(self) -> list:
+        # Get the transport layer factory.
+        tlFactory = pylon.TlFactory.GetInstance()
+
+        devices = tlFactory.EnumerateDevices()
+        if len(devices) == 0:
+            self.cam_array = []
+            return []
+
+        self.cam_array = pylon.InstantCameraArray(len(devices))
+        for idx, cam in enumerate(self.cam_array):
+            cam.Attach(tlFactory.CreateDevice(devices[idx]))
+        return [PylonCamera(cam) for cam in self.cam_array]
@@ -1,21 +1,40 @@
+from __future__ import annotations  # pylon annotations without pypylon installed
+
 import logging, random
+import json
 # import cv2
 import time
 import datetime
 from pathlib import Path
 
-from threading import Event, Thread
+from threading import Event, Thread, Lock
 from queue import Queue, Full
 
-from pypylon import genicam
-from pypylon import pylon
+import numpy as np
+try:
+    from pypylon import genicam
+    from pypylon import pylon
+except ImportError:  # only the synthetic camera backend is available
+    genicam = pylon = None
 
 from SurgeryViewer.utils.VideoWriterFast_gear import VideoWriterFast
-from SurgeryViewer.utils.VideoWriterFast_gear import QueueOverflow
+from SurgeryViewer.utils.VideoWriterFast_gear import QueueOverflow, WriterStopped
+from SurgeryViewer.utils.VideoWriterFast_pipe import VideoWriterPipe, FFMPEG_PIXEL_FORMATS
+from SurgeryViewer.utils.raw_convert import RAW_PIXEL_FORMATS, write_raw_meta
+from SurgeryViewer.utils.PreviewChannel import PreviewChannel
+from SurgeryViewer.utils import codec_calibration
+from SurgeryViewer.utils.FramePool import FramePool, FrameSlot, PoolExhausted
+from SurgeryViewer.core.FrameSetAssembler import FrameSetAssembler
+from SurgeryViewer.core.Metrics import PipelineMetrics, MetricsExporter, LiveStatus
+from SurgeryViewer.core.CameraBackend import CameraBackend, GrabError, get_backend
+from SurgeryViewer.core.Segments import SegmentSchedule, SegmentIndex, SegmentedWriter
 
 from SurgeryViewer.configs.camera_enums import CameraRegistry
 
-from SurgeryViewer.configs.params import TIME_STAMP_STRING, TRIGGER_LINE_IN, MAX_FPS, CONVERT2
+from SurgeryViewer.configs.params import TIME_STAMP_STRING, TRIGGER_LINE_IN, MAX_FPS, CONVERT2, PARALLEL_GRAB, \
+    RECORD_RAW, RAW_CODEC, FRAME_POOL_SIZE, PREVIEW_FPS, PREVIEW_MAX_SIZE, SPILL_WATERMARK, SPILL_DIR, SPILL_MAX_GB, \
+    SYNC_FRAMESETS, FRAMESET_WINDOW, METRICS_EXPORT, METRICS_INTERVAL, CAMERA_BACKEND, WRITER_BACKEND, \
+    SEGMENT_MINUTES, SEGMENT_GB, VIDEO_CONTAINER, FLUSH_INTERVAL
 
 
 import os
@@ -25,7 +44,8 @@ NUM_CAMERAS = 2  # simulated cameras
 # os.environ["PYLON_CAMEMU"] = f"{NUM_CAMERAS}"
 # remove when not needed anymore
 
-CONVERSION_TARGET= {"RGB8":pylon.PixelType_RGB8packed,"Mono8":pylon.PixelType_Mono8}[CONVERT2]
+if pylon is not None:
+    CONVERSION_TARGET= {"RGB8":pylon.PixelType_RGB8packed,"Mono8":pylon.PixelType_Mono8}[CONVERT2]
 
 def rel_close(v, max_v, thresh=5.0):
     v_scaled = v / max_v * 100.0
@@ -37,15 +57,32 @@ def rel_close(v, max_v, thresh=5.0):
 class Recorder(object):
     """Class to handle recording of multiple cameras"""
 
-    def __init__(self, verbosity=0, write_timestamps=False):
+    def __init__(self, verbosity=0, write_timestamps=False, backend: [str, CameraBackend, None] = None):
+        """
+        :param backend: camera backend or its name ('pylon', 'synthetic'), defaults to CAMERA_BACKEND
+        """
         self.write_timestamps = write_timestamps
+        if backend is None or isinstance(backend, str):
+            backend = get_backend(backend if backend else CAMERA_BACKEND)
+        self.backend = backend
+        self.cameras = []  # Camera objects of the backend, grabbed from by the recording and live view
         self.codec = 'divx'
+        self.crf = 0
+        self.codec_presets = {}  # encoder preset per codec, e.g. chosen by the codec calibration
+        self.record_raw = RECORD_RAW  # record native Bayer/Mono8 frames without conversion
+        self.writer_backend = WRITER_BACKEND
+        self.segment_minutes = SEGMENT_MINUTES  # split the videos into segments, None for one video per session
+        self.segment_gb = SEGMENT_GB
+        self.segment_index = None
+        self.video_container = VIDEO_CONTAINER  # 'fmp4' and 'mkv' stay readable if the recording is aborted
+        self.raw_formats = []  # pixel format of each camera delivering native frames, None if converted to RGB
         self.video_writer_list = []  # list of video writers
         self.is_recording = False
         self.is_viewing = False
         self.cams_context = None
         self.multi_record_thread = None
-        self.multi_view_queue = None
+        self.preview = None  # PreviewChannel with the newest downsampled image of each camera
+        self.preview_fps = PREVIEW_FPS
         self.stop_event = None
         self.error_event = Event()  # event we set if an error occurs to signal the main thread
         self.current_cam = None
@@ -53,6 +90,20 @@ class Recorder(object):
         self.single_view_thread = None
         self.single_view_queue = None
         self.multi_view_thread = None
+        self.parallel_grab = PARALLEL_GRAB  # one grabbing thread per camera
+        self.grab_threads = []  # per camera grabbing threads if parallel_grab is set
+        self._grab_lock = Lock()
+        self._active_grabbers = 0
+        self.frame_pool_size = FRAME_POOL_SIZE  # number of reusable frame buffers per camera
+        self.frame_pools = {}  # FramePool of each grabbing thread
+        self.sync_framesets = SYNC_FRAMESETS  # assemble framesets of hardware triggered recordings
+        self.frameset_assembler = None
+        self._last_synced_frames = []  # last written frame of each camera, repeated for missed triggers
+        self.metrics = None  # PipelineMetrics of the current show/record session
+        self.live_status = None  # LiveStatus of the current show/record session, for the overlay of the GUI
+        self.metrics_exporter = None
+        self.live_view = True  # publish frames to the PreviewChannel, off for headless recordings
+        self.preview_listener = None  # on_ready callback of the PreviewChannel, e.g. the display scheduler of the GUI
         self.cams_connected = False
         self.cam_array = []
         self._verbosity = verbosity
@@ -88,105 +139,108 @@ class Recorder(object):
     def get_cam_info(self) -> list:
         self.scan_cams()
         sns = list()
-        for idx, cam in enumerate(self.cam_array):
-            sns.append(cam.DeviceInfo.GetSerialNumber())
+        for idx, cam in enumerate(self.cameras):
+            sns.append(cam.serial)
         return sns
 
     def scan_cams(self):
-        """ Searches for attached Basler cams and puts them into our list of cameras. """
+        """ Searches for attached cams of the backend and puts them into our list of cameras. """
         # reset cams
         self._camera_list, self._camera_names_list = list(), list()
 
-        # Get the transport layer factory.
-        tlFactory = pylon.TlFactory.GetInstance()
-
-        devices = tlFactory.EnumerateDevices()
-        if len(devices) == 0:
+        self.cameras = self.backend.enumerate()
+        # the camera settings (exposure, gain, ...) are pylon specific and work on the InstantCameraArray
+        self.cam_array = getattr(self.backend, 'cam_array', [])
+        if len(self.cameras) == 0:
             self.log.info('No cameras present')
-            self.cam_array = []
             return
 
-        self.log.debug(f'Found {len(devices)} cameras')
-
-        self.cam_array = pylon.InstantCameraArray(len(devices))
+        self.log.debug(f'Found {len(self.cameras)} cameras')
 
-        for idx, cam in enumerate(self.cam_array):
-            cam.Attach(tlFactory.CreateDevice(devices[idx]))
-            sn = cam.DeviceInfo.GetSerialNumber()
+        if not self.backend.registered:
+            return  # the backend names its cameras
+        for cam in self.cameras:
             try:
-                self.cameraregistry.get_camera(sn)
+                self.cameraregistry.get_camera(cam.serial)
             except ValueError:
-                self.log.warning(f'Connected camera {sn} not found in Enum')
+                self.log.warning(f'Connected camera {cam.serial} not found in Enum')
+
+    @property
+    def num_cams(self) -> int:
+        return len(self.cameras)
+
+    def get_encoding_format(self) -> [tuple, None]:
+        """
+        (width, height, number of cameras) of the videos encoded with self.codec, the largest resolution is reported.
+        Cameras recorded raw are not counted as they always use RAW_CODEC, None if no camera uses self.codec
+        """
+        resolutions = [cam.get_resolution() for cam in self.cameras
+                       if not (self.record_raw and cam.pixel_format in RAW_PIXEL_FORMATS)]
+        if not resolutions:
+            return None
+        return max(r[0] for r in resolutions), max(r[1] for r in resolutions), len(resolutions)
+
+    def get_codec_max_fps(self) -> [float, None]:
+        """frame rate self.codec is expected to sustain with the connected cameras, None if it was not calibrated"""
+        encoding_format = self.get_encoding_format()
+        if encoding_format is None:
+            return None
+        return codec_calibration.max_fps(codec_calibration.load_profile(), self.codec,
+                                         self.codec_presets.get(self.codec), *encoding_format)
+
+    def select_codec(self, calibrate: bool = False, stop_event: Event = None) -> [tuple, None]:
+        """
+        Switch to the codec and preset recommended for the connected cameras at self.fps, see utils/codec_calibration.py
+        :param calibrate: measure the codecs first (takes a while), otherwise the stored profile of the machine is used
+        :param stop_event: aborts the calibration
+        :return: (codec, preset), None if no codec keeps up and the codec is left unchanged
+        """
+        encoding_format = self.get_encoding_format()
+        if encoding_format is None:
+            return self.codec, self.codec_presets.get(self.codec)
+        width, height, num_cams = encoding_format
+        if calibrate:
+            self.log.info(f'Calibrating codecs for {num_cams} cameras at {width}x{height} and {self.fps} FPS')
+            results = codec_calibration.calibrate(width, height, self.fps, num_cams, crf=self.crf,
+                                                  stop_event=stop_event,
+                                                  writer_class=VideoWriterPipe if self.writer_backend == 'pipe'
+                                                  else VideoWriterFast)
+            profile = codec_calibration.save_profile(results)
+        else:
+            profile = codec_calibration.load_profile()
+        choice = codec_calibration.recommend(profile, width, height, self.fps, num_cams)
+        if choice is None:
+            self.log.warning(f'No calibrated codec keeps up with {num_cams} cameras at {self.fps} FPS')
+            return None
+        self.codec = choice[0]
+        self.codec_presets[self.codec] = choice[1]
+        self.log.info(f'Selected codec {self.codec} with preset {choice[1]}')
+        return choice
 
     def connect_cams(self):
-        self.cam_array.Open()
-        for idx, cam in enumerate(self.cam_array):
-            camera_serial = cam.DeviceInfo.GetSerialNumber()
+        for cam in self.cameras:
+            cam.open()
+            if not self.backend.registered:
+                continue  # name and context set by the backend
             try:
-                c = self.cameraregistry.get_camera(camera_serial)
+                c = self.cameraregistry.get_camera(cam.serial)
                 self.log.debug(
-                    f"set context {c.get('context')} for camera {camera_serial}")
-                cam.SetCameraContext(c.get('context'))
-                cam.DeviceInfo.SetUserDefinedName(c.get('name'))
+                    f"set context {c.get('context')} for camera {cam.serial}")
+                cam.context = c.get('context')
+                cam.name = c.get('name')
             except ValueError:
                 r_int = random.randint(10, 256)
-                cam.SetCameraContext(r_int)  # for unknown cameras set random context
-                cam.DeviceInfo.SetUserDefinedName(f"cam{r_int}")
+                cam.context = r_int  # for unknown cameras set random context
+                cam.name = f"cam{r_int}"
         self.cams_connected = True
-        self.log.debug(f'Connected to {self.cam_array.GetSize()} cameras')
+        self.log.debug(f'Connected to {self.num_cams} cameras')
 
     def disconnect_cams(self):
         """ Disconnects all cameras"""
-        if self.cam_array:
-            self.cam_array.Close()
+        for cam in self.cameras:
+            cam.close()
         self.cams_connected = False
 
-    def _config_cams_continuous(self, cam):
-        if not cam.IsOpen():
-            cam.Open()
-
-        # some things are to be set as attributes ...
-        try:
-            cam.AcquisitionFrameRate.Value = self.fps  # set fps to desired value
-        except genicam.LogicalErrorException:
-            cam.AcquisitionFrameRateAbs.Value = self.fps
-
-        cam.AcquisitionFrameRateEnable.Value = True
-
-        cam.MaxNumBuffer.SetValue(1024)  # how many buffers there are in total (empty and full)
-        cam.OutputQueueSize.SetValue(
-            512)  # maximal number of filled buffers (if another image is retrieved it replaces an old one and is called skipped)
-
-        cam.AcquisitionMode.Value = 'Continuous'
-        cam.TriggerMode.Value = 'Off'
-
-    def _config_cams_hw_trigger(self, cam):
-        if not cam.IsOpen():
-            cam.Open()
-        try:
-            cam.AcquisitionFrameRate.Value = MAX_FPS  # here we go to max fps in order to not be limited
-        except genicam.LogicalErrorException:
-            cam.AcquisitionFrameRateAbs.Value = MAX_FPS  # maybe basler 2 cameras ?
-        cam.AcquisitionFrameRateEnable.Value = True  # TODO should this be False ?
-        # behavior wrt to these values is a bit strange to me. Important seems to be to use LastImages Strategy and make MaxNumBuffers larger than OutputQueueSize. Otherwise its not guaranteed to work
-        cam.MaxNumBuffer.SetValue(1024)  # how many buffers there are in total (empty and full)
-        cam.OutputQueueSize.SetValue(
-            512)  # maximal number of filled buffers (if another image is retrieved it replaces an old one and is called skipped)
-
-        cam.AcquisitionMode.Value = 'Continuous'
-
-        #todo move this to camera config? only leave triggermode on ?
-        cam.LineSelector.Value = TRIGGER_LINE_IN
-        cam.LineMode.Value = "Input"
-        #cam.LineSelector = TRIGGER_LINE_OUT
-        #cam.LineMode = "Output"
-        # cam.LineSource = pylon. # set to exposureactive
-        cam.TriggerSelector.Value = "FrameStart"
-        cam.TriggerSource.Value = TRIGGER_LINE_IN
-
-        cam.TriggerMode.Value = "On"
-        cam.TriggerActivation.Value = 'RisingEdge'
-
     @staticmethod
     def is_color_cam(cam):
         # get available formats
@@ -627,6 +681,40 @@ class Recorder(object):
             cam.Close()
         return cam_settings
 
+    def load_settings(self, file: [str, Path]) -> [dict, None]:
+        """
+        Apply the camera settings of a settings json (as saved by the GUI) to the connected cameras
+        :param file: path of the *.settings.json
+        :return: content of the file including the general settings (fps, codec, crf, save_path, HW_trigg),
+        None if not connected to the cameras
+        """
+        if not self.cams_connected:
+            self.log.warning('Not connected to cameras cant load settings')
+            return None
+        with open(file, 'r') as fi:
+            cam_lib = json.load(fi)
+
+        for c_id, cam in enumerate(self.cameras):
+            try:
+                settings = cam_lib[cam.name]
+            except KeyError:
+                self.log.info(f'No settings found for cam: {cam.name} with SN: {cam.serial}')
+                continue
+            if self.cam_array:
+                self.set_cam_settings(self.cam_array[c_id], settings)
+            else:
+                self.log.debug(f'Camera settings are not supported by the {self.backend.name} backend')
+        return cam_lib
+
+    def apply_general_settings(self, cam_lib: dict):
+        """Take over fps, codec, preset, crf and save_path of a loaded settings file, missing entries are kept"""
+        self.fps = cam_lib.get('fps', self.fps)
+        self.codec = cam_lib.get('codec', self.codec)
+        if 'preset' in cam_lib:
+            self.codec_presets[self.codec] = cam_lib['preset']
+        self.crf = cam_lib.get('crf', self.crf)
+        self.save_path = cam_lib.get('save_path', self.save_path)
+
     def flip_image_x(self, cam_id: int):
         """ Flips the image  of a single camera in the X plane """
         was_closed = False
@@ -668,7 +756,7 @@ class Recorder(object):
             self.log.info(f'Showing device {cam.GetDeviceInfo().GetSerialNumber()} with {self.fps} FPS')
             self.current_cam_name = cam.GetDeviceInfo().GetSerialNumber()
 
-        self._config_cams_continuous(cam)
+        self.cameras[cam_id].configure(self.fps)
         self.current_cam = cam
 
         self.stop_event = stop_event
@@ -731,28 +819,58 @@ class Recorder(object):
                 break
         cam.StopGrabbing()
 
-    def run_multi_cam_show(self, stop_event: Event, use_hw_trigger: bool = False):
-        self.multi_view_queue = [Queue(self.internal_queue_size) for _ in range(self.cam_array.GetSize())]
-        #self.multi_view_queue = [Queue(self.internal_queue_size)] * self.cam_array.GetSize()
-        #second option does copies of ques and not references!
+    def get_metrics(self) -> [dict, None]:
+        """
+        Snapshot of the pipeline metrics of the current or last show/record session, see core/Metrics.py
+        :return: dict with the counters of each camera in 'cameras', None before the first session
+        """
+        if self.metrics is None:
+            return None
+        if self.preview is not None:
+            for c_id, dropped in enumerate(self.preview.dropped):
+                self.metrics[c_id].preview_dropped = dropped
+        return self.metrics.snapshot()
+
+    def get_live_status(self) -> [list, None]:
+        """
+        Per camera figures of the current show/record session for a live overlay, see LiveStatus.camera.
+        Cheap enough to be called a few times per second
+        :return: list of dicts, None before the first session
+        """
+        if self.metrics is None:
+            return None
+        status = []
+        for c_id in range(len(self.metrics.cameras)):
+            queue_fill = None
+            if self.is_recording and c_id < len(self.video_writer_list):
+                queue_fill = self.video_writer_list[c_id].queue_fill()
+            shown = self.preview.shown[c_id] if self.preview is not None else None
+            frame_age = self.preview.frame_age[c_id] if self.preview is not None else None
+            status.append(self.live_status.camera(c_id, self.metrics[c_id], queue_fill, shown, frame_age))
+        return status
 
-        if not self.cam_array.IsOpen():
-            self.cam_array.Open()
+    def run_multi_cam_show(self, stop_event: Event, use_hw_trigger: bool = False):
+        self.preview = PreviewChannel(self.num_cams, display_fps=self.preview_fps, max_size=PREVIEW_MAX_SIZE,
+                                      on_ready=self.preview_listener).start() if self.live_view else None
+        self.metrics = PipelineMetrics([cam.name for cam in self.cameras])
+        self.live_status = LiveStatus(self.num_cams)
 
-        self.log.info(f'Showing {self.cam_array.GetSize()} cameras '
+        self.log.info(f'Showing {self.num_cams} cameras '
                       f'with {self.fps} FPS')
 
         self.cams_context = {} # to identify from which camera the images arrive
 
-        for c_id, cam in enumerate(self.cam_array):
-            if use_hw_trigger:
-                self._config_cams_hw_trigger(cam)
-            else:
-                self._config_cams_continuous(cam)
-            self.cams_context[cam.GetCameraContext()] = c_id
+        for c_id, cam in enumerate(self.cameras):
+            cam.open()
+            cam.configure(self.fps, use_hw_trigger)
+            self.cams_context[cam.context] = c_id
         #self.log.debug(self.cams_context)
         self.stop_event = stop_event
         self.error_event.clear()
+        if self.parallel_grab or not self.cam_array:  # single loop grabbing needs the pylon InstantCameraArray
+            self.is_viewing = True
+            self._start_grab_workers(record=False)
+            return
         self.multi_view_thread = Thread(target=self.multi_cam_show)
         self.multi_view_thread.start()
         self.is_viewing = True
@@ -762,6 +880,9 @@ class Recorder(object):
             self.log.debug('Stopping multi-view, waiting for join')
             self.multi_view_thread.join()  # wait for thread to finish
             self.log.debug('multi-view thread joined')
+        self._join_grab_workers()
+        if self.preview is not None:
+            self.preview.stop()
         self.stop_event = None
         self.error_event.clear()
         self.multi_view_thread = None
@@ -791,7 +912,8 @@ class Recorder(object):
                         img = targetImage.GetArray()
                     #img = grabResult.GetArray()
                     # context_id = self.cams_context[grabResult.GetCameraContext()]
-                    self.multi_view_queue[context_id].put_nowait(img)
+                    if self.preview is not None:
+                        self.preview.publish(context_id, img)
                     grabResult.Release()
                 else:
                     print("Error: ", grabResult.ErrorCode, grabResult.ErrorDescription)
@@ -803,63 +925,191 @@ class Recorder(object):
                 self.log.error(e)
                 self.error_event.set()
                 break
-            except Full:
-                self.log.error(f"Queue buffer for camera {context_id} overrun !")
-                self.error_event.set()
-                break
         self.cam_array.StopGrabbing()
         self.is_viewing = False
 
     def run_multi_cam_record(self, stop_event: Event, filename: str = 'testrec', use_hw_trigger: bool = False):
-        was_closed = False
-        self.multi_view_queue = [Queue(self.internal_queue_size) for _ in range(self.cam_array.GetSize())]
-
         # create path if not exists
         (Path(self.save_path)).mkdir(parents=True, exist_ok=True)
 
-        if not self.cam_array.IsOpen():
-            was_closed = True
-            self.cam_array.Open()
-
-        self.log.info(f'Recording {self.cam_array.GetSize()} cameras '
+        self.log.info(f'Recording {self.num_cams} cameras '
                       f'with {self.fps} FPS')
 
         self.cams_context = {}
         self.video_writer_list = list()
+        self.raw_formats = list()
+        self.metrics = PipelineMetrics([cam.name for cam in self.cameras])
+        self.live_status = LiveStatus(self.num_cams)
         try:
             timestamp = datetime.datetime.now().strftime(TIME_STAMP_STRING)
         except (TypeError, ValueError):
             timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
 
+        self.segment_index = None
+        if self.video_container not in ('mp4', 'fmp4', 'mkv'):
+            raise ValueError(f'Unknown video container {self.video_container}')
+        if self.segment_minutes or self.segment_gb:
+            segment_frames = int(self.segment_minutes * 60 * self.fps) if self.segment_minutes else None
+            schedule = SegmentSchedule(segment_frames)
+            index_path = (Path(self.save_path) / f"{filename}_{timestamp}_segments.json").as_posix()
+            self.segment_index = SegmentIndex(index_path, [cam.name for cam in self.cameras], self.fps,
+                                              segment_frames=segment_frames, segment_gb=self.segment_gb)
+
         # to make sure all have the same timestamp
-        for c_id, cam in enumerate(self.cam_array):
-            if use_hw_trigger:
-                self._config_cams_hw_trigger(cam)
-            else:
-                self._config_cams_continuous(cam)
+        for c_id, cam in enumerate(self.cameras):
+            cam.open()
+            cam.configure(self.fps, use_hw_trigger)
 
-            self.cams_context[cam.GetCameraContext()] = c_id
+            self.cams_context[cam.context] = c_id
             video_name = f"{filename}_{timestamp}_" \
-                         f"{cam.DeviceInfo.GetUserDefinedName()}.mp4"
+                         f"{cam.name}.{'mkv' if self.video_container == 'mkv' else 'mp4'}"
             video_name = (Path(self.save_path) / video_name).as_posix()
-            self.video_writer_list.append(VideoWriterFast(video_name,
-                                                          fps=self.fps,
-                                                          codec=self.codec))  # was DIVX
+            pixel_format = cam.pixel_format
+            if self.record_raw and pixel_format in RAW_PIXEL_FORMATS:
+                self.raw_formats.append(pixel_format)
+            elif self.writer_backend == 'pipe' and pixel_format in RAW_PIXEL_FORMATS:
+                self.raw_formats.append(pixel_format)  # ffmpeg converts the native frames
+            else:
+                if self.record_raw:
+                    self.log.warning(f'{pixel_format} of {cam.name} cant be recorded raw,'
+                                     f' converting to RGB')
+                self.raw_formats.append(None)
+            frame_shape = None
+            if self.parallel_grab or not self.cam_array:
+                # grab workers deliver frames of the camera resolution, so the encoder can be started right away
+                width, height = cam.get_resolution()
+                frame_shape = (height, width) if self.raw_formats[-1] is not None else (height, width, 3)
+            if self.segment_index is not None:
+                stem, extension = os.path.splitext(video_name)
+                make_writer = (lambda segment, stem=stem, extension=extension, c_id=c_id, frame_shape=frame_shape:
+                               self._open_video(f'{stem}_{segment:03d}{extension}', self.raw_formats[c_id],
+                                                self.metrics[c_id], frame_shape))
+                segment_bytes = int(self.segment_gb * 1024 ** 3) if self.segment_gb else None
+                writer = SegmentedWriter(cam.name, make_writer, schedule, self.segment_index,
+                                         segment_bytes=segment_bytes, rotation_margin=int(self.fps) + 1)
+            else:
+                writer = self._open_video(video_name, self.raw_formats[-1], self.metrics[c_id], frame_shape)
+            self.video_writer_list.append(writer)
+
+        self.frameset_assembler = None
+        if use_hw_trigger and self.sync_framesets:
+            if self.parallel_grab or not self.cam_array:
+                log_path = (Path(self.save_path) / f"{filename}_{timestamp}_framesets.csv").as_posix()
+                self.frameset_assembler = FrameSetAssembler(self.num_cams, window=FRAMESET_WINDOW,
+                                                            log_path=log_path,
+                                                            id_wraps=[cam.id_wrap for cam in self.cameras])
+                self.frameset_assembler.subscribe(self._write_frameset)
+                self._last_synced_frames = [None] * self.num_cams
+            else:
+                self.log.warning('Framesets are only assembled with parallel grabbing')
         # self.log.debug(print(self.cams_context))
+        if METRICS_EXPORT:
+            metrics_path = (Path(self.save_path) / f"{filename}_{timestamp}_metrics.{METRICS_EXPORT}").as_posix()
+            self.metrics_exporter = MetricsExporter(self.get_metrics, metrics_path, METRICS_INTERVAL).start()
+        self.preview = PreviewChannel(self.num_cams, display_fps=self.preview_fps,
+                                      max_size=PREVIEW_MAX_SIZE, raw_formats=self.raw_formats,
+                                      on_ready=self.preview_listener).start() \
+            if self.live_view else None
         self.stop_event = stop_event
         self.error_event.clear()
+        if self.parallel_grab or not self.cam_array:
+            self.is_recording = True
+            self._start_grab_workers(record=True)
+            return
         self.multi_record_thread = Thread(target=self.multi_cam_record)
         self.multi_record_thread.start()
         self.is_recording = True
 
+    def _open_video(self, video_name: str, raw_format: [str, None], metrics, frame_shape: [tuple, None]):
+        """writer of a video, raw recordings get their _meta.json"""
+        if self.record_raw and raw_format is not None:
+            write_raw_meta(video_name, raw_format, self.fps)
+        return self._create_writer(video_name, raw_format, metrics, frame_shape)
+
+    def _create_writer(self, video_name: str, raw_format: [str, None] = None, metrics=None,
+                       frame_shape: tuple = None) -> VideoWriterFast:
+        """
+        Video writer for a camera
+        :param video_name: path of the video
+        :param raw_format: pixel format if the camera delivers native frames
+        :param metrics: CameraMetrics of the camera
+        :param frame_shape: shape of the frames if known, the encoder is created right away instead of with the first
+        frame on the grabbing thread
+        """
+        spill_args = dict(spill_watermark=SPILL_WATERMARK, spill_dir=SPILL_DIR, spill_max_gb=SPILL_MAX_GB,
+                          metrics=metrics, flush_interval=None if self.video_container == 'mp4' else FLUSH_INTERVAL)
+        if self.writer_backend == 'pipe':
+            if raw_format is not None and self.record_raw:
+                return VideoWriterPipe(video_name, fps=self.fps, codec=RAW_CODEC, crf=0, pix_fmt='gray',
+                                       input_pix_fmt='gray', frame_shape=frame_shape, **spill_args).start()
+            input_pix_fmt = FFMPEG_PIXEL_FORMATS[raw_format] if raw_format is not None else None
+            return VideoWriterPipe(video_name, fps=self.fps, codec=self.codec, crf=self.crf,
+                                   preset=self.codec_presets.get(self.codec), input_pix_fmt=input_pix_fmt,
+                                   frame_shape=frame_shape, **spill_args).start()
+        if raw_format is not None:
+            # bayer data has to be stored lossless to be demosaiced later
+            return VideoWriterFast(video_name, fps=self.fps, codec=RAW_CODEC, crf=0, rgb_mode=False, pix_fmt='gray',
+                                   frame_shape=frame_shape, **spill_args).start()
+        return VideoWriterFast(video_name, fps=self.fps, codec=self.codec, crf=self.crf,
+                               preset=self.codec_presets.get(self.codec), frame_shape=frame_shape,
+                               **spill_args).start()  # was DIVX
+
+    def _write_frameset(self, frameset):
+        """
+        Feeds the frames of a frameset to the video writers. Cameras which missed the trigger get their last frame
+        repeated, with ID, ImageNumber and TimeStamp set to -1, so frame N of every video belongs to trigger N.
+        """
+        for c_id, frame in enumerate(frameset.frames):
+            if frame is None:
+                frame = self._last_synced_frames[c_id]
+                if frame is None:
+                    self.log.warning(f'Cam{c_id} missed frameset {frameset.index}, nothing to repeat')
+                    continue
+                meta = (-1, -1, -1)
+            else:
+                meta = frameset.meta[c_id]
+                previous = self._last_synced_frames[c_id]
+                if isinstance(frame, FrameSlot):
+                    frame.retain()
+                self._last_synced_frames[c_id] = frame
+                if isinstance(previous, FrameSlot):
+                    previous.release()
+            if isinstance(frame, FrameSlot):
+                frame.retain()
+            if self.write_timestamps:
+                self.video_writer_list[c_id].feed((frame, *meta))
+            else:
+                self.video_writer_list[c_id].feed(frame)
+
     def stop_multi_cam_record(self):
         self.log.debug('Stopping recording, waiting for join')
-        self.multi_record_thread.join()
+        if self.multi_record_thread:
+            self.multi_record_thread.join()
+        self._join_grab_workers()
+        if self.preview is not None:
+            self.preview.stop()
+        if self.frameset_assembler is not None:
+            try:
+                self.frameset_assembler.close()  # writes the remaining framesets
+            except QueueOverflow:
+                self.log.error('Writer queue overrun while writing the last framesets')
+            except WriterStopped as e:
+                self.log.error(e)
+            for frame in self._last_synced_frames:
+                if isinstance(frame, FrameSlot):
+                    frame.release()
+            self._last_synced_frames = []
+            self.frameset_assembler = None
         self.log.debug('thread joined,waiting for writers to finish')
         for writer in self.video_writer_list:
             writer.wait_to_finish()
             writer.stop()
         self.log.debug('writers finished')
+        if self.segment_index is not None:
+            self.segment_index.close()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()  # after the writers to get the final counts
+            self.metrics_exporter = None
         self.is_recording = False
         self.error_event.clear()
         self.stop_event = None
@@ -883,8 +1133,14 @@ class Recorder(object):
 
                 if grabResult.GetNumberOfSkippedImages() > 0:
                     self.log.warning(f'Cam{context_id}: Missed {grabResult.GetNumberOfSkippedImages()} frames')
+                    self.metrics[context_id].skipped += grabResult.GetNumberOfSkippedImages()
                 if grabResult.GrabSucceeded():
-                    if converter.ImageHasDestinationFormat(grabResult):
+                    self.metrics[context_id].grabbed += 1
+                    raw_format = self.raw_formats[context_id]
+                    if raw_format is not None:
+                        # keep native sensor format
+                        img = grabResult.GetArray()
+                    elif converter.ImageHasDestinationFormat(grabResult):
                         # no conversion required
                         img = grabResult.GetArray()
                     else:
@@ -902,28 +1158,144 @@ class Recorder(object):
                         self.video_writer_list[context_id].feed((img, img_nr_camera, img_nr, img_ts))
                     else:
                         self.video_writer_list[context_id].feed(img)
-                    self.multi_view_queue[context_id].put_nowait(img)
+                    if self.preview is not None:
+                        self.preview.publish(context_id, img)
                     # weirdly enough the recording does not mix up frames.. so maybe mixing up happens later ? in the queue
                     # or at the visualization ?
                     grabResult.Release()
                 else:
                     self.log.error(grabResult.ErrorCode, grabResult.ErrorDescription)
+                    self.metrics[context_id].grab_errors += 1
 
             except genicam.TimeoutException as e:
                 self.log.error(e)
                 self.error_event.set()
                 break
-            except Full:
-                self.log.error(f"Queue buffer{context_id}overrun !")
-                self.error_event.set()
-                break
             except QueueOverflow:
                 self.error_event.set()
                 self.log.error(f"Queue buffer{context_id}overrun !")
                 break
+            except WriterStopped as e:
+                self.error_event.set()
+                self.log.error(e)
+                break
         self.cam_array.StopGrabbing()
         self.is_recording = False
 
+    def _start_grab_workers(self, record: bool):
+        """Starts one grabbing thread per camera"""
+        self._active_grabbers = self.num_cams
+        self.frame_pools = {}
+        self.grab_threads = [Thread(target=self.cam_grab_worker, args=(c_id, record), name=f'grab_cam{c_id}')
+                             for c_id in range(self.num_cams)]
+        for thread in self.grab_threads:
+            thread.start()
+
+    def _join_grab_workers(self):
+        """Waits for all per camera grabbing threads to finish"""
+        for thread in self.grab_threads:
+            thread.join()
+        self.grab_threads = []
+
+    def cam_grab_worker(self, c_id: int, record: bool):
+        """
+        Grab images of a single camera in its own thread, replaces multi_cam_show/multi_cam_record if parallel_grab
+        is set or the backend has no multi camera grab loop. Each worker only feeds the writer and preview of its
+        camera. Pylon releases the GIL while waiting in RetrieveResult, so throughput scales with the number of cameras.
+        Images are copied once from the camera buffer into a slot of the FramePool of the camera, writer and preview
+        borrow the slot and release it when done.
+        :param c_id: index of the camera in cameras
+        :param record: feed the grabbed images to the video writer of the camera
+        """
+        cam = self.cameras[c_id]
+        raw_format = self.raw_formats[c_id] if record else None
+        pool = None
+        metrics = self.metrics[c_id]
+
+        try:
+            cam.start_grabbing(latest_only=not record)
+
+            # stop on errors of the other workers as well
+            while not self.stop_event.is_set() and not self.error_event.is_set():
+                try:
+                    frame = cam.grab(self.grab_timeout)
+                except GrabError as e:
+                    self.log.error(e)
+                    self.error_event.set()
+                    break
+                slot = None  # reference of this thread, until it is passed on or released
+                try:
+                    if frame.skipped > 0:
+                        metrics.skipped += frame.skipped
+                        if record:
+                            self.log.warning(f'Cam{c_id}: Missed {frame.skipped} frames')
+                    if frame.succeeded:
+                        metrics.grabbed += 1
+                        if raw_format is not None:
+                            shape = (frame.height, frame.width)
+                        else:
+                            shape = (frame.height, frame.width, 3)
+                        if pool is None or not pool.fits(shape):
+                            # allocated once with the first image
+                            pool = FramePool(self.frame_pool_size, shape)
+                            self.frame_pools[c_id] = pool
+                        slot = pool.acquire()
+
+                        convert_start = time.perf_counter()
+                        frame.copy_into(slot.array)  # converts to RGB unless recorded raw
+                        metrics.convert_time.add(time.perf_counter() - convert_start)
+                        if record and self.frameset_assembler is not None:
+                            # written once the frames of all cameras for this trigger arrived
+                            slot.retain()
+                            self.frameset_assembler.add(c_id, slot, frame.id, frame.image_number, frame.timestamp)
+                        elif record:
+                            slot.retain()
+                            if self.write_timestamps:
+                                self.video_writer_list[c_id].feed((slot, frame.id, frame.image_number, frame.timestamp))
+                            else:
+                                self.video_writer_list[c_id].feed(slot)
+                        if self.preview is not None:
+                            self.preview.publish(c_id, slot)  # passes on the reference of the grabbing thread
+                        else:
+                            slot.release()
+                        slot = None
+                    else:
+                        self.log.error(f'Cam{c_id}: {frame.error_description}')
+                        metrics.grab_errors += 1
+                    metrics.grab_cpu = time.thread_time()
+                except QueueOverflow:
+                    self.log.error(f"Video writer queue for camera {c_id} overrun !")
+                    self.error_event.set()
+                    break
+                except WriterStopped as e:
+                    self.log.error(e)
+                    self.error_event.set()
+                    break
+                except PoolExhausted:
+                    self.log.error(f"No free frame buffer for camera {c_id} !")
+                    self.error_event.set()
+                    break
+                except Exception as e:  # e.g. a conversion error of the camera backend
+                    self.log.exception(f'Cam{c_id}: grabbing failed: {e}')
+                    self.error_event.set()
+                    break
+                finally:
+                    if slot is not None:
+                        slot.release()  # the frame could not be passed on
+                    frame.release()
+            cam.stop_grabbing()
+        except Exception as e:  # starting or stopping the camera failed
+            self.log.exception(f'Cam{c_id}: {e}')
+            self.error_event.set()
+        finally:
+            with self._grab_lock:
+                self._active_grabbers -= 1
+                if self._active_grabbers == 0:
+                    if record:
+                        self.is_recording = False
+                    else:
+                        self.is_viewing = False
+
 
 if __name__ == "__main__":
     baslerRec = Recorder()
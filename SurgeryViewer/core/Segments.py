@@ -0,0 +1,224 @@
+"""
+Segmented recording: the video of each camera is split into segments of SEGMENT_MINUTES or SEGMENT_GB.
+
+All cameras start a new segment at the same frame number, frame N of every camera's segment list is the N-th frame
+written for that camera (the trigger index with framesets). Time based segments are segment_frames long, once the
+video of a camera exceeds the size limit a boundary shortly ahead of the newest frame is scheduled for all cameras.
+The writer of the next segment is opened ahead of time and finished segments are closed in the background, so the
+grabbing threads never wait for a rotation. Finished segments are added to the session's segment index (json).
+"""
+import json
+import logging
+import os
+from threading import Lock, Thread
+
+from SurgeryViewer.utils.raw_convert import meta_path
+from SurgeryViewer.utils.TimestampSidecar import timestamps_path
+
+
+class SegmentSchedule:
+    """Frame numbers at which segments end, shared by the SegmentedWriters of all cameras of a session"""
+    def __init__(self, segment_frames: int = None):
+        """
+        :param segment_frames: frames per segment, None for size based segments only
+        """
+        self.segment_frames = segment_frames
+        self.ends = []  # end (exclusive) of each segment which was scheduled
+        self.committed = 0  # number of segments which ended on at least one camera, their ends are fixed
+        self._lock = Lock()
+
+    def end(self, segment: int) -> [int, None]:
+        """first frame after segment, None if the segment does not end yet"""
+        with self._lock:
+            if segment < len(self.ends):
+                return self.ends[segment]
+            if self.segment_frames is None:
+                return None
+            while len(self.ends) <= segment:
+                self.ends.append((self.ends[-1] if self.ends else 0) + self.segment_frames)
+            return self.ends[segment]
+
+    def request_end(self, segment: int, frame: int):
+        """end segment at frame (or earlier if already scheduled), ignored once a camera passed the end"""
+        with self._lock:
+            if segment < self.committed:
+                return
+            while len(self.ends) <= segment:
+                self.ends.append(None)
+            if self.ends[segment] is None or frame < self.ends[segment]:
+                self.ends[segment] = frame
+            # later segments are counted from the new end
+            del self.ends[segment + 1:]
+
+    def commit(self, segment: int):
+        with self._lock:
+            self.committed = max(self.committed, segment + 1)
+
+
+class SegmentIndex:
+    """Json file listing the finished segments of a session, rewritten whenever a segment of a camera is closed"""
+    def __init__(self, path: str, camera_names: list, fps: float, segment_frames: int = None,
+                 segment_gb: float = None):
+        self.path = path
+        self.index = {'fps': fps, 'cameras': list(camera_names), 'segment_frames': segment_frames,
+                      'segment_gb': segment_gb, 'complete': False, 'segments': []}
+        self.log = logging.getLogger('SegmentIndex')
+        self._lock = Lock()
+        self._save()
+
+    def add(self, segment: int, camera: str, entry: dict):
+        """
+        :param entry: file, timestamps (sidecar), first_frame, last_frame (global frame numbers of the camera),
+        first/last camera timestamp
+        """
+        with self._lock:
+            segments = self.index['segments']
+            while len(segments) <= segment:
+                segments.append({'segment': len(segments), 'cameras': {}})
+            segments[segment]['cameras'][camera] = entry
+            self._save()
+
+    def close(self):
+        with self._lock:
+            self.index['complete'] = True
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.index, f, indent=4)
+            os.replace(tmp_path, self.path)  # readers never see a partial file
+        except OSError as e:
+            self.log.error(f'Could not write the segment index {self.path}: {e}')
+
+
+def load_segment_index(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def find_segment(index: dict, camera: str, frame: int) -> [dict, None]:
+    """entry of the segment of camera containing the global frame number, None if not recorded"""
+    for segment in index['segments']:
+        entry = segment['cameras'].get(camera)
+        if entry is not None and entry['first_frame'] <= frame <= entry['last_frame']:
+            return entry
+    return None
+
+
+class SegmentedWriter:
+    """
+    Video writer of one camera splitting the recording into segments, same interface as VideoWriterFast.
+    make_writer(segment) creates the (started) writer of a segment.
+    """
+    def __init__(self, camera: str, make_writer, schedule: SegmentSchedule, index: SegmentIndex,
+                 segment_bytes: int = None, size_check_every: int = 100, rotation_margin: int = 30):
+        """
+        :param segment_bytes: size of the video after which a new segment is scheduled, None for no limit
+        :param size_check_every: frames between checks of the video size
+        :param rotation_margin: frames between a size triggered request and the boundary, so no camera passed it yet
+        """
+        self.camera = camera
+        self.make_writer = make_writer
+        self.schedule = schedule
+        self.index = index
+        self.segment_bytes = segment_bytes
+        self.size_check_every = size_check_every
+        self.rotation_margin = rotation_margin
+        self.log = logging.getLogger('SegmentedWriter')
+
+        self.segment = 0
+        self.frame_count = 0  # frames fed, the global frame number of the next frame
+        self.current = make_writer(0)
+        self._segment_info = self._new_info()
+        self._next = None
+        self._next_thread = None
+        self._finishing = []  # threads closing finished segments
+        self._preopen()
+
+    @property
+    def write_speed(self):
+        return self.current.write_speed
+
+    def _new_info(self) -> dict:
+        return {'file': os.path.basename(self.current.video_path),
+                'timestamps': os.path.basename(timestamps_path(self.current.video_path)),
+                'first_frame': self.frame_count,
+                'last_frame': self.frame_count - 1, 'first_timestamp': None, 'last_timestamp': None}
+
+    def _preopen(self):
+        """create the writer of the next segment in the background"""
+        def open_next(segment):
+            self._next = self.make_writer(segment)
+        self._next_thread = Thread(target=open_next, args=(self.segment + 1,), name=f'open_segment_{self.camera}')
+        self._next_thread.daemon = True
+        self._next_thread.start()
+
+    def _rotate(self):
+        self.schedule.commit(self.segment)
+        self._next_thread.join()  # opened long ago unless segments are very short
+        finished, info = self.current, self._segment_info
+        thread = Thread(target=self._finish, args=(finished, self.segment, info), name=f'close_segment_{self.camera}')
+        thread.start()
+        self._finishing = [t for t in self._finishing if t.is_alive()] + [thread]
+        self.current = self._next
+        self._next = None
+        self.segment += 1
+        self._segment_info = self._new_info()
+        self.log.info(f'{self.camera}: segment {self.segment} starts at frame {self.frame_count}')
+        self._preopen()
+
+    def _finish(self, writer, segment: int, info: dict):
+        writer.wait_to_finish()
+        writer.stop()
+        self.index.add(segment, self.camera, info)
+
+    def feed(self, frame):
+        end = self.schedule.end(self.segment)
+        if end is not None and self.frame_count >= end:
+            self._rotate()
+        self.current.feed(frame)
+        info = self._segment_info
+        info['last_frame'] = self.frame_count
+        if isinstance(frame, (list, tuple)) and frame[-1] != -1:  # repeated frames of missed triggers have no meta
+            if info['first_timestamp'] is None:
+                info['first_timestamp'] = int(frame[-1])
+            info['last_timestamp'] = int(frame[-1])
+        self.frame_count += 1
+        if self.segment_bytes is not None and self.frame_count % self.size_check_every == 0:
+            try:
+                if os.path.getsize(self.current.video_path) >= self.segment_bytes:
+                    self.schedule.request_end(self.segment, self.frame_count + self.rotation_margin)
+            except OSError:
+                pass  # encoder did not create the file yet
+
+    def running(self):
+        return self.current.running()
+
+    def is_active(self):
+        return self.current.is_active()
+
+    def queue_fill(self) -> float:
+        return self.current.queue_fill()
+
+    def wait_to_finish(self):
+        self.current.wait_to_finish()
+
+    def stop(self):
+        self.current.stop()
+        if self.frame_count > self._segment_info['first_frame']:
+            self.index.add(self.segment, self.camera, self._segment_info)
+        for thread in self._finishing:
+            thread.join()
+        # the pre-opened writer of the next segment was never used
+        self._next_thread.join()
+        if self._next is not None:
+            self._next.stop()
+            for path in (self._next.video_path, meta_path(self._next.video_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._next = None
+
+    def get_state(self):
+        return f'Segment {self.segment}; ' + self.current.get_state()
@@ -0,0 +1,164 @@
+import math
+import time
+
+import cv2
+import numpy as np
+
+from SurgeryViewer.core.CameraBackend import CameraBackend, Camera, GrabbedFrame, GrabTimeout, GrabError
+from SurgeryViewer.utils.raw_convert import BAYER2RGB
+
+SYNTHETIC_PIXEL_FORMATS = ('Mono8', 'BayerRG8', 'BayerBG8', 'BayerGR8', 'BayerGB8', 'RGB8')
+
+
+class SyntheticFrame(GrabbedFrame):
+    def __init__(self, image: np.ndarray, pixel_format: str, **kwargs):
+        super().__init__(height=image.shape[0], width=image.shape[1], **kwargs)
+        self.image = image
+        self.pixel_format = pixel_format
+
+    def copy_into(self, out: np.ndarray):
+        if out.shape == self.image.shape:
+            np.copyto(out, self.image)
+        elif self.pixel_format in BAYER2RGB:
+            cv2.cvtColor(self.image, BAYER2RGB[self.pixel_format], dst=out)
+        else:
+            cv2.cvtColor(self.image, cv2.COLOR_GRAY2RGB, dst=out)
+
+
+class SyntheticCamera(Camera):
+    """
+    Camera generating images at a fixed rate without hardware, for load and regression tests of the pipeline.
+    Images cycle through num_patterns pre generated images (a moving gradient with noise, so the encoders have some
+    work). Frames are due every 1/fps s (also with hw_trigger) plus gaussian jitter, frames which are not fetched in
+    time are skipped like on a real camera: with latest_only all but the newest, otherwise those not fitting into
+    queue_size buffers. With drop_rate frames are lost at random, which shows up as skipped images and gaps in the IDs.
+    """
+    def __init__(self, serial: str, width: int = 1280, height: int = 1024, pixel_format: str = 'BayerRG8',
+                 jitter: float = 0.0, drop_rate: float = 0.0, queue_size: int = 512, num_patterns: int = 16,
+                 seed: int = None):
+        """
+        :param pixel_format: one of SYNTHETIC_PIXEL_FORMATS
+        :param jitter: standard deviation of the frame times in s
+        :param drop_rate: probability of a frame to get lost
+        :param queue_size: frames buffered by the camera when not grabbing latest_only
+        """
+        super().__init__(serial)
+        if pixel_format not in SYNTHETIC_PIXEL_FORMATS:
+            raise ValueError(f'Unsupported pixel format {pixel_format}')
+        self.name = serial
+        self.context = 0
+        self.width = width
+        self.height = height
+        self._pixel_format = pixel_format
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.queue_size = queue_size
+        self.num_patterns = num_patterns
+        self.fps = 30
+        self.rng = np.random.default_rng(seed)
+        self.patterns = None  # generated on open
+        self._latest_only = False
+        self._t0 = None
+        self._next_index = 0
+        self._image_number = 0
+
+    @property
+    def pixel_format(self) -> str:
+        return self._pixel_format
+
+    def get_resolution(self) -> tuple:
+        return self.width, self.height
+
+    def _make_patterns(self) -> list:
+        x = np.linspace(0, 255, self.width, dtype=np.float32)
+        y = np.linspace(0, 64, self.height, dtype=np.float32)
+        gradient = x[None, :] * 0.75 + y[:, None]
+        shape = (self.height, self.width, 3) if self._pixel_format == 'RGB8' else (self.height, self.width)
+        patterns = []
+        for idx in range(self.num_patterns):
+            img = np.roll(gradient, idx * 8, axis=1)
+            if len(shape) == 3:
+                img = np.stack([img, np.roll(img, self.width // 3, axis=1), np.roll(img, 2 * self.width // 3, axis=1)],
+                               -1)
+            img = img + self.rng.integers(0, 16, shape)
+            patterns.append(np.clip(img, 0, 255).astype(np.uint8))
+        return patterns
+
+    def open(self):
+        if self.patterns is None:
+            self.patterns = self._make_patterns()
+
+    def close(self):
+        self.patterns = None
+
+    def is_open(self) -> bool:
+        return self.patterns is not None
+
+    def configure(self, fps: float, hw_trigger: bool = False):
+        self.open()
+        self.fps = fps
+
+    def start_grabbing(self, latest_only: bool = False):
+        if not self.is_open():
+            raise GrabError(f'{self.name} is not open')
+        self._latest_only = latest_only
+        self._t0 = time.monotonic()
+        self._next_index = 0
+        self._image_number = 0
+
+    def grab(self, timeout_ms: int) -> SyntheticFrame:
+        if self._t0 is None:
+            raise GrabError(f'{self.name} is not grabbing')
+        deadline = time.monotonic() + timeout_ms / 1000
+        skipped = 0
+        while True:
+            now = time.monotonic()
+            due = math.floor((now - self._t0) * self.fps)  # newest frame which is due
+            if self._latest_only and due > self._next_index:
+                skipped += due - self._next_index
+                self._next_index = due
+            elif due - self._next_index > self.queue_size:
+                # camera buffers overflowed, the oldest frames are overwritten
+                skipped += due - self._next_index - self.queue_size
+                self._next_index = due - self.queue_size
+            ready = self._t0 + self._next_index / self.fps
+            if self.jitter:
+                ready += min(max(self.rng.normal(0, self.jitter), -0.5 / self.fps), 0.5 / self.fps)
+            if ready > deadline:
+                time.sleep(max(0.0, deadline - now))
+                raise GrabTimeout(f'{self.name}: no frame within {timeout_ms} ms')
+            if ready > now:
+                time.sleep(ready - now)
+            index = self._next_index
+            self._next_index += 1
+            if self.drop_rate and self.rng.random() < self.drop_rate:
+                skipped += 1
+                continue
+            self._image_number += 1
+            return SyntheticFrame(self.patterns[index % self.num_patterns], self._pixel_format, id=index,
+                                  image_number=self._image_number, timestamp=int((ready - self._t0) * 1e9),
+                                  skipped=skipped)
+
+    def stop_grabbing(self):
+        self._t0 = None
+
+
+class SyntheticBackend(CameraBackend):
+    """
+    num_cams SyntheticCameras, all further arguments are passed to the cameras. They are named by their serial and
+    kept out of the CameraRegistry, so test runs do not change the names of real cameras
+    """
+    name = 'synthetic'
+    registered = False
+
+    def __init__(self, num_cams: int = 2, seed: int = None, **camera_kwargs):
+        self.num_cams = num_cams
+        self.seed = seed
+        self.camera_kwargs = camera_kwargs
+
+    def enumerate(self) -> list:
+        cameras = [SyntheticCamera(f'SYN{c_id:05d}', seed=None if self.seed is None else self.seed + c_id,
+                                   **self.camera_kwargs) for c_id in range(self.num_cams)]
+        for c_id, cam in enumerate(cameras):
+            cam.context = c_id
+        return cameras
@@ -0,0 +1,185 @@
+"""
+Headless recording without the GUI, e.g. on rack machines without a display
+
+    python -m SurgeryViewer.record_cli --settings default.settings.json --session mouse01 --duration 600
+
+Records all connected cameras until the duration elapsed, Ctrl+C/SIGTERM or an error and prints a summary of the
+written and dropped frames per camera. Exits with 1 if the recording stopped because of an error.
+"""
+import argparse
+import datetime
+import logging
+import signal
+import sys
+import time
+from pathlib import Path
+from threading import Event
+
+from SurgeryViewer.core.Recorder import Recorder
+from SurgeryViewer.core.CameraBackend import get_backend
+from SurgeryViewer.configs.params import SAVE_TIMESTAMPS, USE_HW_TRIGGER, LOG2FILE, CAMERA_BACKEND, AUTO_SELECT_CODEC, \
+    WRITER_BACKEND
+
+log = logging.getLogger('record_cli')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Record all connected Basler cameras without the GUI')
+    parser.add_argument('--settings', default=None,
+                        help='settings json saved by the GUI, defaults to default_settings.settings.json or '
+                             'default.settings.json if present')
+    parser.add_argument('--session', default='test_sess', help='session id, prefix of the video names')
+    parser.add_argument('--duration', type=float, default=None, help='recording time in s, until Ctrl+C if not set')
+    parser.add_argument('--fps', type=float, default=None, help='frame rate, overrides the settings file')
+    parser.add_argument('--save-path', default=None, help='output folder, overrides the settings file')
+    parser.add_argument('--codec', default=None, help='video codec, overrides the settings file')
+    parser.add_argument('--crf', type=int, default=None, help='compression level, overrides the settings file')
+    parser.add_argument('--writer', default=WRITER_BACKEND, choices=['gear', 'pipe'],
+                        help='video writer, pipe writes straight to ffmpeg which also demosaics Bayer cameras')
+    parser.add_argument('--container', default=None, choices=['mp4', 'fmp4', 'mkv'],
+                        help='video container, fmp4 and mkv stay readable if the recording is aborted, overrides '
+                             'VIDEO_CONTAINER')
+    parser.add_argument('--segment-minutes', type=float, default=None,
+                        help='start new video files every N minutes, overrides SEGMENT_MINUTES')
+    parser.add_argument('--segment-gb', type=float, default=None,
+                        help='start new video files once a video exceeds N GB, overrides SEGMENT_GB')
+    parser.add_argument('--preset', default=None, help='encoder preset, e.g. veryfast for libx264')
+    parser.add_argument('--auto-codec', action='store_true', default=AUTO_SELECT_CODEC,
+                        help='use the codec which keeps up according to the codec profile of this machine')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='measure the codecs before recording and use the one which keeps up')
+    parser.add_argument('--hw-trigger', action='store_true', default=USE_HW_TRIGGER,
+                        help='cameras are triggered on TRIGGER_LINE_IN')
+    parser.add_argument('--timestamps', action='store_true', default=SAVE_TIMESTAMPS,
+                        help='write the frame timestamps next to the videos')
+    parser.add_argument('--backend', default=CAMERA_BACKEND, choices=['pylon', 'synthetic'],
+                        help='camera backend, synthetic generates images without cameras for load tests')
+    parser.add_argument('--synthetic-cams', type=int, default=2, help='number of synthetic cameras')
+    parser.add_argument('--synthetic-size', type=int, nargs=2, default=(1280, 1024), metavar=('WIDTH', 'HEIGHT'),
+                        help='resolution of the synthetic cameras')
+    parser.add_argument('--synthetic-format', default='BayerRG8', help='pixel format of the synthetic cameras')
+    parser.add_argument('--status-interval', type=float, default=10, help='seconds between status logs, 0 for none')
+    parser.add_argument('-v', '--verbose', action='store_true', help='debug logging')
+    return parser.parse_args(argv)
+
+
+def find_settings_file(settings: [str, None]) -> [str, None]:
+    if settings:
+        return settings
+    for default in ('default_settings.settings.json', 'default.settings.json'):
+        if Path(default).exists():
+            return default
+    return None
+
+
+def summarize(recorder: Recorder) -> str:
+    """frames written and dropped per camera"""
+    metrics = recorder.get_metrics()
+    if metrics is None:
+        return 'Nothing recorded'
+    lines = [f"Recorded {metrics['elapsed_s']:.1f} s"]
+    for cam in metrics['cameras']:
+        not_written = max(0, cam['grabbed'] - cam['written'])  # repeated frames of missed triggers count as written
+        dropped = cam['skipped'] + cam['grab_errors'] + not_written
+        lines.append(f"{cam['name']}: written {cam['written']}, dropped {dropped} (skipped {cam['skipped']}, "
+                     f"grab errors {cam['grab_errors']}, not written {not_written}), "
+                     f"spilled to disk {cam['spilled']}, max queue {cam['queue_hwm']}")
+    return '\n'.join(lines)
+
+
+def status(recorder: Recorder) -> str:
+    metrics = recorder.get_metrics()
+    return ' | '.join(f"{cam['name']}: {cam['grab_fps']:.1f} FPS grabbed, {cam['encode_fps']:.1f} FPS encoded, "
+                      f"{cam['skipped']} skipped" for cam in metrics['cameras'])
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    handlers = [logging.StreamHandler()]
+    if LOG2FILE:
+        log_path = Path('logs')
+        log_path.mkdir(exist_ok=True)
+        handlers.append(logging.FileHandler(log_path / f'record_cli{datetime.datetime.now().strftime("%m%d_%H%M")}.log',
+                                            mode='w'))
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format=log_format, handlers=handlers)
+
+    if args.backend == 'synthetic':
+        backend = get_backend('synthetic', num_cams=args.synthetic_cams, width=args.synthetic_size[0],
+                              height=args.synthetic_size[1], pixel_format=args.synthetic_format)
+    else:
+        backend = get_backend(args.backend)
+    recorder = Recorder(write_timestamps=args.timestamps, backend=backend)
+    recorder.live_view = False  # nobody looks, leave the cpu to the encoders
+    recorder.writer_backend = args.writer
+    recorder.scan_cams()
+    if not recorder.cameras:
+        log.error('No cameras found')
+        return 2
+    recorder.connect_cams()
+
+    settings_file = find_settings_file(args.settings)
+    if settings_file is not None:
+        cam_lib = recorder.load_settings(settings_file)
+        recorder.apply_general_settings(cam_lib)
+        log.info(f'Loaded settings from {settings_file}')
+    else:
+        log.warning('No settings file found, using the current camera settings')
+    if args.fps is not None:
+        recorder.fps = args.fps
+    if args.save_path is not None:
+        recorder.save_path = args.save_path
+    if args.codec is not None:
+        recorder.codec = args.codec
+    if args.crf is not None:
+        recorder.crf = args.crf
+    if args.container is not None:
+        recorder.video_container = args.container
+    if args.segment_minutes is not None:
+        recorder.segment_minutes = args.segment_minutes
+    if args.segment_gb is not None:
+        recorder.segment_gb = args.segment_gb
+    if args.preset is not None:
+        recorder.codec_presets[recorder.codec] = args.preset
+    if args.calibrate or args.auto_codec:
+        recorder.select_codec(calibrate=args.calibrate)
+    max_fps = recorder.get_codec_max_fps()
+    if max_fps is not None and max_fps < recorder.fps:
+        log.warning(f'{recorder.codec} is expected to encode only {max_fps:.1f} FPS, recording may overflow')
+
+    stop_event = Event()
+
+    def request_stop(signum, frame):
+        log.info('Stop requested')
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    recorder.run_multi_cam_record(stop_event, filename=args.session, use_hw_trigger=args.hw_trigger)
+    start = time.monotonic()
+    last_status = start
+    while not stop_event.is_set():
+        stop_event.wait(0.2)
+        if recorder.error_event.is_set() or not recorder.is_recording:
+            break
+        now = time.monotonic()
+        if args.duration is not None and now - start >= args.duration:
+            break
+        if args.status_interval and now - last_status >= args.status_interval:
+            log.info(status(recorder))
+            last_status = now
+    failed = recorder.error_event.is_set()
+    stop_event.set()
+    recorder.stop_multi_cam_record()
+    recorder.disconnect_cams()
+
+    print(summarize(recorder))
+    if failed:
+        log.error('Recording stopped because of an error')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
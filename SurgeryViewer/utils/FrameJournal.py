@@ -0,0 +1,110 @@
+import mmap
+import os
+from threading import Lock
+
+import numpy as np
+
+META_DTYPE = np.dtype([('valid', '<i8'), ('ID', '<i8'), ('ImageNumber', '<i8'), ('TimeStamp', '<i8')])
+
+
+class JournalFull(Exception):
+    """Raised if the journal would grow beyond its maximal size"""
+    pass
+
+
+class FrameJournal:
+    """
+    Append only journal of fixed size frames on local disk, used by the VideoWriterFast to park frames while the
+    encoder falls behind. The file is memory mapped and grows in chunks, records are read back in the order they were
+    written. Once all frames are read the journal starts over at the beginning of the file, so it only grows to the
+    largest backlog. Each record holds (ID, ImageNumber, TimeStamp) of the frame followed by the frame data.
+    """
+    def __init__(self, path: str, frame_shape: tuple, dtype=np.uint8, chunk_frames: int = 64, max_bytes: int = None):
+        """
+        :param path: journal file, removed on close
+        :param frame_shape: shape of all frames
+        :param chunk_frames: number of records the file grows by
+        :param max_bytes: maximal file size, None for unlimited
+        """
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.record_bytes = META_DTYPE.itemsize + self.frame_bytes
+        self.chunk_frames = chunk_frames
+        self.max_bytes = max_bytes
+        self.capacity = 0  # records fitting into the file
+        self.read_idx = 0
+        self.write_idx = 0
+        self.total_written = 0
+        self._lock = Lock()
+        self._file = open(path, 'w+b')
+        self._mm = None
+        self._grow()
+
+    def __len__(self):
+        return self.write_idx - self.read_idx
+
+    def fits(self, frame: np.ndarray) -> bool:
+        return frame.shape == self.frame_shape and frame.dtype == self.dtype
+
+    def _grow(self):
+        new_size = (self.capacity + self.chunk_frames) * self.record_bytes
+        if self.max_bytes is not None and self.capacity > 0 and new_size > self.max_bytes:
+            raise JournalFull
+        if self._mm is not None:
+            self._mm.close()
+        self._file.truncate(new_size)
+        self._mm = mmap.mmap(self._file.fileno(), new_size)
+        self.capacity += self.chunk_frames
+
+    def append(self, frame: np.ndarray, meta: tuple = None):
+        """
+        Add a frame to the end of the journal
+        :param frame: frame of frame_shape
+        :param meta: (ID, ImageNumber, TimeStamp) of the frame
+        """
+        header = np.zeros(1, META_DTYPE)
+        if meta is not None:
+            header[0] = (1, *meta)
+        with self._lock:
+            if self.write_idx == self.capacity:
+                self._grow()
+            offset = self.write_idx * self.record_bytes
+            self._mm[offset:offset + META_DTYPE.itemsize] = header.tobytes()
+            offset += META_DTYPE.itemsize
+            self._mm[offset:offset + self.frame_bytes] = memoryview(np.ascontiguousarray(frame)).cast('B')
+            self.write_idx += 1
+            self.total_written += 1
+
+    def pop(self) -> [tuple, None]:
+        """
+        Oldest frame not read yet
+        :return: (frame, meta) with meta None if no meta was stored, None if the journal is empty
+        """
+        with self._lock:
+            if self.read_idx == self.write_idx:
+                return None
+            offset = self.read_idx * self.record_bytes
+            header = np.frombuffer(self._mm, META_DTYPE, 1, offset)[0]
+            meta = (int(header['ID']), int(header['ImageNumber']), int(header['TimeStamp'])) if header['valid'] \
+                else None
+            del header  # release the buffer of the mmap before it might get resized
+            frame = np.frombuffer(self._mm, self.dtype, int(np.prod(self.frame_shape)),
+                                  offset + META_DTYPE.itemsize).reshape(self.frame_shape).copy()
+            self.read_idx += 1
+            if self.read_idx == self.write_idx:
+                # everything is read, start over at the beginning of the file
+                self.read_idx = self.write_idx = 0
+            return frame, meta
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            self._file.close()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
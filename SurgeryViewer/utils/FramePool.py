@@ -0,0 +1,75 @@
+from collections import deque
+from threading import Condition
+
+import numpy as np
+
+
+class PoolExhausted(Exception):
+    """Raised if no free frame slot is available in time"""
+    pass
+
+
+class FrameSlot:
+    """
+    Reusable frame buffer of a FramePool. The grabbing thread fills the array and hands the slot to its consumers
+    (video writer, live view) without copying. Every consumer calls retain() before it gets the slot and release()
+    when done, the slot goes back to the pool once the last reference is released.
+    """
+    __slots__ = ('pool', 'index', 'array', '_refs')
+
+    def __init__(self, pool, index: int, array: np.ndarray):
+        self.pool = pool
+        self.index = index
+        self.array = array
+        self._refs = 0
+
+    def retain(self, n: int = 1):
+        with self.pool.lock:
+            self._refs += n
+        return self
+
+    def release(self):
+        with self.pool.lock:
+            self._refs -= 1
+            if self._refs != 0:
+                return
+            self.pool.free.append(self)
+            self.pool.lock.notify()
+
+
+class FramePool:
+    """
+    Fixed number of preallocated frame buffers of one camera, so the grabbing loop does not allocate per frame and the
+    memory use is bounded. Free slots are reused last in first out, pages of slots that are never needed are never
+    touched and therefore not resident.
+    """
+    def __init__(self, num_slots: int, shape: tuple, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.num_slots = num_slots
+        self.lock = Condition()
+        self.slots = [FrameSlot(self, idx, np.empty(self.shape, self.dtype)) for idx in range(num_slots)]
+        self.free = deque(reversed(self.slots))
+
+    def acquire(self, timeout: float = 0) -> FrameSlot:
+        """
+        Get a free slot holding one reference
+        :param timeout: seconds to wait for a slot to be released, None waits forever
+        :raises PoolExhausted: if all slots are still in use
+        """
+        with self.lock:
+            if not self.free and not self.lock.wait_for(lambda: self.free, timeout):
+                raise PoolExhausted
+            slot = self.free.pop()
+            slot._refs = 1
+            return slot
+
+    def fits(self, shape: tuple, dtype=np.uint8) -> bool:
+        return self.shape == tuple(shape) and self.dtype == np.dtype(dtype)
+
+    @property
+    def free_slots(self) -> int:
+        return len(self.free)
+
+    def get_state(self) -> str:
+        return f'Pool {self.num_slots - self.free_slots}/{self.num_slots}'
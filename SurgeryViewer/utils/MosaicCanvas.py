@@ -0,0 +1,98 @@
+"""
+Live view of many cameras as one image.
+
+Every camera gets a tile of a preallocated RGB canvas. Its previews are resized into the tile (centered, keeping the
+aspect ratio) by the thread producing them, so the GUI draws a single image per tick however many cameras there are.
+Positions in the mosaic map back to the camera and its pixel coordinates, e.g. for markers.
+"""
+import math
+from threading import Lock
+
+import cv2
+import numpy as np
+
+from SurgeryViewer.configs.params import MOSAIC_TILE_SIZE
+
+
+class MosaicCanvas:
+    """Tiles of the images of num_cams cameras in one canvas, row by row"""
+    def __init__(self, num_cams: int, tile_size: tuple = MOSAIC_TILE_SIZE, columns: int = None):
+        """
+        :param tile_size: (width, height) of the tile of each camera in canvas pixels
+        :param columns: tiles per row, defaults to a square grid
+        """
+        self.num_cams = num_cams
+        self.tile_size = (int(tile_size[0]), int(tile_size[1]))
+        self.columns = columns or max(math.ceil(math.sqrt(num_cams)), 1)
+        self.rows = max(math.ceil(num_cams / self.columns), 1)
+        shape = (self.rows * self.tile_size[1], self.columns * self.tile_size[0], 3)
+        self.canvas = np.zeros(shape, np.uint8)  # written by place
+        self._front = np.zeros(shape, np.uint8)  # consistent copy handed out by snapshot
+        self._placement = [None] * num_cams  # (x, y, width, height, camera pixels per canvas pixel) of each image
+        self._lock = Lock()
+
+    def tile_origin(self, c_id: int) -> tuple:
+        """(x, y) of the top left corner of the tile of a camera"""
+        return (c_id % self.columns) * self.tile_size[0], (c_id // self.columns) * self.tile_size[1]
+
+    def place(self, c_id: int, image: np.ndarray, scale: float = 1):
+        """
+        Resize an image of a camera into its tile
+        :param image: (height, width), (height, width, 1) or (height, width, 3) uint8
+        :param scale: camera pixels per image pixel, e.g. the downsampling factor of a preview
+        """
+        if image.ndim == 3 and image.shape[2] == 1:
+            image = image[:, :, 0]
+        tile_width, tile_height = self.tile_size
+        factor = min(tile_width / image.shape[1], tile_height / image.shape[0])
+        width, height = max(int(image.shape[1] * factor), 1), max(int(image.shape[0] * factor), 1)
+        x, y = self.tile_origin(c_id)
+        x += (tile_width - width) // 2
+        y += (tile_height - height) // 2
+        interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_NEAREST
+        if image.ndim == 2:
+            image = cv2.resize(image, (width, height), interpolation=interpolation)
+        with self._lock:
+            placement = (x, y, width, height, scale / factor)
+            if self._placement[c_id] is None or self._placement[c_id][:4] != placement[:4]:
+                tile_x, tile_y = self.tile_origin(c_id)
+                self.canvas[tile_y:tile_y + tile_height, tile_x:tile_x + tile_width] = 0
+            self._placement[c_id] = placement
+            target = self.canvas[y:y + height, x:x + width]
+            if image.ndim == 2:
+                cv2.cvtColor(image, cv2.COLOR_GRAY2RGB, dst=target)
+            else:
+                cv2.resize(image, (width, height), dst=target, interpolation=interpolation)
+
+    def snapshot(self) -> np.ndarray:
+        """
+        Copy of the canvas which is not written while it is shown. The same array is reused by the next call, only
+        call it from the thread showing the mosaic
+        """
+        with self._lock:
+            np.copyto(self._front, self.canvas)
+        return self._front
+
+    def locate(self, x: float, y: float) -> [tuple, None]:
+        """(camera index, x, y in camera pixels) of a canvas position, None outside of the camera images"""
+        if x < 0 or y < 0:
+            return None
+        c_id = int(y // self.tile_size[1]) * self.columns + int(x // self.tile_size[0])
+        if int(x // self.tile_size[0]) >= self.columns or c_id >= self.num_cams or self._placement[c_id] is None:
+            return None
+        image_x, image_y, width, height, scale = self._placement[c_id]
+        if not (image_x <= x < image_x + width and image_y <= y < image_y + height):
+            return None
+        return c_id, (x - image_x) * scale, (y - image_y) * scale
+
+    def to_canvas(self, c_id: int, x: float, y: float) -> [tuple, None]:
+        """canvas position of a camera pixel, None before the camera's first image"""
+        if self._placement[c_id] is None:
+            return None
+        image_x, image_y, _, _, scale = self._placement[c_id]
+        return image_x + x / scale, image_y + y / scale
+
+    def clear(self):
+        with self._lock:
+            self.canvas[:] = 0
+            self._placement = [None] * self.num_cams
@@ -0,0 +1,182 @@
+import math
+import time
+from collections import namedtuple
+from threading import Thread, Lock, Event
+
+import cv2
+import numpy as np
+
+from SurgeryViewer.utils.FramePool import FrameSlot
+from SurgeryViewer.utils.raw_convert import bayer_preview
+
+PreviewFrame = namedtuple('PreviewFrame', ['image', 'scale', 'grab_time'])
+
+MOSAIC_ID = -1  # camera index of the mosaic of all cameras, see set_mosaic
+
+
+class PreviewChannel:
+    """
+    Latest frame only live view of multiple cameras, decoupled from the recording.
+    Grabbing threads publish every frame, only the newest one per camera is kept and older ones are dropped (and their
+    FrameSlot released) right away. A separate thread downsamples the newest frames to the display size at display_fps,
+    the GUI picks them up with get_latest. A slow display thus never blocks or aborts a recording.
+    on_ready(c_id) is called from the preview thread whenever a new preview of a camera is ready, so the GUI does not
+    have to poll.
+    With a MosaicCanvas set, the previews of all cameras are packed into it instead and on_ready(MOSAIC_ID) is called
+    once per cycle in which any camera changed.
+    """
+    def __init__(self, num_cams: int, display_fps: float = 30, max_size: int = 640, raw_formats: list = None,
+                 on_ready=None):
+        """
+        :param num_cams: number of cameras
+        :param display_fps: rate at which new previews are produced
+        :param max_size: default maximal width/height of the previews until set_target_size is called
+        :param raw_formats: pixel format of each camera delivering raw bayer frames, None for RGB/Mono frames
+        :param on_ready: callback(c_id) for new previews, must not block (e.g. emit a Qt signal)
+        """
+        self.num_cams = num_cams
+        self.display_fps = display_fps
+        self.raw_formats = raw_formats if raw_formats else [None] * num_cams
+        self.target_sizes = [(max_size, max_size)] * num_cams  # (width, height)
+        self._pending = [None] * num_cams  # newest published frame, (frame, grab_time)
+        self._ready = [None] * num_cams  # newest downsampled PreviewFrame not yet fetched by the GUI
+        self.published = [0] * num_cams
+        self.dropped = [0] * num_cams  # frames replaced before they were shown
+        self.shown = [0] * num_cams  # previews handed to the GUI
+        self.frame_age = [None] * num_cams  # s from publishing a frame until the GUI fetched its preview, averaged
+        self.on_ready = on_ready
+        self.mosaic = None  # MosaicCanvas the previews are packed into, see set_mosaic
+        self._mosaic_ready = False
+        self._placed = {}  # camera index -> grab_time of the previews placed in the mosaic since the last fetch
+        self._lock = Lock()
+        self._stop_event = Event()
+        self.thread = Thread(target=self.update, name='preview')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        for c_id in range(self.num_cams):
+            with self._lock:
+                pending, self._pending[c_id] = self._pending[c_id], None
+            if pending is not None:
+                self._release(pending[0])
+
+    def set_target_size(self, c_id: int, width: int, height: int):
+        """size of the widget the previews of a camera are shown in"""
+        self.target_sizes[c_id] = (max(int(width), 1), max(int(height), 1))
+
+    def set_mosaic(self, mosaic):
+        """pack the previews of all cameras into one MosaicCanvas, downsampled to its tile size"""
+        for c_id in range(self.num_cams):
+            self.set_target_size(c_id, *mosaic.tile_size)
+        self.mosaic = mosaic
+
+    def publish(self, c_id: int, frame):
+        """
+        Offer a new frame of a camera, never blocks. Takes over one reference if frame is a FrameSlot.
+        :param c_id: camera index
+        :param frame: numpy array or FrameSlot
+        """
+        with self._lock:
+            replaced = self._pending[c_id]
+            self._pending[c_id] = (frame, time.monotonic())
+            self.published[c_id] += 1
+            if replaced is not None:
+                self.dropped[c_id] += 1
+        if replaced is not None:
+            self._release(replaced[0])
+
+    def get_latest(self, c_id: int) -> [PreviewFrame, None]:
+        """
+        newest preview of a camera, None if there was no new one since the last call.
+        For c_id MOSAIC_ID a snapshot of the mosaic, only call it from the thread showing it
+        """
+        if c_id == MOSAIC_ID:
+            with self._lock:
+                ready, self._mosaic_ready = self._mosaic_ready, False
+                placed, self._placed = self._placed, {}
+            for placed_id, grab_time in placed.items():
+                self._count_shown(placed_id, grab_time)
+            return PreviewFrame(self.mosaic.snapshot(), 1, None) if ready else None
+        with self._lock:
+            preview, self._ready[c_id] = self._ready[c_id], None
+        if preview is not None:
+            self._count_shown(c_id, preview.grab_time)
+        return preview
+
+    def _count_shown(self, c_id: int, grab_time: float):
+        age = time.monotonic() - grab_time
+        self.frame_age[c_id] = age if self.frame_age[c_id] is None else 0.9 * self.frame_age[c_id] + 0.1 * age
+        self.shown[c_id] += 1
+
+    @staticmethod
+    def _release(frame):
+        if isinstance(frame, FrameSlot):
+            frame.release()
+
+    def downsample(self, c_id: int, img: np.ndarray, copy: bool = False) -> PreviewFrame:
+        """
+        Shrink an image by an integer factor to fit the target size of the camera
+        :param copy: make sure the preview does not share memory with img
+        """
+        if self.raw_formats[c_id] is not None:
+            img = bayer_preview(img, self.raw_formats[c_id])
+            scale = 2
+        else:
+            scale = 1
+        width, height = self.target_sizes[c_id]
+        factor = max(1, math.floor(min(img.shape[1] / width, img.shape[0] / height)))
+        if factor > 1:
+            img = cv2.resize(img, (img.shape[1] // factor, img.shape[0] // factor), interpolation=cv2.INTER_AREA)
+        elif copy and scale == 1:
+            img = img.copy()
+        return PreviewFrame(img, scale * factor, None)
+
+    def update(self):
+        period = 1.0 / self.display_fps
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            mosaic = self.mosaic
+            mosaic_changed = False
+            for c_id in range(self.num_cams):
+                with self._lock:
+                    pending, self._pending[c_id] = self._pending[c_id], None
+                if pending is None:
+                    continue
+                frame, grab_time = pending
+                if isinstance(frame, FrameSlot):
+                    # the buffer goes back to the pool, the mosaic copies the preview before that
+                    preview = self.downsample(c_id, frame.array, copy=mosaic is None)
+                else:
+                    preview = self.downsample(c_id, frame)
+                preview = preview._replace(grab_time=grab_time)
+                if mosaic is not None:
+                    mosaic.place(c_id, preview.image, preview.scale)  # before the release, it may be the frame
+                    self._release(frame)
+                    with self._lock:
+                        self._placed[c_id] = grab_time
+                    mosaic_changed = True
+                    continue
+                self._release(frame)
+                with self._lock:
+                    if self._ready[c_id] is not None:
+                        self.dropped[c_id] += 1
+                    self._ready[c_id] = preview
+                if self.on_ready is not None:
+                    self.on_ready(c_id)
+            if mosaic_changed:
+                with self._lock:
+                    self._mosaic_ready = True
+                if self.on_ready is not None:
+                    self.on_ready(MOSAIC_ID)
+            self._stop_event.wait(max(0.0, period - (time.monotonic() - start)))
+
+    def get_state(self) -> str:
+        return ' '.join(f'P{c_id}: {self.dropped[c_id]}/{self.published[c_id]} dropped'
+                        for c_id in range(self.num_cams))
@@ -0,0 +1,96 @@
+"""
+Streaming sidecar files with the (ID, ImageNumber, TimeStamp) of every written frame.
+
+The sidecar is a regular .npy file of fixed size records which is appended in chunks. Its header is rewritten on every
+flush, so the file is always readable up to the last flush, also if the recording process dies. Load it with
+load_timestamps, which memory maps the file.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+TIMESTAMP_DTYPE = np.dtype([('ID', '<i8'), ('ImageNumber', '<i8'), ('TimeStamp', '<i8')])
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+HEADER_LEN = 256  # fixed, so the header can be rewritten in place when the number of records changes
+
+
+def timestamps_path(video_path: str) -> str:
+    """path of the timestamp sidecar of a video"""
+    return os.path.splitext(video_path)[0] + '_timestamps.npy'
+
+
+class StreamingNpyWriter:
+    """
+    Appends records to a .npy file, buffered in memory and flushed every flush_every records or flush_interval s.
+    With sync the records are forced to disk before the header counts them, so the file stays consistent on power loss
+    """
+    def __init__(self, path: str, dtype=TIMESTAMP_DTYPE, flush_every: int = 1024, flush_interval: float = 1.0,
+                 sync: bool = False):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.flush_interval = flush_interval
+        self.sync = sync
+        self.count = 0  # records in the file
+        self._buffer = np.zeros(flush_every, self.dtype)
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._file = open(path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        header = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': (self.count,)}
+        header = repr(header).encode('latin1')
+        text_len = HEADER_LEN - len(NPY_MAGIC) - 2
+        header = header.ljust(text_len - 1) + b'\n'
+        self._file.seek(0)
+        self._file.write(NPY_MAGIC + text_len.to_bytes(2, 'little') + header)
+
+    def append(self, record: tuple):
+        self._buffer[self._buffered] = record
+        self._buffered += 1
+        if self._buffered == len(self._buffer):
+            self.flush()
+
+    def flush_if_due(self):
+        if self._buffered and time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """write buffered records and the new record count"""
+        self._last_flush = time.monotonic()
+        if not self._buffered:
+            return
+        self._file.seek(HEADER_LEN + self.count * self.dtype.itemsize)
+        self._file.write(self._buffer[:self._buffered].tobytes())
+        if self.sync:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self.count += self._buffered
+        self._buffered = 0
+        self._write_header()
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def load_timestamps(path: str, mmap: bool = True) -> np.ndarray:
+    """
+    Load the timestamps of a video
+    :param path: sidecar file or the video itself, also reads the json .txt files of older recordings
+    :param mmap: memory map instead of reading the whole file
+    :return: record array with the fields ID, ImageNumber, TimeStamp
+    """
+    if not path.endswith('.npy') and not path.endswith('.txt'):
+        path = timestamps_path(path)
+    if path.endswith('.txt'):
+        with open(path, 'r') as f:
+            return np.array([tuple(ts) for ts in json.load(f)], TIMESTAMP_DTYPE)
+    return np.load(path, mmap_mode='r' if mmap else None)
+
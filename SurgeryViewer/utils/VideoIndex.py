@@ -0,0 +1,125 @@
+"""
+Frame index of a video: exact frame count and the frame numbers and times of all keyframes.
+
+The index is built once from the packets of the video (with ffprobe if installed, otherwise by reading the packets with
+OpenCV without decoding them) and cached as <video>_index.json next to the video. It is rebuilt if the video changed.
+"""
+import bisect
+import json
+import logging
+import os
+import shutil
+import subprocess
+
+import cv2
+
+INDEX_VERSION = 1
+
+log = logging.getLogger('VideoIndex')
+
+
+def index_path(video_path: str) -> str:
+    """path of the cached index of a video"""
+    return os.path.splitext(video_path)[0] + '_index.json'
+
+
+def _probe_packets(video_path: str) -> [list, None]:
+    """(time in s, is keyframe) of all video packets in decoding order using ffprobe, None if not available"""
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is None:
+        return None
+    try:
+        output = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                                 'packet=pts_time,flags', '-of', 'csv=p=0', video_path],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        log.warning(f'ffprobe failed on {video_path}: {e}')
+        return None
+    packets = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if pts_time and pts_time != 'N/A':
+            packets.append((float(pts_time), 'K' in flags))
+    return packets
+
+
+def _scan_packets(video_path: str) -> list:
+    """(time in s, is keyframe) of all video packets in decoding order, read with OpenCV without decoding"""
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    packets = []
+    try:
+        while cap.grab():
+            packets.append((cap.get(cv2.CAP_PROP_POS_MSEC) / 1000, bool(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME))))
+    finally:
+        cap.release()
+    return packets
+
+
+def build_index(video_path: str) -> dict:
+    """index of the video, frames are numbered in presentation order"""
+    packets = _probe_packets(video_path)
+    source = 'ffprobe'
+    if packets is None:
+        packets = _scan_packets(video_path)
+        source = 'packets'
+    # packets come in decoding order, the frame number of a packet is the rank of its time
+    order = sorted(range(len(packets)), key=lambda p: packets[p][0])
+    start_time = packets[order[0]][0] if packets else 0.0  # times are counted from the first frame like in OpenCV
+    keyframes = [(frame, packets[p][0] - start_time) for frame, p in enumerate(order) if packets[p][1]]
+    cap = cv2.VideoCapture(video_path)
+    stat = os.stat(video_path)
+    index = {'version': INDEX_VERSION, 'video_size': stat.st_size, 'video_mtime': stat.st_mtime,
+             'frame_count': len(packets), 'fps': cap.get(cv2.CAP_PROP_FPS),
+             'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+             'keyframes': [frame for frame, _ in keyframes], 'keyframe_times': [t for _, t in keyframes],
+             'source': source}
+    cap.release()
+    return index
+
+
+def is_current(index: dict, video_path: str) -> bool:
+    """index was built from the video as it is now"""
+    stat = os.stat(video_path)
+    return index.get('version') == INDEX_VERSION and index.get('video_size') == stat.st_size \
+        and index.get('video_mtime') == stat.st_mtime
+
+
+def load_index(video_path: str, cache: bool = True) -> dict:
+    """
+    Cached index of the video, built if missing or outdated
+    :param cache: store a newly built index next to the video
+    """
+    path = index_path(video_path)
+    try:
+        with open(path, 'r') as f:
+            index = json.load(f)
+        if is_current(index, video_path):
+            return index
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    index = build_index(video_path)
+    if cache:
+        try:
+            with open(path, 'w') as f:
+                json.dump(index, f)
+        except OSError as e:
+            log.warning(f'Could not cache the index of {video_path}: {e}')
+    return index
+
+
+def keyframe_before(index: dict, frame: int) -> tuple:
+    """(frame number, time in s) of the last keyframe at or before frame, (0, 0.0) if there is none"""
+    pos = bisect.bisect_right(index['keyframes'], frame) - 1
+    if pos < 0:
+        return 0, 0.0
+    return index['keyframes'][pos], index['keyframe_times'][pos]
+
+
+def seek_to_keyframe(cap: cv2.VideoCapture, keyframe_time: float) -> bool:
+    """
+    Decode the keyframe at keyframe_time (s) with cap, so the next grab returns the frame after it.
+    OpenCV seeks by time converted to frame numbers, it only lands on the keyframe for constant frame rates
+    :return: whether the decoded frame is the keyframe
+    """
+    cap.set(cv2.CAP_PROP_POS_MSEC, keyframe_time * 1000)
+    return cap.grab() and abs(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000 - keyframe_time) < 1e-3
@@ -1,21 +1,60 @@
 # import the necessary packages
-from threading import Thread
+from collections import OrderedDict
+from threading import Thread, Lock
+import logging
 import sys
 import cv2
-import time
+import numpy as np
 
-from queue import Queue
+from queue import Queue, Empty, Full
 
+from SurgeryViewer.utils.VideoIndex import load_index, keyframe_before, seek_to_keyframe
 
+_EOF = object()  # queued by the reading thread at the end of the video
+
+
+def prepare_frame(frame, transform=None, resize: tuple = None, gray: bool = False):
+    """transform, resize to (width, height) and gray conversion (to (H, W, 1)) of a decoded frame"""
+    if transform:
+        frame = transform(frame)
+    if resize is not None:
+        frame = cv2.resize(frame, resize, interpolation=cv2.INTER_AREA)
+    if gray:
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        frame = frame[:, :, None]
+    return frame
 
 
 class VideoReaderFast:
-    def __init__(self, path, transform=None, queue_size=128):
+    def __init__(self, path, transform=None, queue_size=128, cache_size=64, gray=False, resize=None, start_frame=0):
+        """
+        :param start_frame: number of the first frame read returns, the reading thread seeks to it
+        :param cache_size: number of decoded frames kept for seek/read_range
+        :param gray: convert frames to gray (H, W, 1) in the reading thread, after transform
+        :param resize: (width, height) to resize the frames to in the reading thread, after transform
+        """
         # initialize the file video stream along with the boolean
         # used to indicate if the thread should be stopped or not
+        self.path = path
         self.stream = cv2.VideoCapture(path)
         self.stopped = False
         self.transform = transform
+        self.gray = gray
+        self.resize = tuple(resize) if resize is not None else None
+        self.start_frame = start_frame
+        self.next_frame = start_frame  # number of the frame the next read returns
+        self._pending = None  # frame taken from the queue by more, returned by the next read
+        self._batch = None  # array reused by read_batch
+        self.log = logging.getLogger('VideoReaderFast')
+
+        # random access has its own stream, independent of the reading thread
+        self.index = None
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # frame number -> decoded frame, least recently used first
+        self._seek_stream = None
+        self._seek_position = 0  # number of the frame the seek stream decodes next
+        self._seek_lock = Lock()
 
         # initialize the queue used to store frames read from
         # the video file
@@ -30,6 +69,14 @@ class VideoReaderFast:
         return self
 
     def update(self):
+        if self.start_frame > 0:
+            frame = self._skip_to(self.start_frame)
+            if frame is None:
+                self._put(_EOF)
+                self.stopped = True
+            else:
+                self._put(self._prepare(frame))
+
         # keep looping infinitely
         while True:
             # if the thread indicator variable is set, stop the
@@ -37,63 +84,213 @@ class VideoReaderFast:
             if self.stopped:
                 break
 
-            # otherwise, ensure the queue has room in it
-            if not self.Q.full():
-                # read the next frame from the file
-                (grabbed, frame) = self.stream.read()
-
-                # if the `grabbed` boolean is `False`, then we have
-                # reached the end of the video file
-                if not grabbed:
-                    self.stopped = True
-                    break
-
-                # if there are transforms to be done, might as well
-                # do them on producer thread before handing back to
-                # consumer thread. ie. Usually the producer is so far
-                # ahead of consumer that we have time to spare.
-                #
-                # Python is not parallel but the transform operations
-                # are usually OpenCV native so release the GIL.
-                #
-                # Really just trying to avoid spinning up additional
-                # native threads and overheads of additional
-                # producer/consumer queues since this one was generally
-                # idle grabbing frames.
-                if self.transform:
-                    frame = self.transform(frame)
-
-                # add the frame to the queue
-                self.Q.put(frame)
-            else:
-                time.sleep(0.1)  # Rest for 10ms, we have a full queue
+            # read the next frame from the file
+            (grabbed, frame) = self.stream.read()
+
+            # if the `grabbed` boolean is `False`, then we have
+            # reached the end of the video file
+            if not grabbed:
+                self._put(_EOF)
+                self.stopped = True
+                break
+
+            # if there are transforms to be done, might as well
+            # do them on producer thread before handing back to
+            # consumer thread. ie. Usually the producer is so far
+            # ahead of consumer that we have time to spare.
+            #
+            # Python is not parallel but the transform operations
+            # are usually OpenCV native so release the GIL.
+            #
+            # Really just trying to avoid spinning up additional
+            # native threads and overheads of additional
+            # producer/consumer queues since this one was generally
+            # idle grabbing frames.
+            frame = self._prepare(frame)
+
+            # add the frame to the queue, waits while it is full
+            self._put(frame)
 
         self.stream.release()
 
+    def _skip_to(self, frame: int):
+        """decode frame with the reading stream, starting at the keyframe before it. None if it does not exist"""
+        keyframe, keyframe_time = keyframe_before(self.get_index(), frame)
+        position = 0
+        if keyframe > 0 and seek_to_keyframe(self.stream, keyframe_time):
+            position = keyframe + 1
+        elif keyframe > 0:
+            self.log.warning(f'Seeking {self.path} to frame {keyframe} failed, decoding from the start')
+            self.stream.release()
+            self.stream = cv2.VideoCapture(self.path)
+        while position <= frame:
+            if not self.stream.grab():
+                return None
+            position += 1
+        grabbed, img = self.stream.retrieve()
+        return img if grabbed else None
+
+    def _prepare(self, frame):
+        return prepare_frame(frame, self.transform, self.resize, self.gray)
+
+    def _put(self, item):
+        """blocking put which gives up once the reader is stopped"""
+        while not self.stopped:
+            try:
+                self.Q.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def _get(self):
+        """next frame or _EOF, waits until the reading thread delivers one"""
+        while True:
+            try:
+                return self.Q.get(timeout=0.1)
+            except Empty:
+                if not self.thread.is_alive() and self.Q.qsize() == 0:
+                    return _EOF
+
     def read(self):
-        # return next frame in the queue
-        return self.Q.get()
+        # return next frame in the queue, None at the end of the video
+        if self._pending is not None:
+            frame, self._pending = self._pending, None
+        else:
+            frame = self._get()
+        if frame is _EOF:
+            self._pending = _EOF  # stays at the end
+            return None
+        self.next_frame += 1
+        return frame
 
     # Insufficient to have consumer use while(more()) which does
     # not take into account if the producer has reached end of
     # file stream.
     def running(self):
-        return self.more() or not self.stopped
+        return self.more()
 
     def more(self):
-        # return True if there are still frames in the queue. If stream is not stopped, try to wait a moment
-        tries = 0
-        while self.Q.qsize() == 0 and not self.stopped and tries < 5:
-            time.sleep(0.1)
-            tries += 1
+        # return True if there is another frame, waits for the reading thread until it delivered one or reached the end
+        if self._pending is None:
+            self._pending = self._get()
+        return self._pending is not _EOF
 
-        return self.Q.qsize() > 0
+    def poll(self):
+        # return the next frame if the reading thread decoded it already, None otherwise (also at the end of the video)
+        if self._pending is None:
+            try:
+                self._pending = self.Q.get_nowait()
+            except Empty:
+                return None
+        if self._pending is _EOF:
+            return None
+        return self.read()
+
+    def read_batch(self, batch_size: int, out: np.ndarray = None) -> [np.ndarray, None]:
+        """
+        Next frames stacked into a (B, H, W, C) array, C is 1 with gray
+        :param batch_size: maximal number of frames B, fewer at the end of the video
+        :param out: array of at least batch_size frames to fill, by default an array of the reader which is reused by
+        the next call
+        :return: view of the filled frames of out, None at the end of the video
+        """
+        for idx in range(batch_size):
+            frame = self.read()
+            if frame is None:
+                break
+            if out is None:
+                if self._batch is None or len(self._batch) < batch_size or self._batch.shape[1:] != frame.shape:
+                    self._batch = np.empty((batch_size,) + frame.shape, dtype=frame.dtype)
+                out = self._batch
+            out[idx] = frame
+        else:
+            return out[:batch_size]
+        return out[:idx] if idx > 0 else None
+
+    def iter_batches(self, batch_size: int, copy: bool = False):
+        """
+        Generator of (number of the first frame, batch) until the end of the video, see read_batch
+        :param copy: yield new arrays instead of reusing one
+        """
+        while True:
+            start = self.next_frame
+            batch = self.read_batch(batch_size)
+            if batch is None:
+                return
+            yield start, batch.copy() if copy else batch
 
     def stop(self):
         # indicate that the thread should be stopped
         self.stopped = True
         # wait until stream resources are released (producer thread might be still grabbing frame)
-        self.thread.join()
+        if self.thread.is_alive():
+            self.thread.join()
+        # the thread releases the stream when it ends, a reader that was never started has to release it here
+        self.stream.release()
+        self.release_seek()
 
     def get_size(self):
-        return int(self.stream.get(cv2.CAP_PROP_FRAME_COUNT))
+        # exact number of frames, CAP_PROP_FRAME_COUNT is estimated from the duration
+        return self.get_index()['frame_count']
+
+    def get_index(self) -> dict:
+        """keyframes and frame count of the video, see VideoIndex. Built once and cached next to the video"""
+        if self.index is None:
+            self.index = load_index(self.path)
+        return self.index
+
+    def seek(self, frame: int):
+        """decoded frame number frame (from 0), decoding starts at the keyframe before it unless it is just ahead"""
+        with self._seek_lock:
+            return self._get_frame(frame)
+
+    def read_range(self, start: int, stop: int) -> list:
+        """decoded frames start to stop (exclusive), with a single seek"""
+        with self._seek_lock:
+            return [self._get_frame(frame) for frame in range(start, stop)]
+
+    def release_seek(self):
+        """close the random access stream and clear the frame cache"""
+        with self._seek_lock:
+            if self._seek_stream is not None:
+                self._seek_stream.release()
+                self._seek_stream = None
+            self._cache.clear()
+
+    def _get_frame(self, frame: int):
+        if frame in self._cache:
+            self._cache.move_to_end(frame)
+            return self._cache[frame]
+        index = self.get_index()
+        if not 0 <= frame < index['frame_count']:
+            raise IndexError(f'frame {frame} not in {self.path} ({index["frame_count"]} frames)')
+        if self._seek_stream is None:
+            self._seek_stream = cv2.VideoCapture(self.path)
+            self._seek_position = 0
+        keyframe, keyframe_time = keyframe_before(index, frame)
+        if not keyframe <= self._seek_position <= frame:
+            # frames ahead in the same GOP are decoded from the current position, all others from their keyframe
+            self._seek_keyframe(keyframe, keyframe_time)
+        while self._seek_position <= frame:
+            if not self._seek_stream.grab():
+                raise IOError(f'could not decode frame {self._seek_position} of {self.path}')
+            self._seek_position += 1
+        grabbed, img = self._seek_stream.retrieve()
+        if not grabbed:
+            raise IOError(f'could not decode frame {frame} of {self.path}')
+        img = self._prepare(img)
+        self._cache[frame] = img
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return img
+
+    def _seek_keyframe(self, keyframe: int, keyframe_time: float):
+        """position the seek stream at keyframe"""
+        if keyframe > 0:
+            if seek_to_keyframe(self._seek_stream, keyframe_time):
+                self._seek_position = keyframe + 1
+                return
+            self.log.warning(f'Seeking {self.path} to frame {keyframe} failed, decoding from the start')
+        self._seek_stream.release()
+        self._seek_stream = cv2.VideoCapture(self.path)
+        self._seek_position = 0
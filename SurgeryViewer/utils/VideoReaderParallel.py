@@ -0,0 +1,257 @@
+"""
+Parallel decoding of a single video with several processes.
+
+The video is split into chunks starting at keyframes (from the VideoIndex), so every worker process decodes its chunks
+independently. Chunks are assigned round robin and every worker owns a ring of `window` batch slots in shared memory,
+decoded frames are not copied between the processes. Once all slots of a worker are filled it waits until the reader
+is done with them, which bounds the memory to workers * window * batch_size frames no matter how far a worker is
+ahead of the others. Frames are delivered in order, or with ordered=False as soon as any worker decoded them.
+
+    python -m SurgeryViewer.utils.VideoReaderParallel video.mp4 --workers 8
+
+The transform is sent to the worker processes, it has to be a module level function (no lambda).
+"""
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+from queue import Empty
+
+import cv2
+import numpy as np
+
+from SurgeryViewer.utils.VideoIndex import load_index, keyframe_before, seek_to_keyframe
+from SurgeryViewer.utils.VideoReaderFast import prepare_frame
+
+
+def plan_chunks(index: dict, chunk_frames: int) -> list:
+    """(start, stop) frame ranges of about chunk_frames, starting at keyframes"""
+    starts = [keyframe for keyframe in index['keyframes'] if keyframe < index['frame_count']] or [0]
+    if starts[0] != 0:
+        starts.insert(0, 0)  # frames before the first keyframe are decoded from the start
+    chunks = []
+    for keyframe in starts:
+        if not chunks or keyframe - chunks[-1][0] >= chunk_frames:
+            chunks.append([keyframe, None])
+    for chunk, following in zip(chunks, chunks[1:]):
+        chunk[1] = following[0]
+    chunks[-1][1] = index['frame_count']
+    return [tuple(chunk) for chunk in chunks]
+
+
+def _decode_chunks(worker: int, path: str, chunks: list, index: dict, results, free_slots, shm_name: str,
+                   slot_shape: tuple, dtype: str, options: dict):
+    """worker process: decode the chunks [(chunk number, start, stop)] into the batch slots of this worker"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray(slot_shape, dtype=dtype, buffer=shm.buf)
+    try:
+        cap = cv2.VideoCapture(path)
+        position = 0  # number of the frame cap decodes next
+        for chunk, start, stop in chunks:
+            keyframe, keyframe_time = keyframe_before(index, start)
+            if position != start:
+                if keyframe > 0 and seek_to_keyframe(cap, keyframe_time):
+                    position = keyframe + 1
+                else:
+                    cap.release()
+                    cap = cv2.VideoCapture(path)
+                    position = 0
+            frame = start
+            while frame < stop:
+                slot = free_slots.get()
+                count = 0
+                while count < slot_shape[1] and frame < stop:
+                    while position <= frame:
+                        if not cap.grab():
+                            raise IOError(f'could not decode frame {position} of {path}')
+                        position += 1
+                    grabbed, img = cap.retrieve()
+                    if not grabbed:
+                        raise IOError(f'could not decode frame {frame} of {path}')
+                    slots[slot, count] = prepare_frame(img, **options)
+                    count += 1
+                    frame += 1
+                results.put(('batch', worker, slot, frame - count, count))
+        cap.release()
+        results.put(('done', worker))
+    except Exception as e:
+        results.put(('error', worker, f'{type(e).__name__}: {e}'))
+    finally:
+        del slots
+        shm.close()
+
+
+class VideoReaderParallel:
+    """Reader of one video decoded by several worker processes, see module doc"""
+    def __init__(self, path, workers: int = None, ordered: bool = True, chunk_frames: int = None,
+                 batch_size: int = 16, window: int = 4, transform=None, gray: bool = False, resize: tuple = None):
+        """
+        :param workers: number of decoding processes, defaults to the number of cpus
+        :param ordered: deliver the frames in order, otherwise in the order they are decoded
+        :param chunk_frames: minimal frames per chunk, defaults to a quarter of a worker's share
+        :param batch_size: frames per batch
+        :param window: batch slots per worker, workers wait once they are this far ahead of the reader
+        :param transform, gray, resize: applied in the workers, as in VideoReaderFast
+        """
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.ordered = ordered
+        self.batch_size = batch_size
+        self.window = window
+        self.options = {'transform': transform, 'gray': gray, 'resize': tuple(resize) if resize is not None else None}
+        self.log = logging.getLogger('VideoReaderParallel')
+
+        self.index = load_index(path)
+        if chunk_frames is None:
+            chunk_frames = max(math.ceil(self.index['frame_count'] / (4 * self.workers)), 1)
+        self.chunks = plan_chunks(self.index, chunk_frames)
+        self.workers = min(self.workers, len(self.chunks))
+
+        self._processes = []
+        self._shms = []
+        self._slots = []
+        self._results = []
+        self._free_slots = []
+        self._held = None  # (worker, slot) of the batch the reader hands out, released with the next one
+        self.stopped = False
+
+    def get_size(self):
+        return self.index['frame_count']
+
+    def frame_format(self) -> tuple:
+        """shape and dtype of the frames after transform, resize and gray conversion"""
+        cap = cv2.VideoCapture(self.path)
+        grabbed, img = cap.read()
+        cap.release()
+        if not grabbed:
+            raise IOError(f'could not decode {self.path}')
+        img = prepare_frame(img, **self.options)
+        return img.shape, img.dtype
+
+    def start(self):
+        shape, dtype = self.frame_format()
+        slot_shape = (self.window, self.batch_size) + tuple(shape)
+        context = multiprocessing.get_context('spawn')  # forking a process using OpenCV threads can deadlock
+        shared_results = context.Queue() if not self.ordered else None
+        for worker in range(self.workers):
+            shm = shared_memory.SharedMemory(create=True, size=int(np.prod(slot_shape)) * np.dtype(dtype).itemsize)
+            self._shms.append(shm)
+            self._slots.append(np.ndarray(slot_shape, dtype=dtype, buffer=shm.buf))
+            # with ordered=True every worker has its own queue, so a worker far ahead never blocks the one next in line
+            self._results.append(context.Queue() if self.ordered else shared_results)
+            free_slots = context.Queue()
+            for slot in range(self.window):
+                free_slots.put(slot)
+            self._free_slots.append(free_slots)
+            chunks = [(chunk, start, stop) for chunk, (start, stop) in enumerate(self.chunks)
+                      if chunk % self.workers == worker]
+            process = context.Process(target=_decode_chunks, name=f'decode_{worker}', daemon=True,
+                                      args=(worker, self.path, chunks, self.index, self._results[worker],
+                                            free_slots, shm.name, slot_shape, np.dtype(dtype).str, self.options))
+            process.start()
+            self._processes.append(process)
+        return self
+
+    def _get(self, results):
+        """next message of the workers, fails if they died without one"""
+        while True:
+            try:
+                return results.get(timeout=0.5)
+            except Empty:
+                if not any(process.is_alive() for process in self._processes) and results.empty():
+                    raise IOError(f'decoding processes of {self.path} exited')
+
+    def _release(self):
+        if self._held is not None:
+            worker, slot = self._held
+            self._free_slots[worker].put(slot)
+            self._held = None
+
+    def _batch(self, message) -> tuple:
+        if message[0] == 'error':
+            raise IOError(f'decoding {self.path} failed in worker {message[1]}: {message[2]}')
+        _, worker, slot, start, count = message
+        self._held = (worker, slot)
+        return start, self._slots[worker][slot, :count]
+
+    def iter_batches(self):
+        """
+        Generator of (number of the first frame, batch of up to batch_size frames). The batch is shared memory of
+        the workers, it is overwritten after the generator moved on (copy frames to keep them)
+        """
+        try:
+            if self.ordered:
+                for chunk, (start, stop) in enumerate(self.chunks):
+                    results = self._results[chunk % self.workers]
+                    remaining = stop - start
+                    while remaining > 0:
+                        self._release()
+                        batch_start, batch = self._batch(self._get(results))
+                        remaining -= len(batch)
+                        yield batch_start, batch
+            else:
+                done = 0
+                while done < self.workers:
+                    self._release()
+                    message = self._get(self._results[0])
+                    if message[0] == 'done':
+                        done += 1
+                        continue
+                    yield self._batch(message)
+        finally:
+            self._release()
+
+    def iter_frames(self):
+        """Generator of (frame number, frame), frames are views like the batches of iter_batches"""
+        for start, batch in self.iter_batches():
+            for offset, frame in enumerate(batch):
+                yield start + offset, frame
+
+    def stop(self):
+        self.stopped = True
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self._slots = []
+        for shm in self._shms:
+            try:
+                shm.close()
+            except BufferError:
+                pass  # batches are still referenced, the memory is freed with them
+            shm.unlink()
+        self._shms = []
+        self._processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode a video with several processes and report the frame rate')
+    parser.add_argument('video')
+    parser.add_argument('--workers', type=int, default=None, help='decoding processes, defaults to the cpu count')
+    parser.add_argument('--batch', type=int, default=16, help='frames per batch')
+    parser.add_argument('--unordered', action='store_true', help='deliver frames as they are decoded')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    start = time.monotonic()
+    frames = 0
+    with VideoReaderParallel(args.video, workers=args.workers, ordered=not args.unordered,
+                             batch_size=args.batch) as reader:
+        for _, batch in reader.iter_batches():
+            frames += len(batch)
+        workers = reader.workers
+    elapsed = time.monotonic() - start
+    print(f'{frames} frames in {elapsed:.1f} s ({frames / elapsed:.1f} FPS) with {workers} workers')
+
+
+if __name__ == '__main__':
+    main()
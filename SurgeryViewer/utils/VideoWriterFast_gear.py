@@ -1,46 +1,91 @@
 # import the necessary packages
-import json
-from threading import Thread
+import os
+from threading import Thread, Lock
 import time
-from vidgear.gears import WriteGear
-from queue import Queue
+from queue import Queue, Empty
+
+import numpy as np
+
+from SurgeryViewer.utils.FramePool import FrameSlot
+from SurgeryViewer.utils.FrameJournal import FrameJournal, JournalFull
+from SurgeryViewer.utils.TimestampSidecar import StreamingNpyWriter, timestamps_path
 
 class QueueOverflow(Exception):
    """Base class for other exceptions"""
    pass
 
 
+class WriterStopped(Exception):
+    """The writer stopped after an error (e.g. the encoder exited), it accepts no more frames"""
+    pass
+
+
 class VideoWriterFast:
     """
     Utility for faster Video writing with VideoGear.
     Basically runs writing of frames in an separate thread.
     """
-    def __init__(self, video_path, fps, codec="libx264", crf=0, queue_size=512):
+    def __init__(self, video_path, fps, codec="libx264", crf=0, queue_size=512, rgb_mode=True, pix_fmt=None,
+                 spill_watermark=None, spill_dir=None, spill_max_gb=None, metrics=None, preset=None,
+                 flush_interval=None, frame_shape=None):
+        """
+        :param rgb_mode: frames are RGB (otherwise BGR), ignored for single channel frames which are written as gray
+        :param pix_fmt: output pixel format of the encoder, e.g. 'gray' to keep raw sensor data, None for the default
+        :param spill_watermark: number of queued frames above which further frames are parked in a FrameJournal on
+        disk until the encoder caught up, None to raise QueueOverflow once the queue is full
+        :param spill_dir: folder of the journal file, defaults to the folder of the video
+        :param spill_max_gb: maximal size of the journal, None for unlimited
+        :param metrics: CameraMetrics receiving queue, spill and encoding statistics
+        :param preset: encoder preset, e.g. 'veryfast' for libx264 or 'p4' for h264_nvenc, None for the default
+        :param flush_interval: write a crash safe video (.mkv, otherwise fragmented mp4) and force video and timestamps
+        to disk every flush_interval s, so everything up to the last flush stays readable if the recording is aborted.
+        None for a regular mp4 which is only readable once stop was called
+        :param frame_shape: (height, width) or (height, width, 3) of the frames to create the encoder with start instead
+        of with the first frame
+        """
         self.crf = crf
         self.fps = fps
         self.codec = codec
         self.video_path = video_path
+        self.rgb_mode = rgb_mode
+        self.pix_fmt = pix_fmt
+        self.preset = preset
+        self.flush_interval = flush_interval
+        self._last_sync = time.monotonic()
 
         # initialize the file video stream along with the boolean
         # used to indicate if the thread should be stopped or not
-        self.stream = None  # this is initialized when we get the first frame
+        self.stream = None  # this is initialized by start if the frame shape is known, otherwise with the first frame
+        self.frame_shape = tuple(frame_shape) if frame_shape is not None else None
         self.stopped = False
 
         self.started = False
 
         self.write_speed = None
+        self.metrics = metrics
 
         # initialize the queue used to store frames read from
         # the video file
         self.queue_size = queue_size
         self.Q = Queue(maxsize=queue_size)
-        self.frame_ts = []
+        self.timestamps = None  # sidecar, created with the first frame with timestamps
+
+        self.spill_watermark = spill_watermark
+        self.spill_dir = spill_dir
+        self.spill_max_gb = spill_max_gb
+        self.journal = None  # created with the first frame to spill
+        self.spilling = False  # once set all frames go to the journal until it is drained, this keeps the order
+        self._spill_lock = Lock()
+
         # intialize thread
         self.thread = Thread(target=self.update, args=())
         self.thread.daemon = True
 
     def start(self):
         """starts the thread to write frames to the video file"""
+        if self.stream is None and self.frame_shape is not None:
+            # not on the grabbing thread with the first frame, e.g. segments are pre-opened in the background
+            self._open_stream(np.zeros(self.frame_shape, np.uint8))
         self.started = True
         # start a thread to read frames from the file video stream
         self.thread.start()
@@ -56,50 +101,179 @@ class VideoWriterFast:
                 break
 
             # otherwise, ensure the there is something in the queue and the stream was initialized
-            if self.Q.qsize() > 0 and self.stream is not None:
-                # get the next frame from the queue
-                frame = self.Q.get()
+            item = None
+            if self.stream is not None:
+                if self.Q.qsize() > 0:
+                    # get the next frame from the queue
+                    item = self.Q.get()
+                elif self.spilling:
+                    # queued frames are older than the journal ones
+                    item = self._unspill()
 
+            if item is not None:
+                frame, meta = item
                 start = time.time()
                 # write to stream
                 try:
-                    self.stream.write(frame, rgb_mode=True)
+                    self.stream.write(frame.array if isinstance(frame, FrameSlot) else frame, rgb_mode=self.rgb_mode)
                 except ValueError as e:
                     self.stopped = True
                     print("Error writing frame to stream: {}".format(e))
+                    continue  # neither stamped nor counted, the slot is released below
+                finally:
+                    if isinstance(frame, FrameSlot):
+                        frame.release()  # hand the buffer back to the pool of the camera
+                if meta is not None:
+                    self._write_timestamp(meta)
+                duration = time.time() - start
                 if self.write_speed is None:
-                    self.write_speed = time.time() - start
+                    self.write_speed = duration
                 else:
-                    self.write_speed = 0.85*self.write_speed + 0.15*(time.time() - start)
+                    self.write_speed = 0.85*self.write_speed + 0.15*duration
+                if self.metrics is not None:
+                    self.metrics.written += 1
+                    self.metrics.write_time.add(duration)
+                    self.metrics.write_cpu = time.thread_time()
+                self._sync_if_due()
 
             else:
+                if self.timestamps is not None:
+                    self.timestamps.flush_if_due()
+                self._sync_if_due()
                 time.sleep(0.001)  # Rest for 1ms, we have an empty queue
 
+        self._release_queued()
         self.stream.close()
+        if self.timestamps is not None:
+            self.timestamps.close()
+
+    def _release_queued(self):
+        """drop the frames still queued once the writer stopped, frame slots go back to their pool"""
+        while True:
+            try:
+                frame, _ = self.Q.get_nowait()
+            except Empty:
+                break
+            if isinstance(frame, FrameSlot):
+                frame.release()
+
+    def _write_timestamp(self, meta):
+        """streams (ID, ImageNumber, TimeStamp) of a written frame to the sidecar"""
+        if self.timestamps is None:
+            if self.flush_interval is None:
+                self.timestamps = StreamingNpyWriter(timestamps_path(self.video_path))
+            else:
+                self.timestamps = StreamingNpyWriter(timestamps_path(self.video_path),
+                                                     flush_interval=self.flush_interval, sync=True)
+        self.timestamps.append(meta)
+        self.timestamps.flush_if_due()
 
     def feed(self, frame):
+        """
+        Queue a frame for writing
+        :param frame: numpy array or FrameSlot (released after writing), optionally as tuple together with
+        (ID, ImageNumber, TimeStamp) of the frame if timestamps should be written
+        :raises WriterStopped: if the writer stopped, the frame is released
+        """
+        meta = None
+        if isinstance(frame, (list, tuple)):
+            frame, meta = frame[0], tuple(frame[1:])
+        if self.stopped:
+            if isinstance(frame, FrameSlot):
+                frame.release()
+            raise WriterStopped(f'Video writer of {self.video_path} stopped')
+
         if self.stream is None:
-            output_params = {"-input_framerate": self.fps, "-vcodec": self.codec, "-crf": self.crf}
-            #output_params = {"-input_framerate": self.fps, "-vcodec": "h264_nvenc", "-crf": 0}
-            #output_params = {"-vcodec": "libx264", "-crf": 0, "-preset": "fast"}
-            self.stream = WriteGear(output=self.video_path, **output_params)
-            '''
-            working codecs h264_nvenc, libx264, mpeg4, mpeg2video, libxvid, libx264rgb
-            
-            '''
+            self._open_stream(frame.array if isinstance(frame, FrameSlot) else frame)
         if not self.started:
             self.start()
 
+        if self.spill_watermark is not None:
+            with self._spill_lock:
+                if self.spilling or self.Q.qsize() >= self.spill_watermark:
+                    return self._spill(frame, meta)
+
         if not self.Q.full():
             # add the frame to the queue
-            if isinstance(frame, (list, tuple)):
-                self.frame_ts.append(frame[1:])
-                return self.Q.put(frame[0])
-            else:
-                return self.Q.put(frame)
+            self.Q.put((frame, meta))
+            if self.metrics is not None:
+                self.metrics.observe_queue(self.Q.qsize())
         else:
             raise QueueOverflow
 
+    def _container_params(self) -> dict:
+        """ffmpeg output options of crash safe videos: matroska clusters or mp4 fragments of flush_interval s"""
+        if self.flush_interval is None:
+            return {}
+        params = {"-flush_packets": 1}  # no buffering in ffmpeg, finished fragments go straight to the file
+        if self.video_path.endswith('.mkv'):
+            params["-cluster_time_limit"] = int(self.flush_interval * 1000)
+        else:
+            params["-movflags"] = "+frag_keyframe+empty_moov+default_base_moof"
+            params["-frag_duration"] = int(self.flush_interval * 1e6)
+        return params
+
+    def _sync_if_due(self):
+        """force the written video data to disk every flush_interval s"""
+        if self.flush_interval is None or time.monotonic() - self._last_sync < self.flush_interval:
+            return
+        self._last_sync = time.monotonic()
+        try:
+            fd = os.open(self.video_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass  # not created yet, or not supported for read only files (windows)
+
+    def _open_stream(self, img):
+        """creates the encoder, called by start or with the first frame"""
+        from vidgear.gears import WriteGear  # slow import, only needed once something is written
+        output_params = {"-input_framerate": self.fps, "-vcodec": self.codec, "-crf": self.crf}
+        if self.pix_fmt is not None:
+            output_params["-pix_fmt"] = self.pix_fmt
+        if self.preset is not None:
+            output_params["-preset"] = self.preset
+        output_params.update(self._container_params())
+        #output_params = {"-input_framerate": self.fps, "-vcodec": "h264_nvenc", "-crf": 0}
+        #output_params = {"-vcodec": "libx264", "-crf": 0, "-preset": "fast"}
+        self.stream = WriteGear(output=self.video_path, **output_params)
+        '''
+        working codecs h264_nvenc, libx264, mpeg4, mpeg2video, libxvid, libx264rgb
+        
+        '''
+
+    def _spill(self, frame, meta=None):
+        """park a frame in the journal on disk, frame slots are released right away"""
+        img = frame.array if isinstance(frame, FrameSlot) else frame
+        try:
+            if self.journal is None:
+                spill_dir = self.spill_dir if self.spill_dir else os.path.dirname(os.path.abspath(self.video_path))
+                journal_path = os.path.join(spill_dir, os.path.basename(self.video_path) + '.journal')
+                max_bytes = None if self.spill_max_gb is None else int(self.spill_max_gb * 1024 ** 3)
+                self.journal = FrameJournal(journal_path, img.shape, img.dtype, max_bytes=max_bytes)
+            if not self.journal.fits(img):
+                raise QueueOverflow
+            self.journal.append(img, meta)
+            if self.metrics is not None:
+                self.metrics.spilled += 1
+                self.metrics.journal_hwm = max(self.metrics.journal_hwm, len(self.journal))
+        except JournalFull:
+            raise QueueOverflow
+        finally:
+            if isinstance(frame, FrameSlot):
+                frame.release()
+        self.spilling = True
+
+    def _unspill(self):
+        """oldest (frame, meta) of the journal, ends spilling once the journal is drained"""
+        item = self.journal.pop()
+        with self._spill_lock:
+            if len(self.journal) == 0:
+                self.spilling = False
+        return item
+
     # Insufficient to have consumer use while(more()) which does
     # not take into account if the producer has reached end of
     # file stream.
@@ -109,14 +283,19 @@ class VideoWriterFast:
     def is_active(self):
         # return True if there are still frames in the queue. If stream is not stopped, try to wait a moment
         tries = 0
-        while self.Q.qsize() == 0 and not self.stopped and tries < 5:
+        while self.Q.qsize() == 0 and not self.spilling and not self.stopped and tries < 5:
             time.sleep(0.1)
             tries += 1
 
-        return self.Q.qsize() > 0
+        return self.Q.qsize() > 0 or self.spilling
+
+    def queue_fill(self) -> float:
+        """fraction of the queue in use, frames parked on disk not counted"""
+        return self.Q.qsize() / self.queue_size
 
     def wait_to_finish(self):
-        while self.is_active():
+        """wait until all queued frames are written, or the writer stopped after an error"""
+        while not self.stopped and self.is_active():
             time.sleep(0.1)
 
     def stop(self):
@@ -125,12 +304,14 @@ class VideoWriterFast:
         # wait until stream resources are released (producer thread might be still grabbing frame)
         if self.started:
             self.thread.join()
-        if self.frame_ts:
-            with open(self.video_path.replace('.mp4', '.txt'), 'w') as f:
-                json.dump(self.frame_ts, f)
+        self._release_queued()
+        if self.journal is not None:
+            self.journal.close()
 
     def get_state(self):
         state = f'Queue {self.Q.qsize()}/{self.queue_size};'
+        if self.spilling:
+            state += f' Spilled {len(self.journal)};'
         if self.write_speed is None:
             state += ' Write speed nan FPS'
         else:
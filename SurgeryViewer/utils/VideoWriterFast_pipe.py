@@ -0,0 +1,208 @@
+import functools
+import logging
+import os
+import shutil
+import subprocess
+import time
+from queue import Empty
+
+from SurgeryViewer.utils.FramePool import FrameSlot
+from SurgeryViewer.utils.VideoWriterFast_gear import VideoWriterFast
+
+# ffmpeg input formats of the native camera pixel formats
+FFMPEG_PIXEL_FORMATS = {'Mono8': 'gray',
+                        'BayerRG8': 'bayer_rggb8',
+                        'BayerBG8': 'bayer_bggr8',
+                        'BayerGR8': 'bayer_grbg8',
+                        'BayerGB8': 'bayer_gbrg8',
+                        'RGB8': 'rgb24'}
+
+# codec names WriteGear accepts which are no ffmpeg encoders
+CODEC_ALIASES = {'divx': 'mpeg4', 'xvid': 'libxvid'}
+FALLBACK_CODEC = 'libx264'  # as WriteGear, used if the codec is not available
+
+PIPE_BUFFER_SIZE = 8 * 1024 ** 2  # requested size of the ffmpeg stdin pipe (linux only)
+IOV_MAX = 1024
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_encoders() -> frozenset:
+    """names of the video encoders of the installed ffmpeg, empty if ffmpeg can not be queried"""
+    try:
+        output = subprocess.run([shutil.which('ffmpeg') or 'ffmpeg', '-hide_banner', '-encoders'],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return frozenset()
+    encoders = set()
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0].startswith('V'):
+            encoders.add(parts[1])
+    return frozenset(encoders)
+
+
+def resolve_codec(codec: str) -> str:
+    """ffmpeg encoder for a codec name, FALLBACK_CODEC if the installed ffmpeg does not have it"""
+    codec = CODEC_ALIASES.get(codec.lower(), codec)
+    encoders = ffmpeg_encoders()
+    if encoders and codec not in encoders:
+        logging.getLogger('VideoWriterPipe').warning(f'ffmpeg has no {codec} encoder, using {FALLBACK_CODEC}')
+        return FALLBACK_CODEC
+    return codec
+
+
+class VideoWriterPipe(VideoWriterFast):
+    """
+    Writes frames straight to the stdin of an ffmpeg process, without WriteGear.
+    The input format is passed explicitly, so native Mono8/Bayer frames are demosaiced by ffmpeg instead of the
+    grabbing thread. The writer thread blocks on the queue instead of polling and writes all queued frames (up to
+    batch_size) with one system call. Time blocked on the full pipe is the encoder backpressure, it is reported in
+    get_state and metrics.encoder_wait. Queueing, spilling and timestamps work as in VideoWriterFast.
+    """
+    def __init__(self, video_path, fps, codec="libx264", crf=0, queue_size=512, rgb_mode=True, pix_fmt=None,
+                 spill_watermark=None, spill_dir=None, spill_max_gb=None, metrics=None, preset=None,
+                 flush_interval=None, input_pix_fmt=None, frame_shape=None, batch_size=16):
+        """
+        :param input_pix_fmt: ffmpeg pixel format of the frames, e.g. 'bayer_rggb8' (see FFMPEG_PIXEL_FORMATS),
+        None for gray or rgb24/bgr24 (rgb_mode) depending on the number of channels
+        :param batch_size: maximal number of frames per write
+        """
+        super().__init__(video_path, fps, codec=codec, crf=crf, queue_size=queue_size, rgb_mode=rgb_mode,
+                         pix_fmt=pix_fmt, spill_watermark=spill_watermark, spill_dir=spill_dir,
+                         spill_max_gb=spill_max_gb, metrics=metrics, preset=preset, flush_interval=flush_interval,
+                         frame_shape=frame_shape)
+        self.log = logging.getLogger('VideoWriterPipe')
+        self.input_pix_fmt = input_pix_fmt
+        self.batch_size = batch_size
+        self.encoder_wait = 0.0  # s blocked on the full pipe
+        self._writing_since = None  # start of the first write, for the share of time blocked on the encoder
+
+    def get_command(self, shape: tuple) -> list:
+        """ffmpeg command line for frames of shape"""
+        if self.input_pix_fmt is not None:
+            input_pix_fmt = self.input_pix_fmt
+        elif len(shape) == 2:
+            input_pix_fmt = 'gray'
+        else:
+            input_pix_fmt = 'rgb24' if self.rgb_mode else 'bgr24'
+        cmd = [shutil.which('ffmpeg') or 'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+               '-f', 'rawvideo', '-vcodec', 'rawvideo', '-pix_fmt', input_pix_fmt, '-s', f'{shape[1]}x{shape[0]}',
+               '-framerate', str(self.fps), '-i', '-', '-vcodec', self.codec]
+        # same defaults as WriteGear, so videos do not change with the writer backend
+        if self.codec in ('libx264', 'libx264rgb', 'libx265'):
+            cmd += ['-crf', str(self.crf), '-preset', self.preset if self.preset is not None else 'fast']
+        elif self.preset is not None:
+            cmd += ['-preset', self.preset]
+        if self.codec in ('libxvid', 'mpeg4'):
+            cmd += ['-qscale:v', '3']
+        if self.pix_fmt is not None:
+            cmd += ['-pix_fmt', self.pix_fmt]
+        for key, value in self._container_params().items():
+            cmd += [key, str(value)]
+        return cmd + [self.video_path]
+
+    def _open_stream(self, img):
+        self.codec = resolve_codec(self.codec)  # ffmpeg would exit right away on an unknown encoder
+        shape = self.frame_shape if self.frame_shape is not None else img.shape
+        self.frame_shape = tuple(shape)
+        self.stream = subprocess.Popen(self.get_command(shape), stdin=subprocess.PIPE, bufsize=0)
+        if hasattr(os, 'writev'):
+            try:
+                import fcntl
+                fcntl.fcntl(self.stream.stdin.fileno(), 1031, PIPE_BUFFER_SIZE)  # F_SETPIPE_SZ
+            except (ImportError, OSError):
+                pass  # default pipe size, limited by /proc/sys/fs/pipe-max-size
+
+    def _write(self, views: list):
+        """write all buffers to ffmpeg, blocks while the pipe is full"""
+        fd = self.stream.stdin.fileno()
+        while views:
+            if hasattr(os, 'writev'):
+                written = os.writev(fd, views[:IOV_MAX])
+            else:
+                written = os.write(fd, views[0])
+            while views and written >= len(views[0]):
+                written -= len(views[0])
+                views.pop(0)
+            if written:
+                views[0] = views[0][written:]
+
+    def _next_batch(self) -> list:
+        """queued frames, waits for the first one, from the journal once the queue is drained while spilling"""
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.Q.get(block=not batch and not self.spilling, timeout=0.1))
+            except Empty:
+                if self.spilling and not batch:
+                    batch.append(self._unspill())
+                break
+        return batch
+
+    def update(self):
+        while not self.stopped:
+            if self.stream is None:
+                time.sleep(0.01)  # opened by the first feed
+                continue
+            batch = self._next_batch()
+            if not batch:
+                if self.timestamps is not None:
+                    self.timestamps.flush_if_due()
+                self._sync_if_due()
+                continue
+
+            frames = [frame.array if isinstance(frame, FrameSlot) else frame for frame, _ in batch]
+            start = time.time()
+            if self._writing_since is None:
+                self._writing_since = start
+            try:
+                if any(img.shape != self.frame_shape for img in frames):
+                    raise ValueError(f'frame shape {frames[0].shape} does not match {self.frame_shape}')
+                self._write([memoryview(img).cast('B') for img in frames])
+            except (ValueError, OSError) as e:
+                # OSError: ffmpeg exited, e.g. because the codec is not available
+                self.stopped = True
+                self.log.error(f'Error writing frames to {self.video_path}: {e}')
+                for frame, _ in batch:
+                    if isinstance(frame, FrameSlot):
+                        frame.release()  # neither stamped nor counted as written
+                break
+            duration = time.time() - start
+            self.encoder_wait += duration
+
+            for frame, meta in batch:
+                if isinstance(frame, FrameSlot):
+                    frame.release()  # hand the buffer back to the pool of the camera
+                if meta is not None:
+                    self._write_timestamp(meta)
+            per_frame = duration / len(batch)
+            if self.write_speed is None:
+                self.write_speed = per_frame
+            else:
+                self.write_speed = 0.85 * self.write_speed + 0.15 * per_frame
+            if self.metrics is not None:
+                self.metrics.written += len(batch)
+                for _ in batch:
+                    self.metrics.write_time.add(per_frame)
+                self.metrics.encoder_wait = self.encoder_wait
+                self.metrics.write_cpu = time.thread_time()
+            self._sync_if_due()
+
+        self._release_queued()
+        if self.stream is not None:
+            try:
+                self.stream.stdin.close()
+            except OSError:
+                pass  # ffmpeg already exited
+            returncode = self.stream.wait()
+            if returncode != 0:
+                self.log.error(f'ffmpeg exited with {returncode} for {self.video_path}')
+        if self.timestamps is not None:
+            self.timestamps.close()
+
+    def get_state(self):
+        state = super().get_state() + ';'
+        if self._writing_since is not None:
+            busy = self.encoder_wait / max(time.time() - self._writing_since, 1e-6)
+            state += f' Blocked by encoder {100 * min(busy, 1.0):0.0f}%;'
+        return state
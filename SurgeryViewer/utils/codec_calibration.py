@@ -0,0 +1,239 @@
+"""
+Calibration of the video codecs on this machine.
+
+Every available codec of codec_to_try (and its presets in CODEC_PRESETS, fastest first) encodes synthetic frames of
+the session's resolution for all cameras at once through VideoWriterFast, as fast as the encoders take them. A codec
+or preset keeps up if it encodes at least CODEC_HEADROOM times the camera frame rate. Results are stored per machine
+in CODEC_PROFILE as pixel rate (pixels/s over all cameras), so later sessions with other resolutions, frame rates or
+camera counts can be checked without calibrating again. The recommended codec is the best of CODEC_QUALITY which keeps
+up:
+
+    python -m SurgeryViewer.utils.codec_calibration --size 1280 1024 --fps 60 --cams 4
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+from SurgeryViewer.configs.params import codec_to_try, CODEC_PRESETS, CODEC_PROFILE, CODEC_HEADROOM, WRITER_BACKEND, \
+    CODEC_QUALITY
+from SurgeryViewer.utils.VideoWriterFast_gear import VideoWriterFast
+from SurgeryViewer.utils.VideoWriterFast_pipe import VideoWriterPipe
+
+log = logging.getLogger('CodecCalibration')
+
+
+def available_codecs(codecs: list = None) -> list:
+    """codecs (default codec_to_try) the installed ffmpeg can encode with, in the given order"""
+    codecs = codec_to_try if codecs is None else codecs
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        log.warning('ffmpeg not found')
+        return []
+    try:
+        output = subprocess.run([ffmpeg, '-hide_banner', '-encoders'], capture_output=True, text=True,
+                                timeout=10).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        log.warning(f'Could not list the ffmpeg encoders: {e}')
+        return []
+    # lines look like ' V....D libx264              libx264 H.264 / AVC ...'
+    encoders = {line.split()[1] for line in output.splitlines() if len(line.split()) > 1}
+    return [codec for codec in codecs if codec in encoders]
+
+
+def make_frames(width: int, height: int, num_frames: int = 16) -> list:
+    """RGB test images, a moving gradient with noise like the synthetic cameras produce"""
+    from SurgeryViewer.core.SyntheticBackend import SyntheticCamera
+    cam = SyntheticCamera('calibration', width=width, height=height, pixel_format='RGB8', num_patterns=num_frames,
+                          seed=0)
+    cam.open()
+    return cam.patterns
+
+
+def measure(codec: str, preset: [str, None], frames: list, fps: float, num_cams: int, num_frames: int,
+            crf: int = 17, work_dir: str = None, writer_class=VideoWriterFast) -> dict:
+    """
+    Encode num_frames frames per camera (after one to start the encoders) with num_cams writers in parallel, the
+    same way the Recorder does
+    :param writer_class: VideoWriterFast or VideoWriterPipe, whichever the Recorder uses
+    :return: encoded frames per second and camera (including closing the videos), the writer's write_speed, the mean
+    video size per frame in bytes and whether encoding failed
+    """
+    own_dir = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix='codec_calibration_') if own_dir else work_dir
+    height, width = frames[0].shape[:2]
+    result = {'codec': codec, 'preset': preset, 'width': width, 'height': height, 'num_cams': num_cams,
+              'fps': fps, 'crf': crf, 'failed': False}
+    writers = [writer_class(os.path.join(work_dir, f'{codec}_{preset}_cam{c_id}.mp4'), fps=fps, codec=codec,
+                               crf=crf, queue_size=num_frames + 2, preset=preset) for c_id in range(num_cams)]
+    try:
+        # the first frame starts ffmpeg, which is not part of the encoding rate
+        for writer in writers:
+            writer.feed(frames[0])
+        while any(writer.write_speed is None and not writer.stopped for writer in writers):
+            time.sleep(0.01)
+        start = time.monotonic()
+        for idx in range(1, num_frames + 1):
+            for writer in writers:
+                writer.feed(frames[idx % len(frames)])
+        write_speed = []
+        for writer in writers:
+            while writer.Q.qsize() > 0 and not writer.stopped:
+                time.sleep(0.005)  # wait_to_finish waits up to 0.5 s longer
+            write_speed.append(writer.write_speed)
+            writer.stop()
+        elapsed = time.monotonic() - start
+    except Exception as e:
+        log.warning(f'{codec} {preset}: encoding failed ({e})')
+        for writer in writers:
+            writer.stopped = True
+        return dict(result, failed=True)
+    finally:
+        sizes = [os.path.getsize(writer.video_path) if os.path.exists(writer.video_path) else 0
+                 for writer in writers]
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if not all(sizes):
+        # ffmpeg could not open the encoder (e.g. h264_nvenc without gpu), the videos stay empty
+        log.warning(f'{codec} {preset}: no video written')
+        return dict(result, failed=True)
+    result.update(encode_fps=num_frames / elapsed,
+                  write_speed_fps=1 / max(max(write_speed), 1e-9),
+                  bytes_per_frame=sum(sizes) / num_cams / (num_frames + 1))
+    result['pixel_rate'] = result['encode_fps'] * width * height * num_cams
+    return result
+
+
+def calibrate(width: int, height: int, fps: float, num_cams: int, codecs: list = None, crf: int = 17,
+              seconds: float = 3, headroom: float = CODEC_HEADROOM, stop_event=None,
+              writer_class=VideoWriterFast) -> list:
+    """
+    Measure all available codecs and presets for a session. Presets are tried fastest first and the slower ones of a
+    codec are skipped once one does not keep up
+    :param seconds: recording time encoded per measurement
+    :param stop_event: threading.Event to abort the calibration
+    :return: list of measure results, with 'sustained' set
+    """
+    frames = make_frames(width, height)
+    num_frames = max(int(fps * seconds), 2 * len(frames))
+    results = []
+    for codec in available_codecs(codecs):
+        for preset in CODEC_PRESETS.get(codec, [None]):
+            if stop_event is not None and stop_event.is_set():
+                return results
+            result = measure(codec, preset, frames, fps, num_cams, num_frames, crf=crf, writer_class=writer_class)
+            result['sustained'] = not result['failed'] and result['encode_fps'] >= fps * headroom
+            results.append(result)
+            if result['failed']:
+                break
+            log.info(f"{codec} {preset}: {result['encode_fps']:.1f} FPS per camera "
+                     f"({'keeps up' if result['sustained'] else 'too slow'})")
+            if not result['sustained']:
+                break
+    return results
+
+
+def profile_key() -> str:
+    return platform.node()
+
+
+def load_profile(path: str = CODEC_PROFILE) -> dict:
+    """calibration results of this machine as {codec: {preset: result}}, presets of None are stored as ''"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f).get(profile_key(), {})
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_profile(results: list, path: str = CODEC_PROFILE) -> dict:
+    """merge results into the profile of this machine, newer results replace older ones of the same preset"""
+    try:
+        with open(path, 'r') as f:
+            profiles = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        profiles = {}
+    profile = profiles.setdefault(profile_key(), {})
+    date = datetime.datetime.now().isoformat(timespec='seconds')
+    for result in results:
+        profile.setdefault(result['codec'], {})[result['preset'] or ''] = dict(result, date=date)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(profiles, f, indent=4)
+    return profile
+
+
+def max_fps(profile: dict, codec: str, preset: [str, None], width: int, height: int, num_cams: int) -> [float, None]:
+    """frame rate per camera the codec is expected to sustain, None if it was not calibrated"""
+    result = profile.get(codec, {}).get(preset or '')
+    if result is None or result['failed']:
+        return None
+    return result['pixel_rate'] / (width * height * num_cams)
+
+
+def quality_rank(codec: str) -> int:
+    """position of a codec in CODEC_QUALITY, codecs not ranked come last"""
+    return CODEC_QUALITY.index(codec) if codec in CODEC_QUALITY else len(CODEC_QUALITY)
+
+
+def recommend(profile: dict, width: int, height: int, fps: float, num_cams: int,
+              headroom: float = CODEC_HEADROOM) -> [tuple, None]:
+    """
+    (codec, preset) for a session: the calibrated codec ranked best in CODEC_QUALITY which keeps up, with its slowest
+    preset that keeps up (better compression at the same crf). None if no calibrated codec keeps up
+    """
+    for codec in sorted(profile, key=quality_rank):
+        presets = [preset or '' for preset in CODEC_PRESETS.get(codec, [None])]
+        sustained = [preset for preset in presets
+                     if (max_fps(profile, codec, preset, width, height, num_cams) or 0) >= fps * headroom]
+        if sustained:
+            return codec, sustained[-1] or None
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find the codecs which keep up with the cameras on this machine')
+    parser.add_argument('--size', type=int, nargs=2, default=(1280, 1024), metavar=('WIDTH', 'HEIGHT'),
+                        help='resolution of the cameras')
+    parser.add_argument('--fps', type=float, default=30, help='frame rate of the cameras')
+    parser.add_argument('--cams', type=int, default=1, help='number of cameras recorded at once')
+    parser.add_argument('--codecs', nargs='+', default=None, help='codecs to test, defaults to codec_to_try')
+    parser.add_argument('--crf', type=int, default=17, help='compression level')
+    parser.add_argument('--seconds', type=float, default=3, help='recording time encoded per codec and preset')
+    parser.add_argument('--writer', default=WRITER_BACKEND, choices=['gear', 'pipe'], help='video writer backend')
+    parser.add_argument('--profile', default=CODEC_PROFILE, help='json file the results are stored in')
+    parser.add_argument('--no-save', action='store_true', help='do not update the profile')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    width, height = args.size
+    results = calibrate(width, height, args.fps, args.cams, codecs=args.codecs, crf=args.crf, seconds=args.seconds,
+                        writer_class=VideoWriterPipe if args.writer == 'pipe' else VideoWriterFast)
+    for result in results:
+        if result['failed']:
+            print(f"{result['codec']:<12} {str(result['preset']):<10} failed")
+        else:
+            print(f"{result['codec']:<12} {str(result['preset']):<10} {result['encode_fps']:8.1f} FPS "
+                  f"{result['bytes_per_frame'] / 1024:8.1f} kB/frame {'ok' if result['sustained'] else 'too slow'}")
+    if args.no_save:
+        profile = {}
+        for result in results:
+            profile.setdefault(result['codec'], {})[result['preset'] or ''] = result
+    else:
+        profile = save_profile(results, args.profile)
+    choice = recommend(profile, width, height, args.fps, args.cams)
+    if choice is None:
+        print(f'No codec keeps up with {args.cams} cameras at {width}x{height} and {args.fps} FPS')
+    else:
+        print(f'Recommended: codec {choice[0]}, preset {choice[1]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Offline conversion of raw recordings (RECORD_RAW) to RGB videos.
+
+Raw recordings store the native Bayer/Mono8 sensor data losslessly as a gray video, together with a
+_meta.json file holding the pixel format of the camera.
+"""
+import argparse
+import json
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from SurgeryViewer.utils.VideoReaderFast import VideoReaderFast
+from SurgeryViewer.utils.VideoWriterFast_gear import VideoWriterFast
+
+RAW_PIXEL_FORMATS = ('Mono8', 'BayerRG8', 'BayerBG8', 'BayerGR8', 'BayerGB8')
+
+# OpenCV names the bayer pattern after the second row, so pylon's BayerRG corresponds to cv2's BayerBG
+BAYER2RGB = {'BayerRG8': cv2.COLOR_BayerBG2RGB,
+             'BayerBG8': cv2.COLOR_BayerRG2RGB,
+             'BayerGR8': cv2.COLOR_BayerGB2RGB,
+             'BayerGB8': cv2.COLOR_BayerGR2RGB}
+
+# offsets of the red and blue pixel in the 2x2 bayer cell (row, col)
+BAYER_OFFSETS = {'BayerRG8': ((0, 0), (1, 1)),
+                 'BayerBG8': ((1, 1), (0, 0)),
+                 'BayerGR8': ((0, 1), (1, 0)),
+                 'BayerGB8': ((1, 0), (0, 1))}
+
+
+def meta_path(video_path: str) -> str:
+    """path of the json file describing a raw recording"""
+    return str(Path(video_path).with_suffix('')) + '_meta.json'
+
+
+def write_raw_meta(video_path: str, pixel_format: str, fps: float):
+    """store the pixel format of a raw recording next to the video"""
+    with open(meta_path(video_path), 'w') as f:
+        json.dump({'pixel_format': pixel_format, 'fps': fps}, f, indent=4)
+
+
+def read_raw_meta(video_path: str) -> dict:
+    with open(meta_path(video_path), 'r') as f:
+        return json.load(f)
+
+
+def bayer_preview(img: np.ndarray, pixel_format: str) -> np.ndarray:
+    """
+    Cheap half resolution RGB image of a bayer frame by picking the pixels of each 2x2 cell, used for the live view.
+    Mono frames are returned unchanged.
+    """
+    if pixel_format not in BAYER_OFFSETS:
+        return img
+    (r_y, r_x), (b_y, b_x) = BAYER_OFFSETS[pixel_format]
+    return np.dstack((img[r_y::2, r_x::2], img[r_y::2, 1 - r_x::2], img[b_y::2, b_x::2]))
+
+
+def demosaic(frame: np.ndarray, pixel_format: str) -> np.ndarray:
+    """convert a single raw frame to RGB"""
+    if frame.ndim == 3:
+        frame = frame[:, :, 0]  # gray videos are decoded with 3 identical channels
+    if pixel_format in BAYER2RGB:
+        return cv2.cvtColor(frame, BAYER2RGB[pixel_format])
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+
+
+def convert_raw_video(video_path: str, out_path: str = None, codec: str = 'libx264', crf: int = 17) -> str:
+    """
+    Demosaic a raw recording into an RGB video
+    :param video_path: raw video
+    :param out_path: output video, defaults to <video>_rgb.mp4
+    :param codec: codec of the output video
+    :param crf: compression level of the output video
+    :return: path of the converted video
+    """
+    meta = read_raw_meta(video_path)
+    pixel_format = meta['pixel_format']
+    if out_path is None:
+        out_path = str(Path(video_path).with_suffix('')) + '_rgb.mp4'
+
+    reader = VideoReaderFast(video_path, transform=lambda f: demosaic(f, pixel_format)).start()
+    writer = VideoWriterFast(out_path, fps=meta['fps'], codec=codec, crf=crf)
+    while reader.more():
+        frame = reader.read()
+        while writer.Q.full():
+            writer.wait_to_finish()  # let the encoder catch up instead of overflowing
+        writer.feed(frame)
+    reader.stop()
+    writer.wait_to_finish()
+    writer.stop()
+    return out_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert raw Bayer/Mono recordings to RGB videos')
+    parser.add_argument('videos', nargs='+', help='raw videos to convert')
+    parser.add_argument('--codec', default='libx264')
+    parser.add_argument('--crf', type=int, default=17)
+    args = parser.parse_args()
+    for video in args.videos:
+        print(f'Converting {video}')
+        print(f'Written {convert_raw_video(video, codec=args.codec, crf=args.crf)}')
@@ -15,5 +15,6 @@ setup(
                       "pypylon == 3.0.1",
                       "vidgear[core]",
                       "pyserial",
-                      "opencv-python"]
+                      "opencv-python"],
+    entry_points={"console_scripts": ["surgeryviewer-record=SurgeryViewer.record_cli:main"]}
 )
@@ -0,0 +1,60 @@
+"""Segment rotation with synthetic cameras and the gear writer must not stall the grabbing threads"""
+import logging
+import time
+from threading import Event
+
+from SurgeryViewer.core.CameraBackend import get_backend
+from SurgeryViewer.core.Recorder import Recorder
+from SurgeryViewer.core.Segments import SegmentedWriter
+
+FPS = 30
+SEGMENT_FRAMES = 45
+MAX_FEED_TIME = 0.05  # s a feed may take, creating WriteGear on the grabbing thread took over 0.15 s
+
+
+def test_rotation_does_not_stall_grabbing(tmp_path, monkeypatch):
+    logging.getLogger().setLevel(logging.ERROR)
+    feed_times = {}  # (camera, frame number) -> s spent in SegmentedWriter.feed
+    preopened = []  # whether the encoder of the next segment existed when a rotation started
+
+    original_feed, original_rotate = SegmentedWriter.feed, SegmentedWriter._rotate
+
+    def feed(self, frame):
+        frame_number = self.frame_count
+        start = time.perf_counter()
+        original_feed(self, frame)
+        feed_times[(self.camera, frame_number)] = time.perf_counter() - start
+
+    def rotate(self):
+        self._next_thread.join()
+        preopened.append(self._next is not None and self._next.stream is not None)
+        original_rotate(self)
+
+    monkeypatch.setattr(SegmentedWriter, 'feed', feed)
+    monkeypatch.setattr(SegmentedWriter, '_rotate', rotate)
+
+    recorder = Recorder(backend=get_backend('synthetic', num_cams=2, width=320, height=256, pixel_format='RGB8'))
+    recorder.live_view = False
+    recorder.writer_backend = 'gear'
+    recorder.codec = 'libx264'
+    recorder.crf = 23
+    recorder.codec_presets = {'libx264': 'ultrafast'}
+    recorder.fps = FPS
+    recorder.segment_minutes = SEGMENT_FRAMES / FPS / 60
+    recorder.segment_gb = None
+    recorder.save_path = str(tmp_path)
+    recorder.scan_cams()
+    recorder.connect_cams()
+
+    stop_event = Event()
+    recorder.run_multi_cam_record(stop_event, filename='rotation')
+    time.sleep(3 * SEGMENT_FRAMES / FPS + 0.5)
+    stop_event.set()
+    recorder.stop_multi_cam_record()
+
+    assert len(preopened) >= 2 * 2  # two rotations per camera
+    assert all(preopened)
+    # no feed, neither the first nor those at the rotations, waits for an encoder to be created
+    assert any(frame_number == 2 * SEGMENT_FRAMES for _, frame_number in feed_times)
+    assert max(feed_times.values()) < MAX_FEED_TIME
+    assert all(camera['skipped'] == 0 for camera in recorder.get_metrics()['cameras'])